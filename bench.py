@@ -0,0 +1,262 @@
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import sys
+import timeit
+from datetime import datetime
+
+from command_line import CommandLine
+from commands.command import Command
+from commands.database_command import DatabaseCommand
+from database import Database
+from output import Output, OUTPUT_BATCH_SIZE, redirect
+from result_cache import RESULT_CACHE_SIZE
+from util import pretty_print_dict, pretty_print_table
+
+'''
+Benchmarks for the shell and database hot paths. Each benchmark sets up whatever it needs,
+hands over a function to time, then cleans up. Results can be saved as JSON and compared
+with an earlier run to catch performance regressions.
+
+Run them with `python bench.py`, or from the shell with the `benchmark` command.
+'''
+
+# Results file used unless another path is given
+BENCH_FILE = 'bench_results.json'
+# Number of times each benchmark is timed. The best round is the one compared.
+BENCH_ROUNDS = 5
+# A benchmark this many times slower than the run it's compared with is a regression
+REGRESSION_THRESHOLD = 1.2
+
+# Benchmark name -> function which sets it up, filled by `benchmark`
+BENCHMARKS = {}
+
+'''
+Registers a benchmark. The function is a generator which sets up the benchmark, yields the
+function to time, then cleans up after itself.
+@param name Name the benchmark is run and saved under
+'''
+def benchmark(name):
+    def register(function):
+        BENCHMARKS[name] = contextlib.contextmanager(function)
+        return function
+
+    return register
+
+'''
+Throws away anything printed while a benchmark runs, so terminal writes aren't timed.
+'''
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, 'w') as devnull:
+        with redirect(Output(stream=devnull, batch_size=OUTPUT_BATCH_SIZE)):
+            yield
+
+'''
+Command which does nothing, for timing the shell's dispatch on its own.
+'''
+class NoopCommand(Command):
+    def __init__(self):
+        super(NoopCommand, self).__init__('noop', 'Does nothing.')
+
+    def __call__(self, cl, args):
+        return 0
+
+@benchmark('database.execute')
+def bench_execute():
+    db = Database('memory')
+    db.execute('CREATE TABLE numbers (value INTEGER, name STRING)')
+    try:
+        yield lambda: db.execute('INSERT INTO numbers VALUES (?, ?)', 1, 'one')
+    finally:
+        db.__del__()
+
+@benchmark('database.add_table_meta')
+def bench_add_table_meta():
+    db = Database('memory')
+    # Table names are unique in the meta tables, so every call needs a new one
+    names = itertools.count()
+    decl = '''CREATE TABLE IF NOT EXISTS t{} (id INTEGER PRIMARY KEY, name VARCHAR(64) UNIQUE NOT NULL,
+        price DECIMAL(10, 2) DEFAULT 0, created TIMESTAMP, CHECK (price >= 0))'''
+    try:
+        yield lambda: db.add_table_meta(decl.format(next(names)))
+    finally:
+        db.__del__()
+
+@benchmark('database.cached_select')
+def bench_cached_select():
+    db = Database('memory', result_cache=RESULT_CACHE_SIZE)
+    db.execute('CREATE TABLE numbers (value INTEGER, name STRING)')
+    db.insert_many('numbers', ((i, 'n{}'.format(i)) for i in range(100)))
+    try:
+        yield lambda: db.execute('SELECT * FROM numbers WHERE value < ?', 50)
+    finally:
+        db.__del__()
+
+@benchmark('command.insert')
+def bench_insert():
+    db = Database('memory')
+    db.execute('CREATE TABLE numbers (value INTEGER, name STRING)')
+    command = DatabaseCommand()
+    cl = CommandLine(db=db)
+    try:
+        yield lambda: command(cl, ['insert', 'numbers', '1', 'one'])
+    finally:
+        cl.__del__()
+
+@benchmark('command.select')
+def bench_select():
+    db = Database('memory')
+    db.execute('CREATE TABLE numbers (value INTEGER, name STRING)')
+    db.insert_many('numbers', ((i, 'n{}'.format(i)) for i in range(100)))
+    command = DatabaseCommand()
+    cl = CommandLine(db=db)
+    try:
+        with quiet():
+            yield lambda: command(cl, ['select', 'numbers'])
+    finally:
+        cl.__del__()
+
+@benchmark('shell.parse_command')
+def bench_parse_command():
+    cl = CommandLine(db=Database('memory'))
+    cl.register_command(NoopCommand())
+    # Going through an alias is the longest way to a command
+    cl.add_alias('nop', 'noop quietly')
+    try:
+        yield lambda: cl.parse_command('nop', ['please'])
+    finally:
+        cl.__del__()
+
+@benchmark('util.pretty_print_dict')
+def bench_pretty_print_dict():
+    values = {'key_{}'.format(i): 'value {}'.format(i) * (i % 4 + 1) for i in range(20)}
+    with quiet():
+        yield lambda: pretty_print_dict(values)
+
+'''
+Times a benchmark. The number of calls per round is picked so a round takes long enough to
+time, then the benchmark is timed that many calls at a time for each round.
+@param name Name of the benchmark
+@param rounds Number of times to time it
+@return Dictionary with the calls per round, and the best and mean microseconds per call
+'''
+def time_benchmark(name, rounds=BENCH_ROUNDS):
+    with BENCHMARKS[name]() as function:
+        timer = timeit.Timer(function)
+        number, _ = timer.autorange()
+        times = timer.repeat(rounds, number)
+
+    best = min(times) / number
+    return {
+        'number': number,
+        'rounds': rounds,
+        'best_us': best * 1e6,
+        'mean_us': sum(times) / len(times) / number * 1e6,
+        'ops_per_sec': 1 / best if best else 0,
+    }
+
+'''
+Runs benchmarks.
+@param names (optional) Names of the benchmarks to run, all of them if not given
+@param rounds Number of times to time each one
+@return Dictionary of benchmark name to its results
+@throws KeyError if a benchmark doesn't exist
+'''
+def run(names=None, rounds=BENCH_ROUNDS):
+    names = names or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise KeyError('Unknown benchmark `{}`. Expected one of: {}'.format(name,
+                ', '.join(BENCHMARKS)))
+
+    return {name: time_benchmark(name, rounds) for name in names}
+
+'''
+Writes results to a JSON file, along with where they came from.
+'''
+def save(results, path=BENCH_FILE):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results,
+        }, f, indent=2)
+
+'''
+Reads results written by `save`.
+@return Dictionary of benchmark name to its results
+'''
+def load(path=BENCH_FILE):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['results']
+
+'''
+Compares results with an earlier run.
+@param results Results of this run
+@param previous Results of the earlier run
+@param threshold Ratio of the times past which a benchmark has regressed
+@return List of (name, earlier best µs, best µs, ratio, regressed) tuples, for benchmarks
+    in both runs
+'''
+def compare(results, previous, threshold=REGRESSION_THRESHOLD):
+    rows = []
+    for name, result in results.items():
+        if name not in previous:
+            continue
+
+        before = previous[name]['best_us']
+        ratio = result['best_us'] / before if before else 1.0
+        rows.append((name, before, result['best_us'], ratio, ratio > threshold))
+
+    return rows
+
+'''
+Prints results as a table, with the change since an earlier run if there is one.
+@param results Results of this run
+@param previous (optional) Results of an earlier run
+@return Number of benchmarks which regressed
+'''
+def report(results, previous=None):
+    changes = {row[0]: row for row in compare(results, previous or {})}
+    rows = []
+    for name, result in results.items():
+        change = changes.get(name)
+        rows.append((name, '{:.0f}'.format(result['ops_per_sec']), '{:.2f}'.format(result['best_us']),
+            '{:.2f}'.format(result['mean_us']),
+            '' if change is None else '{:+.0%}{}'.format(change[3] - 1, ' SLOWER' if change[4] else '')))
+
+    pretty_print_table(rows, ['benchmark', 'ops/sec', 'best µs', 'mean µs', 'change'])
+
+    return sum(1 for change in changes.values() if change[4])
+
+def main(args):
+    if args['list']:
+        for name in BENCHMARKS:
+            print(name)
+        return 0
+
+    previous = load(args['compare']) if args['compare'] else None
+    results = run(args['benchmarks'], args['rounds'])
+    regressions = report(results, previous)
+    save(results, args['output'])
+
+    # A regression fails the run, so it can be used to check changes
+    return 1 if regressions else 0
+
+def arg_parser(args):
+    parser = argparse.ArgumentParser(prog='bench', description='Benchmarks for the shell and database.')
+    parser.add_argument('benchmarks', nargs='*', help='Benchmarks to run, all of them if none are given')
+    parser.add_argument('-r', '--rounds', type=int, default=BENCH_ROUNDS, help='Times to run each benchmark')
+    parser.add_argument('-o', '--output', default=BENCH_FILE, help='File to save the results to')
+    parser.add_argument('-c', '--compare', help='Results file to compare with')
+    parser.add_argument('-l', '--list', action='store_true', help='List the benchmarks')
+
+    return vars(parser.parse_args(args[1:]))
+
+if __name__ == "__main__":
+    sys.exit(main(arg_parser(sys.argv)))
@@ -0,0 +1,104 @@
+import argparse
+import socket
+import sys
+
+'''
+Thin client for a SQLOS server. It only sends lines and prints what comes back, so running
+a command doesn't have to start the shell or open the database.
+
+The protocol is a line of text per command. The server answers with the command's output,
+then a line with `.` and the command's status, e.g. `.0`. Output lines starting with `.`
+have another `.` put in front of them, so they can't be mistaken for the status.
+'''
+
+# Address the server listens on unless another is given. Addresses are either the path of a
+# Unix socket or `host:port`.
+SERVER_ADDRESS = 'sqlos.sock'
+
+'''
+Works out what kind of socket an address is for.
+@param address Path of a Unix socket, or `host:port` for TCP
+@return Tuple of the socket family and the address to connect to or bind
+'''
+def parse_address(address):
+    host, colon, port = address.rpartition(':')
+    if colon and port.isdigit():
+        return socket.AF_INET, (host or 'localhost', int(port))
+
+    return socket.AF_UNIX, address
+
+class Client():
+    '''
+    Connects to a server. Each client is its own session, with its own aliases and
+    transactions.
+    @param address Address of the server
+    @param timeout (optional) Seconds to wait for the server before giving up
+    '''
+    def __init__(self, address=SERVER_ADDRESS, timeout=None):
+        family, target = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(target)
+        self.file = self.sock.makefile('rw', encoding='utf-8', newline='\n')
+
+    '''
+    Runs a command on the server, writing its output as it comes.
+    @param line Command to run, as it would be typed into the shell
+    @param out File to write the output to
+    @return The command's status, 0 if it worked
+    @throws ConnectionError if the server closes the connection, e.g. after `exit`
+    '''
+    def run(self, line, out=sys.stdout):
+        self.file.write(line.replace('\n', ' ') + '\n')
+        self.file.flush()
+
+        for line in self.file:
+            if line.startswith('..'):
+                out.write(line[1:])
+            elif line.startswith('.'):
+                return int(line[1:])
+            else:
+                out.write(line)
+
+        raise ConnectionError('The server closed the connection.')
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+def main(args):
+    try:
+        client = Client(args['address'])
+    except OSError as e:
+        print('Couldn\'t connect to {}: {}'.format(args['address'], e), file=sys.stderr)
+        return 1
+
+    lines = args['command'] or (line.rstrip('\n') for line in sys.stdin)
+    status = 0
+    try:
+        for line in lines:
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+
+            try:
+                status = client.run(line)
+            except ConnectionError:
+                # `exit` closes the session
+                break
+            if status:
+                break
+    finally:
+        client.close()
+
+    return status
+
+def arg_parser(args):
+    parser = argparse.ArgumentParser(prog='sqlos-client', description='Runs commands on a SQLOS '
+        'server, from -c or one per line on stdin.')
+    parser.add_argument('-c', '--command', action='append', help='Command to run, can be given more than once')
+    parser.add_argument('-a', '--address', default=SERVER_ADDRESS, help='Unix socket path or host:port of the server')
+
+    return vars(parser.parse_args(args[1:]))
+
+if __name__ == "__main__":
+    sys.exit(main(arg_parser(sys.argv)))
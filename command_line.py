@@ -1,17 +1,83 @@
+import asyncio
+import concurrent.futures
 import inspect
+import itertools
+import operator
 from importlib import import_module
-import pkgutil
+from concurrent.futures import ThreadPoolExecutor, wait
+import signal
+import sys
+import threading
+import time
+import transfer
 
 from commands.command import Command
-from util import pretty_print, print_error
+from database import Database
+from output import (Cancellation, Cancelled, Output, buffered, cancellable, capture, emit,
+    redirect)
+from plugins import LazyCommand, find_commands
+from util import pretty_print, pretty_print_table, print_error
+
+# Number of background jobs which can run at once
+JOB_WORKERS = 4
+# Number of rows `head` passes on when it isn't told
+HEAD_ROWS = 10
+
+# Comparisons `filter` understands
+FILTER_OPERATORS = {
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    # Contains, ignoring case
+    '~': lambda cell, value: str(value).lower() in str(cell).lower(),
+}
 
 class ExitException(Exception):
     def __init__(self):
         super(__class__, self).__init__(self, "Exited the command line.")
 
+'''
+A command running in the background. Anything the command prints is kept in the job's
+buffer until the user asks for it with `fg`.
+'''
+class Job():
+    def __init__(self, job_id, line):
+        self.id = job_id
+        self.line = line
+        self.status = 'Running'
+        self.result = None
+        self.reported = False
+        self.future = None
+        self.output = Output(keep=True)
+
+    def done(self):
+        return self.future.done()
+
+'''
+The shell as a background job sees it. The job keeps the database it was started on, even if
+the shell switches to another one while it runs. Everything else is looked up on the shell.
+'''
+class JobShell():
+    '''
+    @param cl The shell
+    @param db Database the job was started on
+    '''
+    def __init__(self, cl, db):
+        self.cl = cl
+        self.db = db
+
+    def __getattr__(self, name):
+        return getattr(self.cl, name)
+
 class CommandLine():
     def __init__(self, db, **kwargs):
         self.coms = {}
+        # Commands found by `init_commands`, by name, including ones not loaded yet
+        self.plugins = {}
         self.builtin = {}
         self.aliases = {
             # Database aliases
@@ -25,6 +91,11 @@ class CommandLine():
             'dbu': 'database update',
             'dbd': 'database dump',
             }
+        # Aliases split into words once, so they don't need splitting on every use
+        self.alias_tokens = {name: tuple(value.split(' ')) for name, value in self.aliases.items()}
+        # Every name the shell understands, mapped to the command to run and any arguments
+        # which come before the user's. Kept up to date as commands and aliases change.
+        self.dispatch = {}
         self.spec = {}
         self.todo = [
             'Implement colour shell',
@@ -35,7 +106,6 @@ class CommandLine():
             'Implement a `clear` builtin',
             'Implement persistent settings (shelve and/or pickle?)',
             'Cleanup documentation on `on_run`, which has been replaced with `__call__`',
-            'Implement command output passing',
             'Implement bash-like command structure',
             'Replicate database create multi-line input in database execute (maybe all)',
             'Add security to anything that bypasses SQL escaping (check input for specific tags',
@@ -45,16 +115,32 @@ class CommandLine():
             'Implement users and authentication',
             'Move all print statements to standard out',
             'Change util.py to return values for commands to process into stdout',
-            'Implement stdout as a class',
             'Implement exception handler in database'
         ]
         
         self.db = db
+        # Every database opened by `use_database`, by path
+        self.databases = {db.path: db}
 
         for name, value in kwargs.items():
             self.spec[name] = value
         
-        self.stdout = ''
+        # Column names and rows piped into the command that's running, if there are any
+        self.pipe = None
+
+        # Messages from the shell itself, shown after the current command
+        self.stdout = Output()
+
+        # Background jobs, by job number
+        self.jobs = {}
+        self.next_job = 1
+        self.executor = None
+
+        # State for `run_loop`
+        self.command_executor = None
+        self.running = None
+        self.pending_input = None
+        self.main_task = None
 
         self.init_builtins()
         self.init_commands()
@@ -73,82 +159,480 @@ r'''   _____   ____   _       ____    _____
 ''' + '''\t\tSQL SHELL\nCreated by: Giles Johnson\nCopyright: 2019'''
         
     def init_commands(self):
-        '''Initialise commands in the commands module'''
-        modules = pkgutil.iter_modules(path=['commands'])
-        for loader, mod_name, ispkg in modules:
-            module = import_module('commands.'+mod_name)
-            
-            for x in dir(module):
-                obj = getattr(module, x)
+        '''Initialise commands in the commands module. Modules are imported the first time
+        one of their commands is used.'''
+        for module, commands in find_commands().items():
+            if commands is None:
+                # Couldn't work out the module's commands without running it
+                self.import_commands(module)
+                continue
+
+            for name, class_name in commands.items():
+                command = LazyCommand(name, module, class_name)
+                self.plugins[name] = command
+                self.register_command(command)
+
+    '''
+    Imports a module straight away and registers every command in it.
+    @param module Name of the module
+    '''
+    def import_commands(self, module):
+        start = time.perf_counter()
+        module = import_module(module)
             
-                if inspect.isclass(obj) and issubclass(obj, Command) and obj is not Command:
-                    # `obj` is a command! So set everything up
-                    instance = obj()
-                    self.coms[instance.name] = instance
+        for x in dir(module):
+            obj = getattr(module, x)
+        
+            # Commands imported from other modules are registered by their own module
+            if inspect.isclass(obj) and issubclass(obj, Command) and obj is not Command \
+                    and obj.__module__ == module.__name__:
+                # `obj` is a command! So set everything up
+                plugin = LazyCommand(None, module.__name__, x)
+                plugin.name = plugin.load().name
+                # The import is part of the load time
+                plugin.load_time = time.perf_counter() - start
+                self.plugins[plugin.name] = plugin
+                self.register_command(plugin.command)
     
     def init_builtins(self):
         '''Initialise built-in commands!'''
-        self.builtin['help'] = HelpBuiltin()
-        self.builtin['exit'] = ExitBuiltin()
-        self.builtin['alias'] = AliasBuiltin()
-        self.builtin['todo'] = TodoBuiltin()
-        self.builtin['man'] = ManBuiltin()
-        self.builtin['pretty_print'] = PrettyPrintBuiltin()
+        self.register_command(HelpBuiltin(), builtin=True)
+        self.register_command(ExitBuiltin(), builtin=True)
+        self.register_command(AliasBuiltin(), builtin=True)
+        self.register_command(TodoBuiltin(), builtin=True)
+        self.register_command(ManBuiltin(), builtin=True)
+        self.register_command(PrettyPrintBuiltin(), builtin=True)
+        self.register_command(JobsBuiltin(), builtin=True)
+        self.register_command(FgBuiltin(), builtin=True)
+        self.register_command(PluginsBuiltin(), builtin=True)
+        self.register_command(FilterBuiltin(), builtin=True)
+        self.register_command(HeadBuiltin(), builtin=True)
+        self.register_command(SortBuiltin(), builtin=True)
+        self.register_command(CountBuiltin(), builtin=True)
+        self.register_command(ExportBuiltin(), builtin=True)
 
-    def parse_command(self, com, args):
-        all_coms = self.get_all()
-        # Brilliant solution ahead!
-        # This solution fixes the alias problem
-        # First, instead of executing the command immediately (like an idiot)
-        # we need to separate the commands from the alias strings
-        command = all_coms[com]
-        
-        # Next, we need to check if the command is a string
-        if type(command) == str:
-            # Now that we know we're working on a string...
-            # Obviously, we need to parse it down into a command!
-            # Same as before...
-            # Start by splitting the string into a list
-            com_list = command.split(' ')
-
-            # Next, we take the first index which is the command name
-            com_name = com_list[0]
-            
-            # The rest of that list becomes arguments to be passed!
-            com_args = com_list[1:]
+    '''
+    Adds a command or builtin to the shell. A command with the same name replaces the old one,
+    unless an alias is using the name.
+    @param command The command to add
+    @param builtin Whether the command is a builtin
+    '''
+    def register_command(self, command, builtin=False):
+        if builtin:
+            self.builtin[command.name] = command
+        else:
+            self.coms[command.name] = command
 
-            # Now, we put it all together
-            # Because it's an alias, there should be other args, so...
-            command = all_coms[com_name]
-            
-            # Interesting error here... `args` is passed in from the parser
-            # not the alias. Because of this, you actually have to work backwards
-            com_args.extend(args) # First, put all the args together in the correct order
-            args = com_args # Finally, move `com_args` into `args` so the order is correct
+        if command.name not in self.aliases:
+            self.dispatch[command.name] = (command, ())
+
+        # Aliases might point at the new command
+        self.resolve_aliases()
+
+    '''
+    Adds an alias, replacing any alias with the same name.
+    @param name Name of the alias
+    @param value Command the alias runs, with any arguments
+    @throws ValueError if the alias would end up running itself
+    '''
+    def add_alias(self, name, value):
+        old = self.alias_tokens.get(name)
+        self.alias_tokens[name] = tuple(value.split(' '))
+
+        try:
+            self.dispatch[name] = self.resolve_alias(name)
+        except ValueError as e:
+            if old is None:
+                del self.alias_tokens[name]
+            else:
+                self.alias_tokens[name] = old
+            raise e
+
+        self.aliases[name] = value
+        self.resolve_aliases()
+
+    '''
+    Removes an alias. If the alias was hiding a command or builtin, the command can be used
+    again.
+    @param name Name of the alias
+    '''
+    def remove_alias(self, name):
+        if name not in self.aliases:
+            return
+
+        del self.aliases[name]
+        del self.alias_tokens[name]
+        del self.dispatch[name]
+
+        command = self.coms.get(name) or self.builtin.get(name)
+        if command is not None:
+            self.dispatch[name] = (command, ())
+
+        self.resolve_aliases()
+
+    '''
+    Follows an alias, and any aliases it uses, down to the command it runs. Like bash, an
+    alias which uses its own name (e.g. `alias select select *`) runs the real command.
+    @param name Name of the alias
+    @return Tuple of the command, or None if there's no such command, and the arguments
+        which come before the user's
+    @throws ValueError if the aliases go round in a loop
+    '''
+    def resolve_alias(self, name):
+        seen = set()
+        args = ()
+        while name in self.alias_tokens and name not in seen:
+            seen.add(name)
+            tokens = self.alias_tokens[name]
+            name = tokens[0]
+            args = tokens[1:] + args
+
+        command = self.coms.get(name) or self.builtin.get(name)
+        if command is None and name in seen:
+            raise ValueError('Alias `{}` runs itself.'.format(name))
+
+        return command, args
+
+    def resolve_aliases(self):
+        for name in self.alias_tokens:
+            self.dispatch[name] = self.resolve_alias(name)
+
+    def parse_command(self, com, args):
+        command, args = self.resolve_command(com, args)
             
         # Arguments are passed in as an array of strings
         # Commands must properly handle arguments
-        command(self, args)
+        return command(self, args)
+
+    '''
+    Finds the command to run for a command name, expanding aliases.
+    @param com Name of the command or alias
+    @param args Arguments given to the command
+    @return Tuple of the command and the arguments to pass to it
+    '''
+    def resolve_command(self, com, args):
+        # Aliases are already worked out, so this is just a lookup
+        command, prefix = self.dispatch[com]
+        if isinstance(command, LazyCommand):
+            # First use, swap in the real command everywhere
+            self.register_command(command.load())
+            command, prefix = self.dispatch[com]
+        if command is None:
+            raise ValueError('`{}` is an alias for `{}`, which is not a command.'.format(com,
+                self.aliases[com]))
+
+        if prefix:
+            # The alias's arguments come before the user's
+            args = list(prefix) + list(args)
+
+        return command, args
     
     def loop(self):
         print(self.welcome_msg)
+        asyncio.run(self.run_loop())
+
+    '''
+    The shell's main loop. Input is read on a separate thread and commands run on the
+    command thread, so the event loop is always free to handle Ctrl-C. Pressing Ctrl-C
+    while a command is running interrupts the command's database query instead of
+    closing the shell.
+    '''
+    async def run_loop(self):
+        loop = asyncio.get_running_loop()
+        self.main_task = asyncio.current_task()
+        try:
+            loop.add_signal_handler(signal.SIGINT, self.interrupt)
+        except NotImplementedError:
+            # No signal handlers on this platform, Ctrl-C closes the shell like it used to
+            pass
+
         while(True):
-            all_coms = self.get_all()
-            user_in = input("> ")
+            try:
+                user_in = await self.read_input("> ")
+            except asyncio.CancelledError:
+                # Ctrl-C at the prompt just gives a fresh prompt
+                print()
+                continue
+            except EOFError:
+                raise ExitException()
+
+            # A trailing `&` runs the command in the background
+            background = user_in.rstrip().endswith('&')
+            if background:
+                user_in = user_in.rstrip()[:-1].rstrip()
             
-            # Separate user input into the command and arguments
-            com = user_in.split(' ')[0].lower()
-            args = user_in.split(' ')[1:]
-            if com in all_coms:
+            # Separate user input into the commands in the pipeline and their arguments
+            stages = self.split_pipeline(user_in)
+            unknown = [com for com, args in stages if com not in self.dispatch]
+            if not unknown:
                 try:
-                    self.parse_command(com, args)
+                    if background and len(stages) > 1:
+                        print('Pipelines can\'t run in the background.')
+                    elif background:
+                        self.start_job(user_in, *stages[0])
+                    elif len(stages) > 1:
+                        self.running = asyncio.ensure_future(self.run_threaded(self.run_pipeline, stages))
+                        await self.running
+                    else:
+                        self.running = asyncio.ensure_future(self.run_command(*stages[0]))
+                        await self.running
+                    self.report_jobs()
                     self.flush_stdout()
+                except asyncio.CancelledError:
+                    print('Interrupted.')
                 except (ExitException, KeyboardInterrupt) as e:
                     raise e
                 except Exception as e:
                     print_error(type(e).__name__, e)
+                finally:
+                    self.running = None
             else:
-                self.append_stdout('{} is not a command or alias.'.format(com))
+                self.append_stdout('{} is not a command or alias.'.format(unknown[0]))
+                self.flush_stdout()
+
+    '''
+    Runs commands from a script, one per line, without the interactive shell. Blank lines
+    and lines starting with `#` are skipped. Commands which read their own input, like
+    `database create`, read it from the script. The script stops at the first command
+    which fails or returns a non-zero status.
+    @param stream File object to read the script from
+    @param transaction Whether to run the whole script in one transaction, which is
+        committed if the script succeeds and rolled back if it fails. The script can
+        still open its own transaction, which becomes a savepoint inside this one.
+    @return Status of the last command run, 0 if everything worked
+    '''
+    def run_script(self, stream, transaction=True):
+        db = self.db
+        stdin = sys.stdin
+        sys.stdin = stream
+
+        status = 0
+        try:
+            if transaction:
+                db.begin(nested=True)
+
+            # Output is written in batches rather than line by line
+            with buffered():
+                for line in iter(stream.readline, ''):
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+
+                    stages = self.split_pipeline(line)
+                    unknown = [com for com, args in stages if com not in self.dispatch]
+                    if unknown:
+                        print_error('CommandNotFound', '{} is not a command or alias.'.format(unknown[0]))
+                        status = 127
+                        break
+
+                    try:
+                        status = self.run_pipeline(stages) or 0
+                    except ExitException:
+                        break
+                    except Exception as e:
+                        print_error(type(e).__name__, e)
+                        status = 1
+
+                    if status:
+                        break
+        finally:
+            sys.stdin = stdin
+
+            if transaction:
+                db.end_nested(not status)
+
+        return status
+
+    '''
+    Runs a command without blocking the event loop. Commands which are coroutines are
+    awaited, anything else is run on the command thread.
+    @param com Name of the command or alias
+    @param args Arguments given to the command
+    @return Whatever the command returns
+    '''
+    async def run_command(self, com, args):
+        command, args = self.resolve_command(com, args)
+
+        if inspect.iscoroutinefunction(command.__call__):
+            return await command(self, args)
+
+        return await self.run_threaded(command, self, args)
+
+    '''
+    Runs a function on the command thread, with its output written in batches rather than
+    line by line. If this is cancelled, e.g. by Ctrl-C, the function is cancelled as well
+    and stops the next time it prints or asks for input. This waits for it to stop, so it's
+    never left running alongside the next command.
+    @param function Function to run
+    @param args Arguments to pass to the function
+    @return Whatever the function returns
+    @see output.Cancellation
+    '''
+    async def run_threaded(self, function, *args):
+        if self.command_executor is None:
+            # One thread, so commands still run one after the other
+            self.command_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlos-command')
+
+        # At the shell's prompt, commands read input the same way the shell does, so they
+        # can stop waiting for it
+        cancellation = Cancellation(self.read_prompt if self.main_task is not None else None)
+        future = asyncio.get_running_loop().run_in_executor(self.command_executor,
+            self.run_buffered, cancellation, function, *args)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError as e:
+            cancellation.cancel()
+            await asyncio.wait([future])
+            raise e
+
+    def run_buffered(self, cancellation, function, *args):
+        with cancellable(cancellation), buffered():
+            try:
+                return function(*args)
+            except Cancelled:
+                # The shell has already moved on
+                return None
+
+    '''
+    Splits a line into the commands of a pipeline, e.g. `dbs events | head 10`. Commands
+    are separated by a `|` on its own.
+    @param line The line the user typed
+    @return List of tuples of the command name and its arguments
+    '''
+    def split_pipeline(self, line):
+        stages = [[]]
+        for word in line.split(' '):
+            if word == '|':
+                stages.append([])
+            else:
+                stages[-1].append(word)
+
+        pipeline = []
+        for words in stages:
+            # Spaces around the `|` leave empty words behind
+            while len(words) > 1 and words[0] == '':
+                words.pop(0)
+            while len(words) > 1 and words[-1] == '':
+                words.pop()
+            pipeline.append((words[0].lower() if words else '', words[1:]))
+
+        return pipeline
+
+    '''
+    Runs a pipeline, passing each command's output on to the next one. Rows are passed on
+    as they're read, so nothing is read until the last command asks for it, and rows the
+    last command doesn't ask for are never read at all.
+    @param stages List of tuples of the command name and its arguments
+    @return Status of the last command
+    @see split_pipeline
+    '''
+    def run_pipeline(self, stages):
+        if len(stages) == 1:
+            return self.parse_command(*stages[0])
+
+        outputs = []
+        try:
+            for com, args in stages[:-1]:
+                output = self.capture_command(com, args)
+                outputs.append(output)
+                self.pipe = output.piped()
+
+            return self.parse_command(*stages[-1])
+        finally:
+            self.pipe = None
+
+            # Stop anything that hasn't been read, like a query part way through
+            for output in outputs:
+                if hasattr(output.rows, 'close'):
+                    output.rows.close()
+
+    '''
+    Runs a command and keeps its output instead of printing it, so it can be passed on to
+    another command.
+    @param com Name of the command or alias
+    @param args Arguments given to the command
+    @return The command's output. If the command emitted rows, they're in its `rows` and
+        `columns` and haven't been read yet.
+    @see output.emit
+    '''
+    def capture_command(self, com, args):
+        with capture(keep_rows=True) as output:
+            self.parse_command(com, args)
+
+        return output
+
+    '''
+    Reads a line of input on a separate thread. If the read is cancelled, the thread carries
+    on waiting and the next call picks up its line, so no input is lost. Writes waiting to
+    be committed automatically are committed while the user is still typing.
+    @param prompt Prompt to show
+    @return The line the user typed
+    '''
+    async def read_input(self, prompt):
+        if self.pending_input is None:
+            self.pending_input = concurrent.futures.Future()
+            threading.Thread(target=self.input_thread, args=(prompt, self.pending_input),
+                name='sqlos-input', daemon=True).start()
+        else:
+            # Still waiting on the last read, so show the prompt again
+            sys.stdout.write(prompt)
+            sys.stdout.flush()
+
+        waiting = asyncio.wrap_future(self.pending_input)
+        while True:
+            try:
+                line = await asyncio.wait_for(asyncio.shield(waiting), self.db.autocommit_due())
+                break
+            except asyncio.TimeoutError:
+                # Writes made before the prompt are old enough to commit
+                await self.run_threaded(self.db.check_autocommit)
+        self.pending_input = None
+
+        return line
+
+    '''
+    Reads a line of input for a command, on the command thread. The line is read the same
+    way as `read_input` reads it, so if the command is cancelled while it waits, whatever the
+    user types next goes to the shell's prompt instead.
+    @param prompt Prompt to show
+    @param cancellation The command's cancellation
+    @return The line the user typed
+    @throws output.Cancelled if the command is cancelled while waiting
+    @see output.ask
+    '''
+    def read_prompt(self, prompt, cancellation):
+        # Everything the command printed has to be out before the prompt
+        sys.stdout.flush()
+        if self.pending_input is None:
+            self.pending_input = concurrent.futures.Future()
+            threading.Thread(target=self.input_thread, args=(prompt, self.pending_input),
+                name='sqlos-input', daemon=True).start()
+        else:
+            sys.stdout.write(prompt)
+            sys.stdout.flush()
+
+        wait([self.pending_input, cancellation.future], return_when=concurrent.futures.FIRST_COMPLETED)
+        cancellation.check()
+
+        line, self.pending_input = self.pending_input, None
+        return line.result()
+
+    def input_thread(self, prompt, future):
+        try:
+            future.set_result(input(prompt))
+        except BaseException as e:
+            future.set_exception(e)
+
+    '''
+    Handles Ctrl-C. A running command has its database query interrupted and is abandoned,
+    otherwise the wait for input is cancelled.
+    '''
+    def interrupt(self):
+        if self.running is not None:
+            self.db.interrupt()
+            self.running.cancel()
+        elif self.main_task is not None:
+            self.main_task.cancel()
     
     '''
     Concatenate builtins, aliases, and commands into one dictionary for parsing.
@@ -174,15 +658,93 @@ r'''   _____   ____   _       ____    _____
 
         return coms
     
+    '''
+    Switches the shell to another database file. Each file is only opened once, switching
+    back to a database that's already open reuses it as it was left. New databases get the
+    same storage settings as the current one, and a read pool of their own on the new file
+    the same size as the current one's.
+    @param path Path of the database file
+    @return The database now in use
+    '''
+    def use_database(self, path):
+        if path not in self.databases:
+            self.databases[path] = Database(path=path, pool_size=self.db.pool.size,
+                **self.db.pragmas)
+
+        self.db = self.databases[path]
+
+        return self.db
+
+    '''
+    Runs a command as a background job. Only commands which say they're read-only can run
+    in the background. Their database reads, including looking up tables and the log, go
+    through the database's read connections, so they don't get in the way of the shell.
+    Each job gets its own instance of the command, so it doesn't share any state with the
+    shell's, or with other jobs running the same command.
+    @param line The command as the user typed it
+    @param com Name of the command or alias
+    @param args Arguments given to the command
+    @return The new job, or None if the command can't run in the background
+    '''
+    def start_job(self, line, com, args):
+        command, args = self.resolve_command(com, args)
+        if not isinstance(command, Command) or not command.read_only(args):
+            print('`{}` can\'t run in the background, only read-only commands can.'.format(line))
+            return None
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='sqlos-job')
+
+        job = Job(self.next_job, line)
+        self.next_job += 1
+        self.jobs[job.id] = job
+        job.future = self.executor.submit(self.run_job, job, type(command)(), args,
+            JobShell(self, self.db))
+
+        print('[{}] {}'.format(job.id, line))
+
+        return job
+
+    '''
+    Runs a job's command. This is run on one of the job threads.
+    '''
+    def run_job(self, job, command, args, shell):
+        # The job's output is kept until `fg`
+        with redirect(job.output):
+            try:
+                with shell.db.reading():
+                    job.result = command(shell, args)
+                job.status = 'Done'
+            except Exception as e:
+                job.status = 'Failed'
+                print_error(type(e).__name__, e)
+
+    '''
+    Prints a line for each job which has finished since the last time, like bash does.
+    '''
+    def report_jobs(self):
+        for job in self.jobs.values():
+            if job.done() and not job.reported:
+                job.reported = True
+                print('[{}] {}\t{}'.format(job.id, job.status, job.line))
+
     def flush_stdout(self):
-        print(self.stdout)
-        self.stdout = ''
+        # A blank line after every command
+        self.stdout.write('\n')
+        self.stdout.flush()
     
     def append_stdout(self, msg):
-        self.stdout += ' ' + msg
+        self.stdout.write(msg + '\n')
     
     def __del__(self):
-        self.db.__del__()
+        # Jobs have to finish before their databases are closed
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+        if self.command_executor is not None:
+            self.command_executor.shutdown()
+
+        for db in self.databases.values():
+            db.__del__()
 
 class Builtin():
     '''
@@ -204,6 +766,8 @@ class Builtin():
     Function to be run when a command is invoked. This function is required to be declared
     by child functions. If it's not, it will raise an error.
     The *args parameter is also required to have the command line passed as the first argument.
+    This function may also be a coroutine, in which case the shell awaits it instead of
+    running it on the command thread.
     @param cl Command line interface, for access to special variables.
     @param args Arguments to be passed to the command (dict)
     '''
@@ -246,13 +810,16 @@ class AliasBuiltin(Builtin):
             pretty_print(cl.aliases)
             return 0
         elif len(args) == 1:
-            if args[0] in cl.aliases:
-                del cl.aliases[args[0]]
+            cl.remove_alias(args[0])
             return 0
         
         a_name = args[0]
         a_com = ' '.join([i for i in args[1:]])
-        cl.aliases[a_name] = a_com
+        try:
+            cl.add_alias(a_name, a_com)
+        except ValueError as e:
+            print(e)
+            return 1
 
         return 0
 
@@ -300,4 +867,209 @@ class PrettyPrintBuiltin(Builtin):
     def __call__(self, cl, args):
         pretty_print(args)
 
-        return 0
\ No newline at end of file
+        return 0
+
+class JobsBuiltin(Builtin):
+    def __init__(self):
+        super(JobsBuiltin, self).__init__('jobs', 'Lists background jobs')
+
+    def __call__(self, cl, args):
+        for job in cl.jobs.values():
+            print('[{}] {}\t{}'.format(job.id, job.status, job.line))
+
+        return 0
+
+class FgBuiltin(Builtin):
+    def __init__(self):
+        super(FgBuiltin, self).__init__('fg', 'Waits for a background job and shows its output')
+
+    def __call__(self, cl, args):
+        if len(cl.jobs) == 0:
+            print('No jobs.')
+            return 1
+
+        # Default to the most recent job
+        job_id = int(args[0]) if len(args) > 0 else max(cl.jobs)
+        if job_id not in cl.jobs:
+            print('No job {}.'.format(job_id))
+            return 1
+
+        job = cl.jobs[job_id]
+
+        # Show the output as it comes in until the job is finished
+        while True:
+            finished = job.done()
+            sys.stdout.write(job.output.read())
+            if finished:
+                break
+
+            # Give the job a moment to finish or write some more
+            wait([job.future], timeout=0.1)
+        sys.stdout.flush()
+
+        del cl.jobs[job_id]
+
+        return job.result
+
+class PluginsBuiltin(Builtin):
+    def __init__(self):
+        super(PluginsBuiltin, self).__init__('plugins', 'Lists commands and how long they took to load')
+
+    def __call__(self, cl, args):
+        rows = []
+        for name, plugin in sorted(cl.plugins.items()):
+            if plugin.load_time is None:
+                loaded = 'not loaded'
+            else:
+                loaded = '{:.1f} ms'.format(plugin.load_time * 1000)
+            rows.append((name, plugin.module, loaded))
+
+        pretty_print_table(rows, headers=['command', 'module', 'import time'])
+
+        return 0
+
+'''
+Builtin which works on the rows piped into it, e.g. `dbs events | head 10`. Text piped in from
+a command which prints, rather than emitting rows, comes in as rows of one line each.
+'''
+class PipeBuiltin(Builtin):
+    def __call__(self, cl, args):
+        if cl.pipe is None:
+            print('`{0}` works on the output of another command, e.g. `dbs events | {0}`.'.format(self.name))
+            return 1
+
+        columns, rows = cl.pipe
+
+        return self.on_rows(cl, args, columns, rows)
+
+    '''
+    Works on the rows piped into the builtin. Required to be implemented by child classes.
+    @param cl Command line interface
+    @param args Arguments passed to the builtin
+    @param columns Names of the columns, None for lines of text
+    @param rows Iterable of rows, read as they're needed
+    @return Status of the builtin
+    '''
+    def on_rows(self, cl, args, columns, rows):
+        raise NotImplementedError('This function is required to be implemented by child classes')
+
+    '''
+    Finds a column by name.
+    @return Index of the column, or None if there is no such column
+    '''
+    def column_index(self, columns, name):
+        if columns is None or name not in columns:
+            print('No column `{}`. Columns: {}'.format(name, ', '.join(columns or [])))
+            return None
+
+        return columns.index(name)
+
+class FilterBuiltin(PipeBuiltin):
+    def __init__(self):
+        super(FilterBuiltin, self).__init__('filter', 'Passes on rows matching a condition, e.g. `filter age > 30`')
+
+    def on_rows(self, cl, args, columns, rows):
+        # Lines of text are matched on what they contain, like grep
+        if columns is None:
+            text = ' '.join(args).lower()
+            emit((row for row in rows if text in str(row[0]).lower()))
+            return 0
+
+        if len(args) < 3 or args[1] not in FILTER_OPERATORS:
+            print('Usage: filter <column> <{}> <value>'.format('|'.join(FILTER_OPERATORS)))
+            return -1
+
+        index = self.column_index(columns, args[0])
+        if index is None:
+            return 1
+
+        compare = FILTER_OPERATORS[args[1]]
+        value = ' '.join(args[2:])
+
+        def matches(row):
+            cell = row[index]
+            # Like SQL, NULL never matches
+            if cell is None:
+                return False
+
+            # Compare numbers as numbers and everything else as text
+            if isinstance(cell, (int, float)):
+                try:
+                    return compare(cell, float(value))
+                except ValueError:
+                    pass
+
+            return compare(str(cell), value)
+
+        emit(filter(matches, rows), columns)
+
+        return 0
+
+class HeadBuiltin(PipeBuiltin):
+    def __init__(self):
+        super(HeadBuiltin, self).__init__('head', 'Passes on the first rows, `head [count]`')
+
+    def on_rows(self, cl, args, columns, rows):
+        count = int(args[0]) if len(args) > 0 else HEAD_ROWS
+
+        # Only the rows passed on are ever read
+        emit(itertools.islice(rows, count), columns)
+
+        return 0
+
+class SortBuiltin(PipeBuiltin):
+    def __init__(self):
+        super(SortBuiltin, self).__init__('sort', 'Sorts rows, `sort [column] [desc]`')
+
+    def on_rows(self, cl, args, columns, rows):
+        reverse = len(args) > 0 and args[-1].lower() == 'desc'
+        if reverse:
+            args = args[:-1]
+
+        index = 0
+        if len(args) > 0:
+            index = self.column_index(columns, args[0])
+            if index is None:
+                return 1
+
+        # NULLs can't be compared, they go last either way
+        rows = list(rows)
+        ordered = sorted((row for row in rows if row[index] is not None),
+            key=operator.itemgetter(index), reverse=reverse)
+        ordered.extend(row for row in rows if row[index] is None)
+
+        emit(ordered, columns)
+
+        return 0
+
+class CountBuiltin(PipeBuiltin):
+    def __init__(self):
+        super(CountBuiltin, self).__init__('count', 'Counts rows')
+
+    def on_rows(self, cl, args, columns, rows):
+        count = sum(1 for row in rows)
+        emit([(count,)], ['count'])
+
+        return 0
+
+class ExportBuiltin(PipeBuiltin):
+    def __init__(self):
+        super(ExportBuiltin, self).__init__('export', 'Writes rows to a file, `export <path> [--format csv|jsonl] [--gzip]`')
+
+    def on_rows(self, cl, args, columns, rows):
+        if len(args) < 1:
+            print('Usage: export <path> [--format csv|jsonl] [--gzip]')
+            return -1
+
+        path = args[0]
+        try:
+            fmt, compressed = transfer.choose_format(path, args[1:])
+        except ValueError as e:
+            print(e)
+            return 1
+        with transfer.open_file(path, 'w', compressed) as f:
+            count = transfer.write_rows(f, rows, columns or ['line'], fmt)
+
+        print('Exported {} rows to {}'.format(count, path))
+
+        return 0
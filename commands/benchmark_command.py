@@ -0,0 +1,55 @@
+from commands.command import Command
+
+import bench
+
+'''
+Runs the benchmarks in `bench` from the shell. The benchmarks make their own in-memory
+databases, so the shell's database isn't touched.
+Usage:
+benchmark [names...] [--rounds N] [--save path] [--compare path]
+benchmark list
+'''
+class BenchmarkCommand(Command):
+    def __init__(self, **kwargs):
+        super(BenchmarkCommand, self).__init__('benchmark', 'Times the shell and database hot paths.', man_page_entry='''IMPLEMENT ME''')
+
+    def __call__(self, cl, args):
+        if len(args) > 0 and args[0] == 'list':
+            for name in bench.BENCHMARKS:
+                print(name)
+            return 0
+
+        '''
+        Arguments:
+        --rounds N -> Times to run each benchmark
+        --save path -> Save the results as JSON
+        --compare path -> Compare with results saved by an earlier run
+        '''
+        options = {'--rounds': bench.BENCH_ROUNDS, '--save': None, '--compare': None}
+        names = []
+        args = iter(args)
+        for arg in args:
+            if arg in options:
+                options[arg] = next(args, None)
+                if options[arg] is None:
+                    # Display help message here
+                    return -1
+            else:
+                names.append(arg)
+
+        try:
+            previous = bench.load(options['--compare']) if options['--compare'] else None
+            results = bench.run(names, int(options['--rounds']))
+        except (KeyError, OSError, ValueError) as e:
+            # KeyError quotes its message
+            print(e.args[0] if isinstance(e, KeyError) else e)
+            return 1
+
+        regressions = bench.report(results, previous)
+        if options['--save']:
+            bench.save(results, options['--save'])
+
+        return 1 if regressions else 0
+
+    def on_help(self):
+        print(self.desc)
@@ -60,9 +60,21 @@ class Command():
     function is similar to the `Builtin` commands' on_run, complete with the same
     arguments. If the implementation does not follow this style, there is a chance
     the shell will not execute the command correctly and likely will crash.
+    Commands may implement `__call__` as a coroutine, which the shell will await. Otherwise
+    the shell runs the command on a separate thread.
     @param cl Shell the command is running from
     @param args Arguments passed to the command 
     @see command_line.Builtin
     '''
     def on_run(self, cl, args):
-        raise NotImplementedError('Abstract function `on_run(self, cl, args)` has not been implemented.')
\ No newline at end of file
+        raise NotImplementedError('Abstract function `on_run(self, cl, args)` has not been implemented.')
+
+    '''
+    Whether running the command with the given arguments only reads from the database.
+    Only read-only commands can be run as background jobs by the shell. Commands are
+    assumed to write unless they say otherwise.
+    @param args Arguments that would be passed to the command
+    @return True if the command is safe to run in the background
+    '''
+    def read_only(self, args):
+        return False
@@ -1,6 +1,21 @@
 from commands.command import Command
-from util import pretty_print, str_replace_index
+from output import ask, emit
+from util import pretty_print, pretty_print_table
+import config
+import index_advisor
+import query_log
+from database import DELETE_CHUNK_SIZE
+from result_cache import RESULT_CACHE_SIZE
+import sql_parser
+import transfer
 from datetime import datetime
+import sys
+import time
+
+# Number of recent log entries `database stats` works from
+STATS_WINDOW = 10000
+# Number of statements `database stats` shows as the slowest
+STATS_SLOWEST = 10
 
 '''
 Used to manipulate the Sqlite database through a command. This is a complex, multi-stage
@@ -21,9 +36,11 @@ class DatabaseCommand(Command):
         super(DatabaseCommand, self).__init__('database', 'Allows the user to modify the Sqlite database in multiple ways.', man_page_entry='''IMPLEMENT ME''')
 
         # This is a special variable
-        # The `__call__` function will set this if it hasn't already been set
-        # Each sub-command will be completely unaware of the shell.
+        # The `__call__` function sets this to the shell's database
+        # Each sub-command will be completely unaware of the shell, except `use`
+        # which needs it to switch databases.
         self.db = None
+        self.cl = None
 
         # Dictionary to keep track of subcommands
         # The key is the name of the sub-command
@@ -33,16 +50,35 @@ class DatabaseCommand(Command):
             'alter': 'Modifies an existing table',
             'select': 'Selects data from the database',
             'insert': 'Inserts data into a table in the database',
-            'update': 'Updates a row in a table in the database',
+            'update': 'Updates rows in a table in the database',
+            'delete': 'Deletes rows from a table in the database',
             'help': 'Print help information for each sub-command',
             'execute': 'Executes raw SQL',
             'commit': 'Commits changes to database',
-            'log': 'Prints the database log'
+            'begin': 'Opens a transaction',
+            'rollback': 'Rolls back the transaction or to a savepoint',
+            'savepoint': 'Opens a savepoint inside the transaction',
+            'release': 'Releases a savepoint, keeping its changes',
+            'autocommit': 'Sets up automatic commits',
+            'pragma': 'Shows or changes storage settings',
+            'attach': 'Attaches another database file',
+            'detach': 'Detaches a database file',
+            'use': 'Switches to another database file',
+            'log': 'Prints the database log',
+            'cache': 'Prints cache statistics, turns the result cache on or off',
+            'stats': 'Prints the slowest statements and latencies',
+            'explain': 'Shows how a query will be run',
+            'index': 'Creates, drops, lists and suggests indexes',
+            'dump': 'Writes a table to a CSV or JSON lines file',
+            'load': 'Reads a CSV or JSON lines file into a table'
         }
+
+        # Sub-commands which never write, so can run as background jobs
+        self.read_only_subs = {'select', 'log', 'dump', 'stats', 'explain'}
     
     '''
-    The `__call__` function first determines if there is a database already assigned.
-    If not, it sets the database to the shell's database. Sub-commands will be unaware
+    The `__call__` function first sets the database to the shell's database, which can
+    change when the shell switches databases. Sub-commands will be unaware
     of the shell's existence, relying on the internal variables for anything they need.
     Next, it checks if there is a sub-command to invoke, and if not, will return sub-command
     information. Next, it handles executing sub-commands. From there, the sub-commands
@@ -50,7 +86,8 @@ class DatabaseCommand(Command):
     '''
     def __call__(self, cl, args):
         # Ensure there is a database reference internally
-        if self.db == None: self.db = cl.db
+        self.db = cl.db
+        self.cl = cl
 
         # Ensure there is a sub-command to invoke
         if len(args) < 1:
@@ -63,16 +100,20 @@ class DatabaseCommand(Command):
             com = args[0] # Sub-command to be run
             sargs = args[1:] # Args to be passed to sub-command
             if com in self.sub_commands.keys():
-                getattr(self, 'sub_'+com, None)(sargs)
+                # Sub-commands which don't return anything worked
+                return getattr(self, 'sub_'+com)(sargs) or 0
             else:
                 print('Function {} not found. For help type `database help` or `database` to see a full list of functions.'.format(com))
                 return 1
-            
-            return 0
-        
-        # This should not happen!
-        return -1
     
+    '''
+    Sub-commands which only read from the database can run as background jobs.
+    @param args Arguments that would be passed to the command
+    '''
+    def read_only(self, args):
+        # `cache` on its own only prints, anything after it changes the cache
+        return len(args) > 0 and (args[0] in self.read_only_subs or args == ['cache'])
+
     '''
     Select information from a table.
     Arguments passed in must be in the following order:
@@ -82,22 +123,31 @@ class DatabaseCommand(Command):
     '''
     def sub_select(self, args):
         # Parse out any arguments
-        # TODO: Fill this in!
         '''
         Arguments:
-
+        --page N -> Wait for the user after every N rows
         '''
+        usage = 'select <table> [column...] [--page N]'
+        try:
+            page_size, args = self.take_option(args, '--page', int)
+        except ValueError as e:
+            print(e)
+            return self.usage(usage)
+        if page_size is not None and page_size < 1:
+            print('--page needs at least 1 row.')
+            return self.usage(usage)
+
         # Ensure args contains at least a table name
         if len(args) < 1:
-            # Print help information
-
-            return -1
+            return self.usage(usage)
         
         template = ''
+        headers = None
 
         if len(args) == 1:
             # In this case, the user only specified the table name
             template = 'SELECT * FROM {}'.format(args[0])
+            headers = [column[1] for column in self.db.get_table_meta(args[0])]
         else:
             table_name = args[0]
             table_rows = args[1:]
@@ -105,49 +155,306 @@ class DatabaseCommand(Command):
 
             template = 'SELECT {} FROM {}'.format(template_rows, table_name)
         
-        # TODO: Pretty print results
-        results = self.db.execute(template)
-        print(results)
+        # Rows are printed as they come out of the database so nothing
+        # has to wait for the whole table to be read
+        rows = self.db.stream(template)
+        emit(rows, headers or rows.columns, page_size=page_size)
 
         return 0
 
     '''
-    Insert information into a table.
+    Insert information into a table. Values are either given one per argument for a single
+    row, or as SQL style rows for any number of rows:
+    database insert users bob sql:datetime('now')
+    database insert users VALUES (bob, datetime('now')), ('Alice Smith', NULL)
+    database insert users (name, created) VALUES (bob, CURRENT_TIMESTAMP)
+    Every value is bound, never put into the statement. Whitelisted functions like
+    `datetime` can be called to make a value, with their arguments bound as well.
     Args passed in must be in the following order:
     args[0] OR args[0:] -> table name OR arguments passed into insert
     args[1:] OR args[:]-> values passed into the table OR table name (if args[0:] are arguments)
     @param args Table information and arguments passed into `insert` subcommand
+    @see self.bulk_insert
+    @see sql_parser.INSERT_FUNCTIONS
     '''
     def sub_insert(self, args):
         # Parse out any arguments
-        # TODO: Fill this in!
         '''
         Arguments to be parsed:
-        specify columns -> Necessary to specify columns to fill when inserting
+        --bulk -> Insert rows read from a file or stdin
         '''
+        if len(args) > 0 and args[0] == '--bulk':
+            return self.bulk_insert(args[1:])
+
         # Ensure args contains at least the table name and values
         if(len(args) < 2):
-            # Display help message here
+            return self.usage('insert <table> <value> ... | [(columns)] VALUES (...), ...')
 
-            return -1
+        table_name = args[0]
+        values = None
+        if args[1].upper() == 'VALUES' or args[1].startswith('('):
+            try:
+                values = sql_parser.parse_insert_values(' '.join(args[1:]))
+            except ValueError:
+                # Not a list of rows after all, e.g. `dbi notes (draft)`, so they're plain values
+                pass
 
-        # Setup the template
-        # The number of values to pass will be set
-        # by the number of arguments passed in by the user
-        template = 'INSERT INTO {} VALUES ({})'
+        if values is None:
+            try:
+                # One value per argument, `sql:` values are expressions
+                values = sql_parser.InsertValues((), [tuple(
+                    sql_parser.parse_insert_value(value[4:]) if value.startswith('sql:') else ('?', (value,))
+                    for value in args[1:])])
+            except ValueError as e:
+                print(e)
+                return 1
 
-        table_name = args[0]
-        table_values = args[1:]
+        # Rows next to each other which look the same are inserted together, each group is
+        # parsed by sqlite once
+        groups = sql_parser.compile_insert(values.rows)
+        if len(values.rows) == 1:
+            (placeholders, (params,)), = groups
+            self.db.execute('INSERT INTO {}{} VALUES ({})'.format(table_name,
+                ' ({})'.format(', '.join(sql_parser.quote(column) for column in values.columns))
+                if values.columns else '',
+                ','.join(placeholders)), *params)
+            return 0
 
-        template = template.format(table_name,
-            ''.join(['?,' for i in range(len(table_values))])[:-1])
+        count = 0
+        with self.db.transaction():
+            for placeholders, rows in groups:
+                count += self.db.insert_many(table_name, rows, columns=values.columns or None,
+                    placeholders=placeholders)
 
-        template, args = self.sql_stuff(template, *table_values)
+        print('Inserted {} rows'.format(count))
 
-        self.db.execute(template, *args)
+        return 0
     
+    '''
+    Insert many rows into a table at once. Rows are read as CSV, one row per line, either
+    from a file or from stdin until EOF. All the rows are inserted in a single transaction.
+    args[0] -> table name
+    args[1] -> (optional) path of the file to read, `-` or nothing to read stdin
+    @param args Arguments passed into `insert --bulk`
+    '''
+    def bulk_insert(self, args):
+        if len(args) < 1:
+            return self.usage('insert --bulk <table> [file]')
+
+        with transfer.open_input(args[1] if len(args) > 1 else '-') as f:
+            start = time.perf_counter()
+            count = self.db.insert_many(args[0], transfer.csv_rows(f))
+            self.report_changes('Inserted', count, time.perf_counter() - start)
+
+        return 0
+
+    '''
+    Update rows in a table. Either the rows matching a condition are all given the same
+    values, or a file of changes is applied row by row:
+    database update users SET name = bob, seen = datetime('now') WHERE id = 5
+    database update users SET seen = NULL --all
+    database update --batch users changes.csv --key id
+    Values are bound the same way as `insert` values. Like `delete`, updating needs a
+    condition or `--all`, so every row isn't changed by mistake. Batch files are CSV with a header
+    naming the columns, and rows are picked out by the `--key` columns (the first column if
+    not given). Every change in a batch is made in a single transaction.
+    args[0] -> table name OR --batch
+    args[1:] -> SET clause and WHERE clause or --all OR table name, file and --key
+    @param args Arguments passed into `update` subcommand
+    @see self.sub_insert
+    '''
     def sub_update(self, args):
-        pass
+        if len(args) > 0 and args[0] == '--batch':
+            return self.batch_update(args[1:])
+
+        usage = 'update <table> SET <column> = <value>, ... WHERE ... | --all'
+        every_row = args[-1:] == ['--all']
+        if every_row:
+            args = args[:-1]
+        if len(args) < 2:
+            return self.usage(usage)
+
+        table_name = args[0]
+        try:
+            update = sql_parser.parse_update(' '.join(args[1:]))
+        except ValueError as e:
+            print(e)
+            return 1
+
+        if not update.where and not every_row:
+            print('Updating needs a WHERE clause, or --all to update every row.')
+            return self.usage(usage)
+
+        sets = []
+        params = []
+        for column, (sql, value_params) in update.assignments:
+            sets.append('{} = {}'.format(sql_parser.quote(column), sql))
+            params.extend(value_params)
+
+        sql = 'UPDATE {} SET {}'.format(table_name, ', '.join(sets))
+        if update.where:
+            sql += ' WHERE ' + update.where
+
+        start = time.perf_counter()
+        count = self.db.changes(sql, *params)
+        self.report_changes('Updated', count, time.perf_counter() - start)
+
+        return 0
+
+    '''
+    Update rows from a CSV file of changes.
+    args[0] -> table name
+    args[1] -> (optional) path of the file to read, `-` or nothing to read stdin
+    --key columns -> (optional) comma separated columns which pick out each row
+    @param args Arguments passed into `update --batch`
+    '''
+    def batch_update(self, args):
+        usage = 'update --batch <table> [file] [--key column,...]'
+        try:
+            keys, args = self.take_option(args, '--key', lambda value: value.split(','))
+        except ValueError as e:
+            print(e)
+            return self.usage(usage)
+        if len(args) < 1:
+            return self.usage(usage)
+
+        with transfer.open_input(args[1] if len(args) > 1 else '-') as f:
+            rows = transfer.csv_rows(f)
+            header = next(rows, [])
+            keys = keys or header[:1]
+
+            missing = [key for key in keys if key not in header]
+            if missing:
+                print('Key column `{}` is not in the file.'.format(missing[0]))
+                return 1
+
+            # Keys go last, to match the WHERE clause
+            columns = [column for column in header if column not in keys]
+            if not columns:
+                print('The file has no columns to update besides the key.')
+                return 1
+            order = [header.index(column) for column in columns + keys]
+
+            start = time.perf_counter()
+            count = self.db.update_many(args[0], columns, keys,
+                ([row[i] for i in order] for row in rows))
+            self.report_changes('Updated', count, time.perf_counter() - start)
+
+        return 0
+
+    '''
+    Delete rows from a table. Either the rows matching a condition are deleted, a chunk at
+    a time, or the rows listed in a file are:
+    database delete events WHERE created < '2020-01-01' --chunk 5000
+    database delete events --all
+    database delete --batch users ids.csv
+    Deleting needs a condition or `--all`, so a table isn't emptied by mistake. Chunks are
+    committed one at a time, unless a transaction is open, so the journal stays small.
+    Batch files are CSV with a header naming the columns which pick out each row, and every
+    row is deleted in a single transaction.
+    args[0] -> table name OR --batch
+    args[1:] -> WHERE clause or --all, and optional --chunk N OR table name and file
+    @param args Arguments passed into `delete` subcommand
+    @see database.Database.delete_chunked
+    '''
+    def sub_delete(self, args):
+        if len(args) > 0 and args[0] == '--batch':
+            return self.batch_delete(args[1:])
+
+        usage = 'delete <table> WHERE ... | --all [--chunk N]'
+        try:
+            chunk_size, args = self.take_option(args, '--chunk', int)
+        except ValueError as e:
+            print(e)
+            return self.usage(usage)
+        if chunk_size is not None and chunk_size < 1:
+            print('--chunk needs at least 1 row.')
+            return self.usage(usage)
+        if len(args) < 1:
+            return self.usage(usage)
+
+        table_name = args[0]
+        where = None
+        if args[1:] != ['--all']:
+            if len(args) < 3 or args[1].upper() != 'WHERE':
+                print('Deleting needs a WHERE clause, or --all to delete every row.')
+                return self.usage(usage)
+            where = ' '.join(args[2:])
+
+        start = time.perf_counter()
+        count = self.db.delete_chunked(table_name, where, chunk_size=chunk_size or DELETE_CHUNK_SIZE,
+            progress=self.report_progress)
+        sys.stdout.write('\r')
+        self.report_changes('Deleted', count, time.perf_counter() - start)
+
+        return 0
+
+    '''
+    Delete the rows listed in a CSV file.
+    args[0] -> table name
+    args[1] -> (optional) path of the file to read, `-` or nothing to read stdin
+    @param args Arguments passed into `delete --batch`
+    '''
+    def batch_delete(self, args):
+        if len(args) < 1:
+            return self.usage('delete --batch <table> [file]')
+
+        with transfer.open_input(args[1] if len(args) > 1 else '-') as f:
+            rows = transfer.csv_rows(f)
+            header = next(rows, [])
+            if not header:
+                print('The file has no header naming the key columns.')
+                return 1
+
+            start = time.perf_counter()
+            count = self.db.delete_many(args[0], header, rows)
+            self.report_changes('Deleted', count, time.perf_counter() - start)
+
+        return 0
+
+    '''
+    Prints how a sub-command is used, for when it's given arguments it can't use.
+    @param usage The sub-command and the arguments it takes
+    @return -1, for the sub-command to return
+    '''
+    def usage(self, usage):
+        print('Usage: database {}'.format(usage))
+
+        return -1
+
+    '''
+    Takes an option and its value out of a sub-command's arguments, e.g. `--chunk 5000`.
+    @param args Arguments passed to the sub-command
+    @param name Name of the option
+    @param convert Function turning the value into what the sub-command needs, e.g. int
+    @return Tuple of the value, or None if the option wasn't given, and the rest of the
+        arguments
+    @throws ValueError if the option has no value, or the value can't be converted
+    '''
+    def take_option(self, args, name, convert=str):
+        if name not in args:
+            return None, args
+
+        index = args.index(name)
+        if index + 1 >= len(args):
+            raise ValueError('{} needs a value.'.format(name))
+
+        try:
+            value = convert(args[index+1])
+        except ValueError:
+            raise ValueError('Invalid value `{}` for {}.'.format(args[index+1], name))
+
+        return value, args[:index] + args[index+2:]
+
+    '''
+    Prints how many rows were changed and how fast.
+    @param action What was done to the rows, e.g. `Updated`
+    @param count Number of rows changed
+    @param elapsed Seconds it took
+    '''
+    def report_changes(self, action, count, elapsed):
+        print('{} {} rows in {:.2f}s ({:.0f} rows/sec)'.format(action, count, elapsed,
+            count / elapsed if elapsed else count))
 
     def sub_create(self, args):
         '''
@@ -165,15 +472,14 @@ class DatabaseCommand(Command):
         Once it receives the EOF indicator, it then parses the input and runs a SQL query.
         '''
         if len(args) != 1:
-            # Display help message here
-            return -1
+            return self.usage('create <EOF indicator>')
         
         eof_indicator = args[0]
         template = '''CREATE TABLE {} ({})'''
         sql_input = []
         # Capture user input until it encounters EOF
         while(True):
-            next_line = input()
+            next_line = ask()
             if next_line == eof_indicator:
                 break
             if next_line != '':
@@ -200,51 +506,371 @@ class DatabaseCommand(Command):
     
     def sub_execute(self, args):
         sql = ' '.join([i for i in args])
-        value = self.db.execute(sql)
         # Print out any output given from the database
-        if value:
-            print(value)
+        rows = self.db.stream(sql)
+        if rows.columns:
+            emit(rows, rows.columns)
     
     def sub_commit(self, args):
         self.db.commit()
+
+    def sub_begin(self, args):
+        self.db.begin()
+
+    '''
+    Roll back the transaction.
+    args[0] -> (optional) savepoint to roll back to, the transaction stays open
+    @param args Arguments passed into `rollback` subcommand
+    '''
+    def sub_rollback(self, args):
+        self.db.rollback(args[0] if len(args) > 0 else None)
+
+    '''
+    Open a savepoint. A transaction is opened as well if there isn't one.
+    args[0] -> name of the savepoint
+    @param args Arguments passed into `savepoint` subcommand
+    '''
+    def sub_savepoint(self, args):
+        if len(args) != 1:
+            return self.usage('savepoint <name>')
+
+        self.db.savepoint(args[0])
+
+    '''
+    Release a savepoint.
+    args[0] -> name of the savepoint
+    @param args Arguments passed into `release` subcommand
+    '''
+    def sub_release(self, args):
+        if len(args) != 1:
+            return self.usage('release <name>')
+
+        self.db.release(args[0])
+
+    '''
+    Set up automatic commits. With no arguments, prints the current settings.
+    args[0] -> number of writes to commit after, or `off`
+    args[1] -> (optional) milliseconds after the first uncommitted write to commit after
+    Example:
+    database autocommit 1000 500 -> commit every 1000 writes or every half a second
+    @param args Arguments passed into `autocommit` subcommand
+    '''
+    def sub_autocommit(self, args):
+        if len(args) == 0:
+            pretty_print({
+                'every': self.db.autocommit_every or 'off',
+                'ms': self.db.autocommit_ms if self.db.autocommit_ms is not None else 'off',
+            })
+            return 0
+
+        if args[0] == 'off':
+            self.db.autocommit()
+        else:
+            self.db.autocommit(int(args[0]) or None, int(args[1]) if len(args) > 1 else None)
+
+        return 0
     
+    '''
+    Print the database log.
+    With no arguments, prints the recent entries kept in memory. Otherwise:
+    args[0] -> number of entries to print
+    args[1] -> (optional) page of older entries to print, starting from 0 for the newest
+    Pages are read from the `logs` table, so the whole history is available.
+    @param args Arguments passed into `log` subcommand
+    '''
     def sub_log(self, args):
-        print('\n'.join([i for i in self.db.log]))
+        if len(args) == 0:
+            entries = self.db.log
+        else:
+            limit = int(args[0])
+            page = int(args[1]) if len(args) > 1 else 0
+
+            entries = self.db.log.page(limit, page)
+
+        print('\n'.join([i for i in entries]))
         # TODO: Implement pretty print for this?
 
+    '''
+    Print the slowest statements, the latency of each statement template, and any statements
+    which read whole tables. Everything is worked out from the most recent log entries.
+    args[0] -> (optional) number of slowest statements to print
+    @param args Arguments passed into `stats` subcommand
+    @see query_log.template_stats
+    '''
+    def sub_stats(self, args):
+        count = int(args[0]) if len(args) > 0 else STATS_SLOWEST
+
+        entries = self.db.log.profiles(STATS_WINDOW)
+        if not entries:
+            print('No statements have been timed yet.')
+            return 0
+
+        print('Slowest statements')
+        slowest = sorted(entries, key=lambda entry: -entry[2])[:count]
+        pretty_print_table([('{:.2f}'.format(duration), '' if rows is None else rows, message)
+            for message, template, duration, rows, plan in slowest], ['ms', 'rows', 'statement'])
+
+        print('\nLatency by statement')
+        pretty_print_table([(template, calls, '{:.2f}'.format(p50), '{:.2f}'.format(p95),
+            '{:.2f}'.format(_max)) for template, calls, p50, p95, _max
+            in query_log.template_stats(entries)],
+            ['statement', 'count', 'p50 ms', 'p95 ms', 'max ms'])
+
+        # Each template's plan only needs checking once
+        scans = {}
+        for message, template, duration, rows, plan in entries:
+            if template not in scans:
+                scans[template] = query_log.full_scans(plan)
+        scans = {template: steps for template, steps in scans.items() if steps}
+
+        if scans:
+            print('\nFull table scans')
+            for template, steps in scans.items():
+                print('Warning: {} -> {}'.format(template, ', '.join(steps)))
+
+        return 0
+
+    '''
+    Print how sqlite will run a statement, without running it. Steps which read a whole
+    table are pointed out.
+    args -> The statement
+    @param args Arguments passed into `explain` subcommand
+    '''
+    def sub_explain(self, args):
+        if len(args) < 1:
+            return self.usage('explain <statement>')
+
+        steps = self.db.explain(' '.join(args))
+
+        # Steps are indented under the step they're part of
+        depth = {0: -1}
+        for step_id, parent, unused, detail in steps:
+            depth[step_id] = depth.get(parent, -1) + 1
+            print('  ' * depth[step_id] + detail)
+
+        for step in query_log.full_scans('; '.join(step[3] for step in steps)):
+            print('Warning: `{}` reads every row of the table, an index might help.'.format(step))
+
+        return 0
+
+    '''
+    Manage indexes. Indexes are kept track of in the meta tables.
+    args[0] -> create, drop, list or advise
+    create <table> <column> [column...] [--unique] [--name name] -> Creates an index
+    drop <name> -> Drops an index
+    list [table] -> Lists the indexes, optionally only those on one table
+    advise [--apply] -> Suggests indexes for statements in the log which read whole tables,
+        and creates them with --apply
+    @param args Arguments passed into `index` subcommand
+    @see index_advisor
+    '''
+    def sub_index(self, args):
+        if len(args) < 1:
+            return self.usage('index create|drop|list|advise ...')
+
+        action = args[0]
+        args = args[1:]
+
+        if action == 'create':
+            unique = '--unique' in args
+            if unique:
+                args.remove('--unique')
+
+            usage = 'index create <table> <column> [column...] [--unique] [--name name]'
+            try:
+                name, args = self.take_option(args, '--name')
+            except ValueError as e:
+                print(e)
+                return self.usage(usage)
+            if len(args) < 2:
+                return self.usage(usage)
+
+            print('Created index {}'.format(self.db.create_index(args[0], args[1:], name, unique)))
+        elif action == 'drop':
+            if len(args) < 1:
+                return self.usage('index drop <name>')
+
+            self.db.drop_index(args[0])
+        elif action == 'list':
+            indexes = self.db.get_indexes(args[0] if len(args) > 0 else None)
+            pretty_print_table([(name, table, ', '.join(columns), 'yes' if unique else 'no')
+                for name, table, columns, unique in indexes], ['name', 'table', 'columns', 'unique'])
+        elif action == 'advise':
+            suggestions = index_advisor.advise(self.db, self.db.log.profiles(STATS_WINDOW))
+            if not suggestions:
+                print('No indexes to suggest.')
+                return 0
+
+            pretty_print_table([(suggestion.table, ', '.join(suggestion.columns), suggestion.calls,
+                '{:.2f}'.format(suggestion.total_ms), '{:.2f}'.format(suggestion.saved_ms))
+                for suggestion in suggestions],
+                ['table', 'columns', 'statements', 'total ms', 'est. saved ms'])
+
+            if '--apply' in args:
+                for suggestion in suggestions:
+                    name = self.db.create_index(suggestion.table, suggestion.columns)
+                    print('Created index {}'.format(name))
+        else:
+            print('Unknown index action `{}`. Expected one of: create, drop, list, advise'.format(action))
+            return -1
+
+        return 0
+
+    '''
+    Print statement cache statistics, and query result cache statistics if results are
+    being cached. The result cache can be turned on, off or cleared.
+    args[0] -> (optional) on, off or clear
+    args[1] -> (optional) bytes of memory to cache results in, for `on`
+    @param args Arguments passed into `cache` subcommand
+    @see database.Database.cache_results
+    '''
+    def sub_cache(self, args):
+        if len(args) > 0:
+            if args[0] == 'on':
+                self.db.cache_results(int(args[1]) if len(args) > 1 else RESULT_CACHE_SIZE)
+            elif args[0] == 'off':
+                self.db.cache_results(None)
+            elif args[0] == 'clear':
+                self.db.invalidate_results()
+            else:
+                return self.usage('cache [on [bytes] | off | clear]')
+
+        print('Statements:')
+        pretty_print(self.db.cache_stats())
+        if self.db.results is not None:
+            print('Results:')
+            pretty_print(self.db.results.stats())
+
+        return 0
+
+    '''
+    Write every row of a table to a file. The format is worked out from the file extension
+    (.csv, .jsonl, optionally followed by .gz) unless it's given.
+    args[0] -> table name
+    args[1] -> path of the file to write
+    args[2:] -> (optional) --format csv|jsonl, --gzip
+    @param args Arguments passed into `dump` subcommand
+    @see transfer
+    '''
+    def sub_dump(self, args):
+        if len(args) < 2:
+            return self.usage('dump <table> <file> [--format csv|jsonl] [--gzip]')
+
+        table_name = args[0]
+        path = args[1]
+        try:
+            fmt, compressed = transfer.choose_format(path, args[2:])
+        except ValueError as e:
+            print(e)
+            return 1
+
+        rows = self.db.stream('SELECT * FROM {}'.format(table_name))
+        with transfer.open_file(path, 'w', compressed) as f:
+            count = transfer.write_rows(f, transfer.progress(rows, self.report_progress),
+                rows.columns, fmt)
+
+        print('\rDumped {} rows from {} to {}'.format(count, table_name, path))
+
+        return 0
+
+    '''
+    Read every row from a file into a table, in a single transaction. The first row of a
+    CSV file must hold the column names. The format is worked out from the file extension
+    (.csv, .jsonl, optionally followed by .gz) unless it's given.
+    args[0] -> table name
+    args[1] -> path of the file to read
+    args[2:] -> (optional) --format csv|jsonl, --gzip
+    @param args Arguments passed into `load` subcommand
+    @see transfer
+    '''
+    def sub_load(self, args):
+        if len(args) < 2:
+            return self.usage('load <table> <file> [--format csv|jsonl] [--gzip]')
+
+        table_name = args[0]
+        path = args[1]
+        try:
+            fmt, compressed = transfer.choose_format(path, args[2:])
+        except ValueError as e:
+            print(e)
+            return 1
+
+        with transfer.open_file(path, 'r', compressed) as f:
+            columns, rows = transfer.read_rows(f, fmt)
+            count = self.db.insert_many(table_name, transfer.progress(rows, self.report_progress),
+                columns=columns)
+
+        print('\rLoaded {} rows from {} into {}'.format(count, path, table_name))
+
+        return 0
+
+    '''
+    Show or change storage settings. With no arguments, prints every setting.
+    args[0] -> name of the setting, or --profile to apply a profile
+    args[1] -> (optional) new value for the setting, or the name of the profile
+    @param args Arguments passed into `pragma` subcommand
+    @see config.PROFILES
+    '''
+    def sub_pragma(self, args):
+        if len(args) == 0:
+            pretty_print({name: self.db.pragma(name) for name in config.PRAGMAS})
+        elif args[0] == '--profile':
+            if len(args) < 2:
+                pretty_print({name: ', '.join('{}={}'.format(*i) for i in settings.items())
+                    for name, settings in config.PROFILES.items()})
+                return 0
+
+            self.db.use_profile(args[1])
+        else:
+            print(self.db.pragma(args[0], args[1] if len(args) > 1 else None))
+
+        return 0
+
+    '''
+    Attach another database file, so its tables can be used as `alias.table`.
+    args[0] -> path of the database file
+    args[1] -> name to attach it as
+    @param args Arguments passed into `attach` subcommand
+    '''
+    def sub_attach(self, args):
+        if len(args) != 2:
+            return self.usage('attach <file> <alias>')
+
+        self.db.attach(args[0], args[1])
+
+    '''
+    Detach a database file.
+    args[0] -> name it was attached as
+    @param args Arguments passed into `detach` subcommand
+    '''
+    def sub_detach(self, args):
+        if len(args) != 1:
+            return self.usage('detach <alias>')
+
+        self.db.detach(args[0])
+
+    '''
+    Switch the shell to another database file. With no arguments, lists the open databases.
+    args[0] -> path of the database file
+    @param args Arguments passed into `use` subcommand
+    '''
+    def sub_use(self, args):
+        if len(args) == 0:
+            for path in self.cl.databases:
+                print(('* ' if self.cl.databases[path] is self.db else '  ') + path)
+            return 0
+
+        self.db = self.cl.use_database(args[0])
+
+        return 0
+
     def sub_help(self, args):
         pass
     
-    def sql_stuff(self, template, *args: tuple):
-        '''
-        Input:
-        template -> INSERT INTO users (?,?)
-        args[0] -> 'bastisawesome'
-        args[1] -> 'exec:datetime('now')'
-
-        Template result:
-        database insert users bastisawesome exec:datetime('now')
-
-        Output:
-        INSERT INTO users VALUES ('bastisawesome', datetime('now'))
-        
-        Possible solutions:
-        Input: exec:datetime.now()
-        Code:
-        exec(args[1]) # exec(datetime.now())
-        Problem:
-        Random code execution -> security hole
-        '''
-        '''
-        If using the sql: command, you have to remember that it is executing sql without
-        being escaped. This is a huge security hole because it isn't escaped. You have to make sure you use valid SQL. Furthermore, spaces are not allowed in the commands, so nothing that uses spaces will be accepted.
-        '''
-        new_template = template
-        for i in args:
-            if 'sql:' in i:
-                command = i.split(':')[1]
-                index = args.index(i)
-                new_template = str_replace_index(template, '?', command, index+1)
-                args = [i for i in args if not 'sql:' in i]
-        
-        return new_template, args
\ No newline at end of file
+    '''
+    Prints the number of rows moved so far, over the top of the previous count.
+    @param count Number of rows moved so far
+    '''
+    def report_progress(self, count):
+        sys.stdout.write('\r{} rows'.format(count))
+        sys.stdout.flush()
@@ -0,0 +1,135 @@
+import configparser
+import os
+import re
+
+'''
+Storage engine settings for the database. Settings are sqlite pragmas, grouped into named
+profiles, and can be given to `Database` directly or read from a config file at startup.
+The config file can also hold any of the other `OPTIONS` for `Database`.
+Config file layout:
+
+[database]
+profile = fast
+cache_size = -131072
+log_size = 5000
+'''
+
+CONFIG_FILE = 'sqlos.ini'
+
+# Pragmas which can be tuned
+PRAGMAS = ('journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'temp_store', 'page_size')
+
+PROFILES = {
+    # Whatever sqlite does by default
+    'default': {},
+    # Every commit is synced to disk, readers don't block the writer
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+    },
+    # A crash can lose the last commits but never corrupts the database
+    'fast': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 268435456,
+        'cache_size': -65536,
+        'temp_store': 'MEMORY',
+    },
+    # For loading lots of data, a crash part way through can corrupt the database
+    'bulk-load': {
+        'journal_mode': 'MEMORY',
+        'synchronous': 'OFF',
+        'cache_size': -262144,
+        'temp_store': 'MEMORY',
+    },
+}
+
+# Settings the config file can give `Database` besides pragmas, and how to read each one.
+# Everything in the file is text, so each needs turning into the type `Database` expects.
+OPTIONS = {
+    'profile': 'get',
+    'pool_size': 'getint',
+    'log_size': 'getint',
+    'log_batch_size': 'getint',
+    'log_interval': 'getfloat',
+    'statement_cache_size': 'getint',
+    'cached_statements': 'getint',
+    'schema_fallback': 'getboolean',
+    'autocommit_every': 'getint',
+    'autocommit_ms': 'getfloat',
+    'result_cache': 'getint',
+}
+
+# Pragma values are put straight into the statement, so only allow numbers and keywords
+VALUE = re.compile(r'^(-?\d+|[A-Za-z]+)$')
+
+'''
+Builds the pragma settings from a profile and any settings which override it.
+@param profile (optional) Name of the profile to start from
+@param pragmas Settings which override the profile
+@return Dictionary of pragma name to value
+@throws ValueError if the profile, a pragma, or a value isn't valid
+'''
+def resolve(profile=None, **pragmas):
+    if profile is not None and profile not in PROFILES:
+        raise ValueError('Unknown profile `{}`. Expected one of: {}'.format(profile,
+            ', '.join(PROFILES)))
+
+    settings = dict(PROFILES[profile] if profile else {}, **pragmas)
+    for name, value in settings.items():
+        check(name, value)
+
+    return settings
+
+'''
+Checks a pragma can be tuned and its value is safe to use.
+@throws ValueError if it isn't
+'''
+def check(name, value):
+    if name not in PRAGMAS:
+        raise ValueError('Unknown pragma `{}`. Expected one of: {}'.format(name, ', '.join(PRAGMAS)))
+
+    if not VALUE.match(str(value)):
+        raise ValueError('Invalid value `{}` for pragma `{}`'.format(value, name))
+
+'''
+Orders pragma settings so they can be applied one after the other. `page_size` can't be
+changed once the database is in WAL mode, so it always goes first.
+@param settings Dictionary of pragma name to value
+@return List of (name, value) tuples
+'''
+def ordered(settings):
+    return sorted(settings.items(), key=lambda setting: setting[0] != 'page_size')
+
+'''
+Reads the `[database]` section of a config file. Pragmas are left as text, they're checked
+when the database applies them.
+@param path Path of the config file
+@return Dictionary of keyword arguments for `Database`, empty if there is no config file
+@throws ValueError if a setting isn't known or its value is the wrong type
+@see OPTIONS
+'''
+def load_config(path=CONFIG_FILE):
+    if not os.path.exists(path):
+        return {}
+
+    parser = configparser.ConfigParser()
+    parser.read(path)
+    if not parser.has_section('database'):
+        return {}
+
+    section = parser['database']
+    settings = {}
+    for name in section:
+        if name in PRAGMAS:
+            settings[name] = section[name]
+        elif name in OPTIONS:
+            try:
+                settings[name] = getattr(section, OPTIONS[name])(name)
+            except ValueError:
+                raise ValueError('Invalid value `{}` for `{}` in {}'.format(section[name], name, path))
+        else:
+            raise ValueError('Unknown setting `{}` in {}. Expected a pragma ({}) or one of: {}'.format(
+                name, path, ', '.join(PRAGMAS), ', '.join(OPTIONS)))
+
+    return settings
@@ -1,25 +1,167 @@
+import contextlib
+import functools
+import itertools
 import sqlite3
+import threading
+import time
+
+import config
+import sql_parser
+from pool import ConnectionPool, CONNECTION_PRAGMAS, POOL_SIZE
+from query_log import QueryLog, LOG_BUFFER_SIZE, LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL, LOG_COLUMNS
+from result_cache import ResultCache, row_size
+
+# Database file used by physical databases unless another path is given
+DATABASE_PATH = 'sqlos.db'
+# Number of rows pulled from sqlite at a time when streaming results
+STREAM_BATCH_SIZE = 500
+# Number of classified statements kept by each database
+STATEMENT_CACHE_SIZE = 256
+# Number of compiled statements kept by sqlite
+CACHED_STATEMENTS = 256
+# Number of rows passed to `executemany` at a time by bulk inserts, updates and deletes
+INSERT_BATCH_SIZE = 1000
+# Number of rows deleted per transaction by chunked deletes
+DELETE_CHUNK_SIZE = 10000
+# Statements which get their query plan logged
+PLANNED_VERBS = ('SELECT', 'WITH', 'VALUES', 'UPDATE', 'DELETE')
+# Columns of every table in the meta tables, as (table, column, type, is_null, is_unique,
+# is_primary_key) rows
+SCHEMA_QUERY = '''
+SELECT tables_meta.name, columns_meta.name, type, is_null, is_unique, is_primary_key FROM tables_meta
+LEFT JOIN columns_meta
+WHERE table_name = tables_meta.name
+'''
+
+'''
+Iterator over the rows returned by `Database.stream`. Works exactly like the generator it
+wraps, but also carries the names of the result's columns.
+'''
+class Rows():
+    '''
+    @param cur Cursor the statement was executed on, or None for cached rows
+    @param rows Generator yielding the rows from the cursor
+    @param columns (optional) Names of the columns, for cached rows
+    '''
+    def __init__(self, cur, rows, columns=None):
+        # `description` is None for statements which don't return rows
+        self.columns = columns if cur is None else [column[0] for column in cur.description or []]
+        self.rows = rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.rows)
+
+    '''
+    Stops reading rows and closes the cursor.
+    '''
+    def close(self):
+        if hasattr(self.rows, 'close'):
+            self.rows.close()
 
 class Database():
-    def __init__(self, _type='physical'):
+    '''
+    Opens the database and makes sure the log and meta tables exist.
+    @param _type Either 'physical' to use a database file or 'memory' for an in-memory database
+    @param path Path of the database file for physical databases
+    @param pool_size Most read connections to keep open for reading on other threads
+    @param log_size Number of log entries kept in memory
+    @param log_batch_size Number of log entries written to the `logs` table at a time
+    @param log_interval Seconds between writes to the `logs` table
+    @param statement_cache_size Number of classified statements to keep
+    @param cached_statements Number of compiled statements sqlite keeps
+    @param schema_fallback Whether to look up tables missing from the meta tables with
+        `PRAGMA table_info`, e.g. tables altered or created outside of `execute`
+    @param autocommit_every (optional) Commit after this many writes
+    @param autocommit_ms (optional) Commit once the oldest uncommitted write is this old
+    @param result_cache (optional) Bytes of memory to cache query results in, or None to
+        not cache them
+    @param profile (optional) Name of the storage settings profile to use
+    @param pool (optional) Read connection pool to share with other databases on the same
+        file, e.g. the sessions of a server. It's left open when this database closes.
+    @param pragmas Storage settings overriding the profile, e.g. journal_mode='WAL'
+    @see self.autocommit
+    @see config.PROFILES
+    '''
+    def __init__(self, _type='physical', path=DATABASE_PATH, pool_size=POOL_SIZE,
+            log_size=LOG_BUFFER_SIZE, log_batch_size=LOG_BATCH_SIZE,
+            log_interval=LOG_FLUSH_INTERVAL, statement_cache_size=STATEMENT_CACHE_SIZE,
+            cached_statements=CACHED_STATEMENTS, schema_fallback=True, autocommit_every=None,
+            autocommit_ms=None, result_cache=None, profile=None, pool=None, **pragmas):
         if _type == 'physical':
-            self.db = sqlite3.connect('sqlos.db', detect_types=sqlite3.PARSE_DECLTYPES |
-                sqlite3.PARSE_COLNAMES)
+            self.path = path
         elif _type == 'memory':
-            self.db = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES |
-                sqlite3.PARSE_COLNAMES)
+            self.path = ':memory:'
+
+        # In-memory databases share this connection with reads on other threads
+        self.db = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES |
+            sqlite3.PARSE_COLNAMES, cached_statements=cached_statements, check_same_thread=False)
+
+        # Statements are only classified the first time they're seen
+        self.classify = functools.lru_cache(maxsize=statement_cache_size)(sql_parser.classify)
+        # Query plans for the log, by statement. Plans are only worked out the first time.
+        self.plans = {}
+        self.plans_size = statement_cache_size
+        self.plans_lock = threading.Lock()
 
         self.cur = self.db.cursor()
-        self.log = [] #['CREATE TABLE users (username STRING NOT NULL)','SELECT * FROM users']
 
-        self.num_logs = 0
+        # Storage settings go first, `page_size` only works before any tables are created
+        self.pragmas = config.resolve(profile, **pragmas)
+        for name, value in config.ordered(self.pragmas):
+            self.pragma(name, value)
+
+        # Table name -> column meta data, filled by `init_table_meta`. It's read again
+        # whenever sqlite's schema version moves, which other connections can do.
+        self.schema = {}
+        self.schema_version = None
+        self.schema_fallback = schema_fallback
+
+        # Query results, if they're being cached
+        self.results = None
+        self.data_version = None
+        self.version_lock = threading.Lock()
+        self.cache_key = functools.lru_cache(maxsize=statement_cache_size)(sql_parser.cache_key)
+        self.cache_results(result_cache)
+
+        # Transaction state
+        # `explicit` is set while a transaction opened by `begin` is running, which stops
+        # automatic commits. `savepoints` holds the names of the open savepoints.
+        # `begin_savepoint` marks where `begin` was called if there were uncommitted
+        # writes already, so rolling back doesn't throw them away. `nested` is set by
+        # `begin(nested=True)`, and `inner_savepoint` names the savepoint standing in for
+        # a transaction opened inside it.
+        self.explicit = False
+        self.savepoints = []
+        self.begin_savepoint = None
+        self.nested = False
+        self.inner_savepoint = None
+        self.writes = 0
+        self.first_write = None
+        self.autocommit(autocommit_every, autocommit_ms)
+
         self.init_logs()
         self.init_table_meta()
+
+        # In-memory databases can't be opened by the log's background writer
+        self.log = QueryLog(self.db, None if _type == 'memory' else self.path,
+            buffer_size=log_size, batch_size=log_batch_size, flush_interval=log_interval,
+            on_commit=self.log_commit, reader=self.borrow)
+
+        self.owns_pool = pool is None
+        if pool is None:
+            pool = ConnectionPool(self.path, self.db, size=pool_size, pragmas=self.pragmas)
+        self.pool = pool
+        # Per thread flag set by `reading`
+        self.local = threading.local()
     
     '''
     Checks that the table `logs` exists in the database. If it doesn't exist then it creates
-    the table. If the table does exist then it populates `self.log` and sets the number of 
-    logs for later.
+    the table. Logs tables from before statements were profiled get the new columns added.
+    Existing logs are not loaded, they are paged in by `self.log` when needed.
+    @see query_log.QueryLog
     '''
     def init_logs(self):
         # So, I crashed Repl.it with this and then...
@@ -27,24 +169,24 @@ class Database():
         # So I had to write this twice.
         self.cur.execute('''SELECT count(name) FROM sqlite_master WHERE type='table' AND name='logs' ''')
         
-        if self.cur.fetchone()[0] == 1:
-            # Table exists, let's pull logs!
-            self.cur.execute('''SELECT * FROM logs''')
-            
-            # Store results
-            res = self.cur.fetchall()
-            self.num_logs = len(res)
-
-            for log in res:
-                self.log.append(*log)
-        else:
+        if self.cur.fetchone()[0] == 0:
             # Table doesn't exist, let's create it!
-            self.cur.execute('''CREATE TABLE logs (message STRING NOT NULL)''')
+            self.cur.execute('''CREATE TABLE logs (message STRING NOT NULL, {})'''.format(
+                ', '.join('{} {}'.format(*column) for column in LOG_COLUMNS)))
+        else:
+            existing = {row[1] for row in self.cur.execute('''PRAGMA table_info(logs)''')}
+            for name, _type in LOG_COLUMNS:
+                if name not in existing:
+                    self.cur.execute('''ALTER TABLE logs ADD COLUMN {} {}'''.format(name, _type))
     
     '''
     Checks that the table `table_meta` exists in the database. If it doesn't, it creates
     the necessary meta tables. These tables keep track of the existing tables and their
     columns. Each column contains a name, a type, if it allows null, and more information.
+    Indexes are kept track of in `indexes_meta`, which is added to older databases too.
+    The meta data is read into `self.schema` here, after that it's kept up to date by
+    `add_table_meta` and `clear_table_meta`, and read again if another connection changes
+    the schema.
     '''
     def init_table_meta(self):
         # First check if the table_meta table exists
@@ -73,43 +215,840 @@ class Database():
             self.cur.execute(c_table_meta)
             self.cur.execute(c_column_meta)
 
+        self.cur.execute('''
+        CREATE TABLE IF NOT EXISTS indexes_meta (
+            name STRING UNIQUE NOT NULL,
+            table_name STRING NOT NULL,
+            columns STRING NOT NULL,
+            is_unique INTEGER NOT NULL
+        )
+        ''')
+
+        self.load_schema()
+
+    '''
+    Reads the meta tables into `self.schema`, replacing whatever was there.
+    '''
+    def load_schema(self):
+        self.schema = {}
+        self.schema_version = self.db.execute('PRAGMA schema_version').fetchone()[0]
+        self.cur.execute(SCHEMA_QUERY)
+
+        for column in self.cur.fetchall():
+            self.schema[column[0]] = self.schema.get(column[0], ()) + (column,)
+
     '''
     Executes SQL statements but does not commit to the database. The SQL statement passed
     in must already be formatted and cannot be a format string.
     @param sql Statement to be executed
     @param vals Tuple of values to pass into the template string
     @see self.commit
+    @see self.stream
     '''
     def execute(self, sql, *vals):
-        # Log the sql statements first
-        tolog = sql
-        for i in vals:
-            tolog = tolog.replace('?', i, 1)
-        self.log.append(tolog)
+        # Cached results don't reach `run`, so writes left waiting are checked here
+        self.check_autocommit()
+        statement = self.classify(sql)
+        key = self.result_key(sql, vals)
+        if key is not None:
+            result = self.cached_result(key)
+            if result is not None:
+                return list(result.rows)
+
+        start = time.perf_counter()
+        # This statement is here in the event the user
+        # executes a select statement.
+        # It will either return an empty list or, on select
+        # it will return all of the items in the list.
+        if key is None:
+            rows = self.run(sql, vals, self.cur, statement).fetchall()
+        else:
+            with self.results.reads(self.db) as tables:
+                cur = self.run(sql, vals, self.cur, statement)
+            rows = cur.fetchall()
+            self.store_result(key, [column[0] for column in cur.description or []], rows, tables)
+
+        # Everything else was logged by `run`
+        if statement.kind == 'QUERY':
+            self.profile(statement, sql, vals, time.perf_counter() - start, len(rows))
+
+        return rows
+
+    '''
+    Executes SQL statements the same way as `execute`, but instead of returning every row
+    at once it returns a generator which pulls the rows from sqlite in `fetchmany` batches.
+    The statement runs on its own cursor, so other statements can be executed while the
+    results are still being read. Memory use stays flat regardless of the result size.
+    @param sql Statement to be executed
+    @param vals Tuple of values to pass into the template string
+    @param batch_size Number of rows to fetch from sqlite at a time
+    @return Rows iterator yielding each row of the result
+    @see self.execute
+    '''
+    def stream(self, sql, *vals, batch_size=STREAM_BATCH_SIZE):
+        if getattr(self.local, 'reading', False):
+            return self.read(sql, *vals, batch_size=batch_size)
+
+        self.check_autocommit()
+        # The statement is executed straight away so errors are raised here
+        # and not when the first row is requested
+        statement = self.classify(sql)
+        key = self.result_key(sql, vals)
+        if key is not None:
+            result = self.cached_result(key)
+            if result is not None:
+                return Rows(None, iter(result.rows), result.columns)
+
+        start = time.perf_counter()
+        if key is None:
+            cur = self.run(sql, vals, self.db.cursor(), statement)
+        else:
+            with self.results.reads(self.db) as tables:
+                cur = self.run(sql, vals, self.db.cursor(), statement)
+
+        seconds = time.perf_counter() - start
+        profile = None
+        if statement.kind == 'QUERY':
+            # Queries are logged once their rows have been read
+            profile = lambda elapsed, count: self.profile(statement, sql, vals, seconds + elapsed,
+                count)
+
+        rows = Rows(cur, self.fetch_batches(cur, batch_size, profile))
+        if key is not None:
+            rows.rows = self.collect_result(key, rows.columns, tables, rows.rows)
+
+        return rows
+
+    '''
+    Yields rows from a cursor, fetching `batch_size` rows at a time. The cursor is closed
+    once the rows run out or the generator is discarded.
+    @param cur Cursor with a statement already executed
+    @param batch_size Number of rows to fetch from sqlite at a time
+    @param profile (optional) Function called once the cursor is closed, with the seconds
+        spent fetching and the number of rows fetched. Time spent by whatever is reading
+        the rows isn't counted.
+    '''
+    def fetch_batches(self, cur, batch_size, profile=None):
+        count = 0
+        elapsed = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                rows = cur.fetchmany(batch_size)
+                elapsed += time.perf_counter() - start
+                if not rows:
+                    break
+
+                count += len(rows)
+                yield from rows
+        finally:
+            cur.close()
+            if profile is not None:
+                profile(elapsed, count)
+
+    '''
+    Turns on caching of query results, or changes the size of the cache. Results cached so
+    far are thrown away.
+    @param max_bytes (optional) Bytes of memory to cache results in, or None to stop caching
+    @see result_cache.ResultCache
+    '''
+    def cache_results(self, max_bytes=None):
+        self.results = None if max_bytes is None else ResultCache(int(max_bytes))
+        self.data_version = None
+
+    '''
+    Works out what a statement's results are cached under. Only queries on the database's
+    own connection are cached, not reads from the pool.
+    @return Key for the results, or None if they can't be cached
+    '''
+    def result_key(self, sql, vals):
+        if self.results is None:
+            return None
+
+        text = self.cache_key(sql)
+        if text is None:
+            return None
+
+        key = (text, vals)
+        try:
+            hash(key)
+        except TypeError:
+            # Values like lists can't be part of a key
+            return None
+
+        return key
+
+    '''
+    Looks up a cached result. If another connection has changed the database since the last
+    look up, which `PRAGMA data_version` tells us, nothing cached can be trusted.
+    @return result_cache.Result, or None if there isn't one
+    '''
+    def cached_result(self, key):
+        version = self.db.execute('PRAGMA data_version').fetchone()[0]
+        with self.version_lock:
+            if version != self.data_version:
+                self.results.clear()
+                self.data_version = version
+
+        return self.results.get(key)
+
+    '''
+    Makes a commit for the log's background writer. Its connection is another connection as
+    far as `PRAGMA data_version` goes, but it only ever writes to `logs`, which results
+    never read. So if nothing else had changed the database beforehand, the version the
+    commit moves to is taken as already seen, and `cached_result` keeps the cache.
+    @param commit Function making the commit
+    @see query_log.QueryLog
+    '''
+    def log_commit(self, commit):
+        if self.results is None:
+            commit()
+            return
+
+        before = self.db.execute('PRAGMA data_version').fetchone()[0]
+        commit()
+        after = self.db.execute('PRAGMA data_version').fetchone()[0]
+
+        with self.version_lock:
+            if self.data_version == before:
+                self.data_version = after
+
+    '''
+    Caches a query's result. Results can include changes which haven't been committed, but
+    they're only handed out on this connection, which can see those changes anyway, and
+    rolling back throws every result away.
+    '''
+    def store_result(self, key, columns, rows, tables, size=None):
+        self.results.put(key, columns, rows, tables, size)
+
+    '''
+    Passes rows on as they're read, keeping them to cache once they've all been read. Rows
+    which stop being read part way through, or which are too big for the cache, aren't kept.
+    '''
+    def collect_result(self, key, columns, tables, rows):
+        kept = []
+        size = 0
+        try:
+            for row in rows:
+                if kept is not None:
+                    kept.append(row)
+                    size += row_size(row)
+                    if size > self.results.max_result:
+                        kept = None
+                yield row
+        finally:
+            # Closes the cursor if the rows stopped being read
+            rows.close()
+
+        if kept is not None:
+            self.store_result(key, columns, kept, tables, size)
+
+    '''
+    Runs a query on a read connection from the pool and streams its rows, the same way as
+    `stream`. Reads can run on any thread, at the same time as each other and as writes.
+    Only committed changes can be seen. The connection goes back to the pool once the
+    rows run out or the iterator is closed.
+    @param sql Query to run
+    @param vals Tuple of values to pass into the template string
+    @param batch_size Number of rows to fetch from sqlite at a time
+    @return Rows iterator yielding each row of the result
+    @throws sqlite3.ProgrammingError if the statement isn't a query
+    @see pool.ConnectionPool
+    '''
+    def read(self, sql, *vals, batch_size=STREAM_BATCH_SIZE):
+        statement = self.classify(sql)
+        if statement.kind != 'QUERY':
+            raise sqlite3.ProgrammingError('Only queries can be run on a read connection.')
+
+        conn = self.pool.acquire()
+        start = time.perf_counter()
+        try:
+            cur = conn.execute(sql, vals)
+        except Exception as e:
+            self.profile(statement, sql, vals, time.perf_counter() - start)
+            self.pool.release(conn)
+            raise e
+
+        seconds = time.perf_counter() - start
+        profile = lambda elapsed, count: self.profile(statement, sql, vals, seconds + elapsed,
+            count, conn)
+
+        return Rows(cur, self.read_batches(conn, cur, batch_size, profile))
+
+    '''
+    Context manager which sends every query passed to `stream` on the current thread to a
+    read connection for the length of the block. This lets code written for the main
+    connection run on a background thread. Anything that isn't a query raises.
+    @see self.read
+    '''
+    @contextlib.contextmanager
+    def reading(self):
+        self.local.reading = True
+        try:
+            yield self
+        finally:
+            self.local.reading = False
+
+    '''
+    Context manager giving the connection statements on this thread should use: a read
+    connection from the pool inside `reading`, the database's own connection otherwise.
+    @see self.reading
+    '''
+    @contextlib.contextmanager
+    def borrow(self):
+        if not getattr(self.local, 'reading', False):
+            yield self.db
+            return
+
+        conn = self.pool.acquire()
+        try:
+            yield conn
+        finally:
+            self.pool.release(conn)
+
+    '''
+    Yields rows from a pooled connection's cursor, giving the connection back when done.
+    '''
+    def read_batches(self, conn, cur, batch_size, profile=None):
+        try:
+            yield from self.fetch_batches(cur, batch_size, profile)
+        finally:
+            self.pool.release(conn)
+
+    '''
+    Stops whatever query is running on the database's own connection. The query raises
+    `sqlite3.OperationalError`. This is safe to call from any thread.
+    '''
+    def interrupt(self):
+        self.db.interrupt()
+
+    '''
+    Attaches another database file, so its tables can be used as `alias.table`. Read
+    connections get the database attached as well.
+    @param path Path of the database file
+    @param alias Name to attach the database as
+    '''
+    def attach(self, path, alias):
+        # The alias can't be passed as a parameter, so make sure it's just a name
+        if not alias.isidentifier():
+            raise ValueError('Invalid database alias `{}`'.format(alias))
+
+        self.db.execute('ATTACH DATABASE ? AS "{}"'.format(alias), (path,))
+        self.pool.attach(alias, path)
+        self.invalidate_results()
+
+    '''
+    Detaches a database attached with `attach`.
+    @param alias Name the database was attached as
+    '''
+    def detach(self, alias):
+        self.db.execute('DETACH DATABASE "{}"'.format(alias))
+        self.pool.attach(alias, None)
+        self.invalidate_results()
+
+    '''
+    Inserts many rows into a table in a single transaction. Rows are grouped into batches
+    which are each passed to `executemany`, and each batch gets one entry in the log instead
+    of one per row. If any batch fails, every row is rolled back. Inside an open transaction
+    the rows are inserted in a savepoint, and the transaction is left open.
+    @see self.transaction
+    @param table Name of the table to insert into
+    @param rows Iterable of rows, each a sequence of values in column order
+    @param batch_size Number of rows passed to `executemany` at a time
+    @param columns (optional) Names of the columns the values are for
+    @param placeholders (optional) SQL for each value, e.g. `datetime(?)`, which is `?` for
+        every value if not given. Each row holds the values bound to all of them, in order.
+    @return Number of rows inserted
+    '''
+    def insert_many(self, table, rows, batch_size=INSERT_BATCH_SIZE, columns=None, placeholders=None):
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return 0
+
+        # Column names can come from file headers, so they're quoted
+        template = 'INSERT INTO {}{} VALUES ({})'.format(table,
+            ' ({})'.format(', '.join(sql_parser.quote(column) for column in columns)) if columns else '',
+            ','.join(placeholders or ('?' for i in first)))
+        count = self.run_many(template, itertools.chain([first], rows), batch_size)
+        self.invalidate_results(table)
+
+        return count
+
+    '''
+    Updates many rows of a table at once, each picked out by its key. Rows are passed to
+    `executemany` in batches, all in a single transaction, the same way as `insert_many`.
+    @param table Name of the table to update
+    @param columns Names of the columns to set
+    @param keys Names of the columns which pick out each row
+    @param rows Iterable of rows, each the values for `columns` followed by the values for `keys`
+    @param batch_size Number of rows passed to `executemany` at a time
+    @return Number of rows updated
+    @see self.insert_many
+    '''
+    def update_many(self, table, columns, keys, rows, batch_size=INSERT_BATCH_SIZE):
+        template = 'UPDATE {} SET {} WHERE {}'.format(table,
+            ', '.join('{} = ?'.format(sql_parser.quote(column)) for column in columns),
+            ' AND '.join('{} = ?'.format(sql_parser.quote(key)) for key in keys))
+
+        count = self.run_many(template, rows, batch_size)
+        self.invalidate_results(table)
+
+        return count
+
+    '''
+    Deletes many rows of a table at once, each picked out by its key, the same way as
+    `update_many`.
+    @param table Name of the table to delete from
+    @param keys Names of the columns which pick out each row
+    @param rows Iterable of rows, each the values for `keys`
+    @param batch_size Number of rows passed to `executemany` at a time
+    @return Number of rows deleted
+    '''
+    def delete_many(self, table, keys, rows, batch_size=INSERT_BATCH_SIZE):
+        template = 'DELETE FROM {} WHERE {}'.format(table,
+            ' AND '.join('{} = ?'.format(sql_parser.quote(key)) for key in keys))
+
+        count = self.run_many(template, rows, batch_size)
+        self.invalidate_results(table)
+
+        return count
+
+    '''
+    Passes rows to `executemany` in batches, in a single transaction. Each batch gets one
+    entry in the log. If any batch fails, every batch is rolled back.
+    @param template Statement to run for each row
+    @param rows Iterable of rows of values
+    @param batch_size Number of rows passed to `executemany` at a time
+    @return Number of rows the statement changed altogether
+    '''
+    def run_many(self, template, rows, batch_size=INSERT_BATCH_SIZE):
+        rows = iter(rows)
+        count = 0
+        changes = self.db.total_changes
+        with self.transaction():
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+
+                start = time.perf_counter()
+                self.cur.executemany(template, batch)
+                count += self.cur.rowcount
+                self.log.append('{} [{} rows]'.format(template, len(batch)), template,
+                    (time.perf_counter() - start) * 1000, self.cur.rowcount)
+
+        # Triggers and foreign key actions could have changed any other table
+        if self.db.total_changes - changes > count:
+            self.invalidate_results()
+
+        return count
+
+    '''
+    Deletes the rows matching a condition a chunk at a time, committing after each chunk so
+    the journal never has to hold more than one chunk. Inside an open transaction, or with
+    writes which haven't been committed yet, each chunk is a savepoint instead, and nothing
+    is committed. Tables without rowids are deleted
+    from in one go.
+    @param table Name of the table to delete from
+    @param where (optional) Condition rows have to match, every row is deleted if not given
+    @param vals Values for the condition's placeholders
+    @param chunk_size Number of rows to delete at a time
+    @param progress (optional) Function called with the number of rows deleted so far
+    @return Number of rows deleted
+    '''
+    def delete_chunked(self, table, where=None, vals=(), chunk_size=DELETE_CHUNK_SIZE, progress=None):
+        condition = ' WHERE {}'.format(where) if where else ''
+        sql = 'DELETE FROM {0} WHERE rowid IN (SELECT rowid FROM {0}{1} LIMIT ?)'.format(table,
+            condition)
+
+        count = 0
+        while True:
+            try:
+                with self.transaction():
+                    deleted = self.changes(sql, *vals, chunk_size)
+            except sqlite3.OperationalError as e:
+                if count or 'rowid' not in str(e):
+                    raise e
+
+                # WITHOUT ROWID table
+                with self.transaction():
+                    return self.changes('DELETE FROM {}{}'.format(table, condition), *vals)
+
+            count += deleted
+            if progress is not None:
+                progress(count)
+            if deleted < chunk_size:
+                return count
+
+    '''
+    Executes a statement which changes rows, the same way as `execute`.
+    @param sql Statement to be executed
+    @param vals Tuple of values to pass into the template string
+    @return Number of rows the statement changed
+    '''
+    def changes(self, sql, *vals):
+        return self.run(sql, vals, self.cur).rowcount
+
+    '''
+    Executes a statement on the given cursor, then updates the meta tables and logs it.
+    Queries aren't logged here, their rows haven't been read yet, so whatever reads them
+    logs them with `profile`. Statements which fail are always logged.
+    @param sql Statement to be executed
+    @param vals Tuple of values to pass into the template string
+    @param cur Cursor to execute the statement on
+    @param statement (optional) The statement already classified
+    @return The cursor, ready to have its results fetched
+    '''
+    def run(self, sql, vals, cur, statement=None):
+        if statement is None:
+            statement = self.classify(sql)
 
         # Execute the statements but raise if there's an error
+        changes = self.db.total_changes
+        start = time.perf_counter()
         try:
-            if 'CREATE' in sql.upper():
+            cur.execute(sql, vals)
+        except Exception as e:
+            # Statements which fail are logged too
+            self.profile(statement, sql, vals, time.perf_counter() - start)
+            if statement.kind != 'QUERY':
+                # A failed write can roll back the whole transaction
+                self.invalidate_results()
+            raise e
+
+        if statement.kind != 'QUERY':
+            # `rowcount` is -1 for anything that doesn't change rows
+            self.profile(statement, sql, vals, time.perf_counter() - start,
+                cur.rowcount if cur.rowcount >= 0 else None)
+
+        if statement.kind != 'QUERY':
+            # Writes to one table only affect results which read it, anything else could
+            # affect any of them. So could triggers and foreign key actions, which show up
+            # as more changes than the statement made itself.
+            own_table = statement.kind == 'DML' and \
+                self.db.total_changes - changes <= max(cur.rowcount, 0)
+            self.invalidate_results(statement.table if own_table else None)
+
+        if statement.kind in ('DML', 'DDL'):
+            self.writes += 1
+            if self.first_write is None:
+                self.first_write = time.monotonic()
+
+        # Meta data is only touched once the statement has worked
+        if statement.object == 'TABLE':
+            if statement.verb == 'CREATE':
                 self.add_table_meta(sql)
-            elif 'DROP' in sql.upper():
-                self.clear_table_meta(sql.split(' ')[2])
+            elif statement.verb == 'DROP':
+                self.clear_table_meta(statement.table)
+            elif statement.verb == 'ALTER':
+                self.refresh_table_meta(statement.table)
+        elif statement.object == 'INDEX':
+            if statement.verb == 'CREATE':
+                self.add_index_meta(statement.table)
+            elif statement.verb == 'DROP':
+                self.clear_index_meta(statement.table)
 
-            self.cur.execute(sql, vals)
-            
-            # This statement is here in the event the user
-            # executes a select statement.
-            # It will either return an empty list or, on select
-            # it will return all of the items in the list.
-            return self.cur.fetchall()
-        except sqlite3.OperationalError as e:
-            # Reraise error
-            raise e
+        self.check_autocommit()
+
+        return cur
+
+    '''
+    Logs a statement that has run, with how long it took and its query plan.
+    @param statement The statement, classified
+    @param sql The statement's text
+    @param vals Values passed with the statement
+    @param seconds Time the statement took
+    @param row_count (optional) Number of rows the statement returned or changed
+    @param conn (optional) Connection the statement ran on, for working out its plan
+    '''
+    def profile(self, statement, sql, vals, seconds, row_count=None, conn=None):
+        plan = None
+        if statement.verb in PLANNED_VERBS:
+            plan = self.plan(sql, vals, conn)
+
+        self.log.append(sql_parser.format_log(statement.log_template, vals), statement.template,
+            seconds * 1000, row_count, plan)
+
+    '''
+    Works out a statement's query plan, the first time the statement is seen.
+    @param sql The statement
+    @param vals Values passed with the statement
+    @param conn (optional) Connection to use, defaults to the database's own
+    @return The steps of the plan separated by `; `, or None if there isn't one
+    '''
+    def plan(self, sql, vals, conn=None):
+        with self.plans_lock:
+            if sql in self.plans:
+                return self.plans[sql]
+
+        try:
+            steps = self.explain(sql, *vals, conn=conn)
+            plan = '; '.join(step[3] for step in steps) or None
+        except sqlite3.Error:
+            plan = None
+
+        with self.plans_lock:
+            if len(self.plans) >= self.plans_size:
+                # Forget the oldest plan
+                del self.plans[next(iter(self.plans))]
+            self.plans[sql] = plan
+
+        return plan
+
+    '''
+    Explains how sqlite will run a statement, without running it.
+    @param sql The statement
+    @param vals Values to pass with the statement
+    @param conn (optional) Connection to use, defaults to the one `borrow` gives
+    @return List of (id, parent, unused, detail) rows from `EXPLAIN QUERY PLAN`
+    '''
+    def explain(self, sql, *vals, conn=None):
+        if conn is not None:
+            return conn.execute('EXPLAIN QUERY PLAN ' + sql, vals).fetchall()
+
+        with self.borrow() as conn:
+            return conn.execute('EXPLAIN QUERY PLAN ' + sql, vals).fetchall()
+
+    '''
+    Throws away cached results.
+    @param table (optional) Table whose results to throw away, every result if not given
+    '''
+    def invalidate_results(self, table=None):
+        if self.results is None:
+            return
+
+        if table is None:
+            self.results.clear()
+        else:
+            self.results.invalidate(table)
+
+    '''
+    Returns how well the statement cache is doing.
+    @return Dictionary of hits, misses, and the current and maximum size of the cache
+    '''
+    def cache_stats(self):
+        info = self.classify.cache_info()
+
+        return {
+            'hits': info.hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'max size': info.maxsize,
+        }
+
+    '''
+    Reads or changes a storage setting.
+    @param name Name of the pragma, one of `config.PRAGMAS`
+    @param value (optional) New value for the pragma
+    @return The value of the pragma, after any change
+    @throws ValueError if the pragma can't be tuned or the value isn't valid
+    '''
+    def pragma(self, name, value=None):
+        if value is not None:
+            config.check(name, value)
+            self.db.execute('PRAGMA {} = {}'.format(name, value))
+            self.pragmas[name] = value
+
+            # Read connections share `self.pragmas`, but ones already open need remaking.
+            # There's no pool yet while the database is being set up.
+            if name in CONNECTION_PRAGMAS and getattr(self, 'owns_pool', False):
+                self.pool.refresh()
+
+        config.check(name, 0)
+        row = self.db.execute('PRAGMA {}'.format(name)).fetchone()
+
+        # Some pragmas, like mmap_size on in-memory databases, have nothing to report
+        return row[0] if row else None
 
     '''
-    Commits changes to the database.
+    Applies a storage settings profile.
+    @param profile Name of the profile
+    @see config.PROFILES
+    '''
+    def use_profile(self, profile):
+        for name, value in config.ordered(config.resolve(profile)):
+            self.pragma(name, value)
+
+    '''
+    Commits changes to the database. This ends any transaction opened with `begin` and
+    releases all savepoints.
     '''
     def commit(self):
+        if self.inner_savepoint is not None:
+            # Only ends the transaction opened inside a nested one
+            self.release(self.inner_savepoint)
+            self.inner_savepoint = None
+            return
+
         self.db.commit()
+        self.end_transaction()
+
+    '''
+    Opens a transaction. Automatic commits are held off until the transaction is ended
+    with `commit` or `rollback`. Changes made before the transaction was opened which
+    haven't been committed are committed along with it, but `rollback` leaves them be.
+    @param nested Whether `begin`, `commit` and `rollback` can be used inside the
+        transaction, e.g. by a script run in one. They work on a savepoint instead, and
+        the transaction itself is ended with `end_nested`.
+    @throws sqlite3.OperationalError if a transaction is already open
+    '''
+    def begin(self, nested=False):
+        if self.nested and self.inner_savepoint is None:
+            self.inner_savepoint = 'sqlos_inner'
+            self.savepoint(self.inner_savepoint)
+            return
+        if self.explicit:
+            raise sqlite3.OperationalError('A transaction is already open, use a savepoint instead.')
+
+        if self.db.in_transaction:
+            self.begin_savepoint = 'sqlos_begin'
+            self.db.execute('SAVEPOINT "{}"'.format(self.begin_savepoint))
+        else:
+            self.db.execute('BEGIN')
+        self.explicit = True
+        self.nested = nested
+
+    '''
+    Ends a transaction opened with `begin(nested=True)`, along with any transaction left
+    open inside it.
+    @param commit Whether to commit the changes, rather than roll them back
+    '''
+    def end_nested(self, commit):
+        self.inner_savepoint = None
+        if commit:
+            self.commit()
+        else:
+            self.rollback()
+
+    '''
+    Rolls back the transaction, or everything after a savepoint.
+    @param savepoint (optional) Name of the savepoint to roll back to. The savepoint stays
+        open, the transaction carries on.
+    '''
+    def rollback(self, savepoint=None):
+        if savepoint is None and self.inner_savepoint is not None:
+            # Only rolls back the transaction opened inside a nested one
+            savepoint, self.inner_savepoint = self.inner_savepoint, None
+            self.rollback(savepoint)
+            self.release(savepoint)
+            return
+
+        if savepoint is None:
+            if self.begin_savepoint is not None:
+                self.db.execute('ROLLBACK TO "{}"'.format(self.begin_savepoint))
+                self.db.execute('RELEASE "{}"'.format(self.begin_savepoint))
+            else:
+                self.db.rollback()
+            self.end_transaction()
+        else:
+            self.db.execute('ROLLBACK TO "{}"'.format(savepoint))
+            # Savepoints opened after this one are gone
+            del self.savepoints[self.savepoints.index(savepoint)+1:]
+
+        # The meta tables may have been rolled back as well
+        self.load_schema()
+        self.invalidate_results()
+
+    '''
+    Opens a savepoint, which can be rolled back to without ending the transaction. A
+    transaction is opened first if there isn't one.
+    @param name Name of the savepoint
+    '''
+    def savepoint(self, name):
+        if not self.explicit:
+            self.begin()
+
+        self.db.execute('SAVEPOINT "{}"'.format(name))
+        self.savepoints.append(name)
+
+    '''
+    Releases a savepoint, keeping its changes as part of the transaction. Savepoints opened
+    after it are released as well.
+    @param name Name of the savepoint
+    '''
+    def release(self, name):
+        self.db.execute('RELEASE "{}"'.format(name))
+        del self.savepoints[self.savepoints.index(name):]
+
+    '''
+    Context manager wrapping a block in a transaction. The transaction is committed when
+    the block finishes and rolled back if it raises. Inside another transaction, including
+    one sqlite opened for writes which haven't been committed yet, the block runs in a
+    savepoint instead. Only its own changes are rolled back, and nothing is committed.
+    '''
+    @contextlib.contextmanager
+    def transaction(self):
+        if self.explicit or self.db.in_transaction:
+            name = 'sqlos_{}'.format(len(self.savepoints))
+            self.db.execute('SAVEPOINT "{}"'.format(name))
+            self.savepoints.append(name)
+            try:
+                yield self
+            except BaseException as e:
+                self.rollback(name)
+                self.release(name)
+                raise e
+
+            self.release(name)
+        else:
+            self.begin()
+            try:
+                yield self
+            except BaseException as e:
+                self.rollback()
+                raise e
+
+            self.commit()
+
+    '''
+    Sets up automatic commits. Outside of transactions opened with `begin`, writes are
+    committed once `every` of them have built up, or once the oldest uncommitted write is
+    `ms` milliseconds old. This is checked every time a statement runs. Anything which waits
+    between statements, like the shell waiting for input, should check again once
+    `autocommit_due` says the writes are old enough. Passing neither turns automatic commits
+    off, which leaves commits to the user.
+    @param every (optional) Number of writes to commit after
+    @param ms (optional) Age in milliseconds of the oldest write to commit after
+    '''
+    def autocommit(self, every=None, ms=None):
+        self.autocommit_every = every
+        self.autocommit_ms = ms
+
+    def check_autocommit(self):
+        # Committing would end any savepoint `transaction` is running in
+        if self.explicit or self.savepoints or not self.writes:
+            return
+
+        if self.autocommit_every and self.writes >= self.autocommit_every:
+            self.commit()
+        elif self.autocommit_ms is not None and \
+                (time.monotonic() - self.first_write) * 1000 >= self.autocommit_ms:
+            self.commit()
+
+    '''
+    Works out how long until the uncommitted writes are old enough to be committed
+    automatically.
+    @return Seconds until `check_autocommit` will commit, 0 if it's overdue, or None if
+        nothing is waiting to be committed after `ms`
+    '''
+    def autocommit_due(self):
+        if self.explicit or self.savepoints or not self.writes or self.autocommit_ms is None:
+            return None
+
+        return max(0, self.autocommit_ms / 1000 - (time.monotonic() - self.first_write))
+
+    '''
+    Resets the transaction state once a transaction is over.
+    '''
+    def end_transaction(self):
+        self.explicit = False
+        self.savepoints = []
+        self.begin_savepoint = None
+        self.nested = False
+        self.inner_savepoint = None
+        self.writes = 0
+        self.first_write = None
     
     '''
     Inserts information into a meta table that keeps track of each column per table.
@@ -119,49 +1058,109 @@ class Database():
     '''
     def add_table_meta(self, decl: str):
         # Parse declaration to create the table's meta data
-        data = decl.replace('CREATE', '').replace('TABLE', '').strip()
-        data_dict = data.split(' ')
-        table_name = data_dict[0]
-        row_str = ' '.join(i for i in data_dict[1:])
-        row_str = row_str.replace('(', '').replace(')', '').strip()
-        table_rows = row_str.split(',')
+        table = sql_parser.parse_create_table(decl)
+        table_name = table.name
+
+        # IF NOT EXISTS on a table that exists doesn't change anything
+        if table.if_not_exists and table_name in self.schema:
+            return
 
         i_table_meta = '''
-INSERT INTO tables_meta VALUES ('{}')'''.format(table_name)
+INSERT INTO tables_meta VALUES (?)'''
         
         columns = []
-        for row in table_rows:
-            if 'FOREIGN KEY' in row.upper():
-                continue
-            row_s = row.strip().split(' ')
-            row_name = row_s[0]
-            row_type = row_s[1]
-            row_nullable = not int('IS NULL' in row.upper())
-            row_unique = int('UNIQUE' in row.upper())
-            row_primary_key = int('PRIMARY KEY' in row.upper())
-
-            columns.append([row_name, row_type, row_nullable, row_unique, row_primary_key, table_name])
+        for column in table.columns:
+            row_type = column.type
+            if column.type_params:
+                row_type += '({})'.format(','.join(column.type_params))
+            row_nullable = int(not column.not_null)
+            row_unique = int(column.unique)
+            row_primary_key = int(column.primary_key)
+
+            columns.append([column.name, row_type, row_nullable, row_unique, row_primary_key, table_name])
         
 
         i_column_meta = '''
 INSERT INTO columns_meta (name, type, is_null, is_unique, is_primary_key, table_name) VALUES ({})'''.format(','.join('?' for i in range(6)))
         
-        self.cur.execute(i_table_meta)
-        self.cur.executemany(i_column_meta, columns)
+        self.db.execute(i_table_meta, (table_name,))
+        self.db.executemany(i_column_meta, columns)
+
+        # CREATE TABLE ... AS SELECT has no column definitions to go on, so leave
+        # it for the PRAGMA fallback
+        if columns:
+            self.schema[table_name] = tuple((table_name, *column[:5]) for column in columns)
     
     '''
-    Returns table meta data from the internal database.
+    Returns table meta data. The meta data is served from `self.schema`, only tables which
+    aren't in the meta tables are looked up with `PRAGMA table_info` (if the fallback is on).
+    @param name Name of the table
+    @return List of (table, column, type, is_null, is_unique, is_primary_key) tuples, empty
+        if the table doesn't exist
     '''
     def get_table_meta(self, name):
-        sql = '''
-SELECT tables_meta.name, columns_meta.name, type, is_null, is_unique, is_primary_key FROM tables_meta
-LEFT JOIN columns_meta
-WHERE table_name = tables_meta.name
-AND table_name = '{}'
-'''.format(name)
+        if getattr(self.local, 'reading', False):
+            # `self.schema` belongs to the database's own connection, so reads on other
+            # threads look the table up on their read connection instead
+            with self.borrow() as conn:
+                columns = conn.execute(SCHEMA_QUERY + 'AND tables_meta.name = ?', (name,)).fetchall()
+                if not columns and self.schema_fallback:
+                    columns = self.table_info(conn, name)
+
+            return list(columns)
+
+        # Another session could have changed the table, the same way `cached_result`
+        # checks the data version
+        if self.db.execute('PRAGMA schema_version').fetchone()[0] != self.schema_version:
+            self.load_schema()
 
-        return self.cur.execute(sql).fetchall()
+        if name not in self.schema and self.schema_fallback:
+            columns = self.table_info(self.db, name)
+            if columns:
+                self.schema[name] = columns
+
+        return list(self.schema.get(name, ()))
+
+    '''
+    Looks up a table's columns with `PRAGMA table_info`, for tables missing from the meta
+    tables. Nothing is known about which columns are unique.
+    @param conn Connection to look the table up on
+    @param name Name of the table
+    @return Tuple of (table, column, type, is_null, is_unique, is_primary_key) tuples
+    '''
+    def table_info(self, conn, name):
+        return tuple((name, column[1], column[2], int(not column[3]), 0, int(column[5] > 0))
+            for column in conn.execute('SELECT * FROM pragma_table_info(?)', (name,)))
     
+    '''
+    Rewrites a table's columns in the meta tables from what sqlite says they are, for
+    changes which have no CREATE TABLE to parse, like ALTER TABLE. A table which isn't
+    there any more, e.g. because it was renamed, is removed from the meta tables.
+    @param name Name of the table
+    '''
+    def refresh_table_meta(self, name):
+        if not self.db.execute('''SELECT count(*) FROM tables_meta WHERE name = ?''', (name,)).fetchone()[0]:
+            # Not in the meta tables, the PRAGMA fallback looks it up
+            self.schema.pop(name, None)
+            return
+
+        # sqlite doesn't say which columns are unique, so keep what the meta tables said
+        unique = dict(self.db.execute('''SELECT name, is_unique FROM columns_meta WHERE table_name = ?''', (name,)))
+        columns = [(column[1], column[2], int(not column[3]), unique.get(column[1], 0), int(column[5] > 0), name)
+            for column in self.db.execute('SELECT * FROM pragma_table_info(?)', (name,))]
+        if not columns:
+            self.clear_table_meta(name)
+            return
+
+        self.db.execute('''DELETE FROM columns_meta WHERE table_name = ?''', (name,))
+        self.db.executemany('''
+INSERT INTO columns_meta (name, type, is_null, is_unique, is_primary_key, table_name) VALUES (?,?,?,?,?,?)''', columns)
+        self.schema[name] = tuple((name, *column[:5]) for column in columns)
+
+    '''
+    Removes a table from the meta tables.
+    @param name Name of the table
+    '''
     def clear_table_meta(self, name):
         clear_table = '''
 DELETE FROM tables_meta WHERE name='{}'
@@ -171,19 +1170,93 @@ DELETE FROM tables_meta WHERE name='{}'
 DELETE FROM columns_meta WHERE table_name='{}'
 '''.format(name)
 
-        self.cur.execute(clear_table)
-        self.cur.execute(clear_columns)
-        self.db.commit()
+        self.db.execute(clear_table)
+        self.db.execute(clear_columns)
+        # Dropping a table drops its indexes
+        self.db.execute('''DELETE FROM indexes_meta WHERE table_name = ?''', (name,))
+
+        self.schema.pop(name, None)
+
+    '''
+    Creates an index on a table. The index is added to the meta tables when it's executed.
+    @param table Name of the table
+    @param columns List of the columns to index, in order
+    @param name (optional) Name of the index, made up from the table and columns if not given
+    @param unique Whether the index is unique
+    @return Name of the index
+    '''
+    def create_index(self, table, columns, name=None, unique=False):
+        if name is None:
+            name = 'idx_{}_{}'.format(table, '_'.join(columns))
+
+        self.execute('''CREATE {}INDEX IF NOT EXISTS {} ON {} ({})'''.format(
+            'UNIQUE ' if unique else '', sql_parser.quote(name), sql_parser.quote(table),
+            ', '.join(sql_parser.quote(column) for column in columns)))
+
+        return name
+
+    '''
+    Drops an index. The index is removed from the meta tables when it's executed.
+    @param name Name of the index
+    '''
+    def drop_index(self, name):
+        self.execute('''DROP INDEX {}'''.format(sql_parser.quote(name)))
+
+    '''
+    Returns the indexes in the meta tables.
+    @param table (optional) Only return the indexes on this table
+    @return List of (name, table, columns, is_unique) tuples, where columns is a list
+    '''
+    def get_indexes(self, table=None):
+        if table is None:
+            rows = self.db.execute('''SELECT * FROM indexes_meta ORDER BY table_name, name''')
+        else:
+            rows = self.db.execute('''SELECT * FROM indexes_meta WHERE table_name = ? ORDER BY name''',
+                (table,))
+
+        return [(name, table_name, columns.split(', '), is_unique)
+            for name, table_name, columns, is_unique in rows]
+
+    '''
+    Adds an index to the meta tables. The index's details are read from sqlite, so it must
+    already exist.
+    @param name Name of the index
+    '''
+    def add_index_meta(self, name):
+        row = self.db.execute('''SELECT tbl_name FROM sqlite_master WHERE type = 'index' AND name = ?''',
+            (name,)).fetchone()
+        if row is None:
+            return
+        table = row[0]
+
+        # Indexes on expressions have no column name
+        columns = [column or '<expression>' for column, in self.db.execute(
+            '''SELECT name FROM pragma_index_info(?) ORDER BY seqno''', (name,))]
+        unique = self.db.execute('''SELECT "unique" FROM pragma_index_list(?) WHERE name = ?''',
+            (table, name)).fetchone()
+
+        self.db.execute('''INSERT OR REPLACE INTO indexes_meta VALUES (?, ?, ?, ?)''',
+            (name, table, ', '.join(columns), unique[0] if unique else 0))
+
+    '''
+    Removes an index from the meta tables.
+    @param name Name of the index
+    '''
+    def clear_index_meta(self, name):
+        self.db.execute('''DELETE FROM indexes_meta WHERE name = ?''', (name,))
     
     '''
     Write logs to the databse then close the datatbase
     '''
     def __del__(self):
-        # Let's save those logs!
-        # Create a tuple for our logs
-        logs = [tuple([log]) for log in self.log[self.num_logs:]]
+        # Commit first so the log's writer isn't blocked by our own transaction
+        self.db.commit()
 
-        self.cur.executemany('''INSERT INTO logs VALUES (?)''', logs)
+        # Let's save those logs!
+        self.log.close()
         self.db.commit()
+
+        if self.owns_pool:
+            self.pool.close()
         
-        #self.db.close()
\ No newline at end of file
+        #self.db.close()
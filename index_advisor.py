@@ -0,0 +1,130 @@
+import sqlite3
+from collections import namedtuple
+
+import sql_parser
+from query_log import full_scans
+
+'''
+Suggests indexes from the statements in the query log. Statements whose plans read a whole
+table are grouped by the table and the columns they filter on (or sort on, if they don't
+filter), and each group is tried out with a temporary index to see whether sqlite would
+use it. The benefit is estimated from how long the statements took and how few of the
+table's rows they actually needed.
+'''
+
+# Fewest times statements have to have run before an index is suggested for them
+ADVISE_MIN_CALLS = 2
+# Name of the index made while trying out a suggestion
+TRIAL_INDEX = 'sqlos_advisor_trial'
+
+'''
+An index the advisor thinks is worth making.
+table -> Table to index
+columns -> Columns to index, in order
+calls -> Number of logged statements which would use it
+total_ms -> Milliseconds those statements took altogether
+saved_ms -> Estimate of the milliseconds the index would have saved
+plan -> Query plan of one of the statements with the index in place
+'''
+Suggestion = namedtuple('Suggestion', ['table', 'columns', 'calls', 'total_ms', 'saved_ms', 'plan'])
+
+'''
+Groups logged statements which read whole tables by the index that could help them.
+@param entries Entries from `QueryLog.profiles`
+@return Dictionary of (table, columns) to a list of the number of statements, their total
+    milliseconds, the total rows they returned, and one of their templates
+'''
+def candidates(entries):
+    groups = {}
+    for message, template, duration_ms, row_count, plan in entries:
+        if template is None or not full_scans(plan):
+            continue
+
+        table = sql_parser.classify(template).table
+        found = sql_parser.query_columns(template)
+        if table is None or found is None:
+            continue
+
+        # Columns compared to one value can all be used, but only the first range
+        equality, ranges, order = found
+        columns = equality + ranges[:1] or order
+        # A column only needs to be in the index once
+        columns = tuple(dict.fromkeys(columns))
+        if not columns:
+            continue
+
+        group = groups.setdefault((table, columns), [0, 0.0, 0, template])
+        group[0] += 1
+        group[1] += duration_ms
+        group[2] += row_count or 0
+
+    return groups
+
+'''
+Works out which indexes would help the logged statements most.
+@param db Database the statements ran on
+@param entries Entries from `QueryLog.profiles`
+@param min_calls Fewest statements an index has to help
+@return List of Suggestions, biggest estimated saving first
+'''
+def advise(db, entries, min_calls=ADVISE_MIN_CALLS):
+    suggestions = []
+    for (table, columns), (calls, total_ms, rows, template) in candidates(entries).items():
+        if calls < min_calls or covered(db, table, columns):
+            continue
+
+        # Skip anything that isn't a plain column of the table, like an alias
+        known = [column[1] for column in db.get_table_meta(table)]
+        if not all(column in known for column in columns):
+            continue
+
+        plan = trial_plan(db, table, columns, template)
+        if plan is None or full_scans(plan):
+            # sqlite wouldn't use the index
+            continue
+
+        table_rows = db.db.execute('SELECT count(*) FROM {}'.format(sql_parser.quote(table))).fetchone()[0]
+        if table_rows == 0:
+            continue
+
+        # Without the index every row is read, with it only the rows that are needed
+        needed = min(1.0, rows / calls / table_rows)
+        suggestions.append(Suggestion(table, columns, calls, total_ms, total_ms * (1 - needed), plan))
+
+    return sorted(suggestions, key=lambda suggestion: -suggestion.saved_ms)
+
+'''
+Checks whether an existing index already starts with the columns.
+'''
+def covered(db, table, columns):
+    for name, in db.db.execute('SELECT name FROM pragma_index_list(?)', (table,)).fetchall():
+        indexed = [row[0] for row in db.db.execute(
+            'SELECT name FROM pragma_index_info(?) ORDER BY seqno', (name,))]
+        if tuple(indexed[:len(columns)]) == columns:
+            return True
+
+    return False
+
+'''
+Finds the plan a statement would get with an index on the columns. The index is made in a
+savepoint which is rolled back straight away, so nothing is left behind, but making it
+still reads the whole table.
+@param db Database to try the index on
+@param table Table to index
+@param columns Columns to index
+@param template Statement to plan, with `?` for its values
+@return The plan, or None if it couldn't be worked out
+'''
+def trial_plan(db, table, columns, template):
+    db.db.execute('SAVEPOINT sqlos_advisor')
+    try:
+        db.db.execute('CREATE INDEX {} ON {} ({})'.format(TRIAL_INDEX, sql_parser.quote(table),
+            ', '.join(sql_parser.quote(column) for column in columns)))
+        steps = db.explain(template, *[None] * template.count('?'))
+
+        return '; '.join(step[3] for step in steps)
+    except sqlite3.Error:
+        return None
+    finally:
+        db.db.execute('ROLLBACK TO sqlos_advisor')
+        db.db.execute('RELEASE sqlos_advisor')
@@ -1,21 +1,68 @@
+import argparse
+import asyncio
+import io
 import sys
-from database import Database
+from client import SERVER_ADDRESS
+from config import load_config
+from database import Database, DATABASE_PATH
 from command_line import CommandLine, ExitException
+from server import Server
 
 def main(args):
     #return test_database()
+
+    try:
+        options = load_config()
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    if args['serve']:
+        try:
+            asyncio.run(Server(args['database'], args['serve'], **options).serve())
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+        return 0
     
-    cl = CommandLine(db = Database())
+    cl = CommandLine(db = Database(path=args['database'], **options))
     #cl.parse_command('database', ['dump'])
     #return
+
+    # Anything to run means there's no need for the interactive shell
+    script = None
+    if args['command']:
+        script = io.StringIO('\n'.join(args['command']))
+    elif args['file']:
+        script = open(args['file'])
+    elif not sys.stdin.isatty():
+        script = sys.stdin
+
+    if script is not None:
+        try:
+            return cl.run_script(script, transaction=not args['no_transaction'])
+        finally:
+            if script is not sys.stdin:
+                script.close()
+            cl.__del__()
+
     try:
         cl.loop()
     except (ExitException, KeyboardInterrupt):
         cl.__del__()
-        return
+        return 0
 
 def arg_parser(args):
-    return {}
+    parser = argparse.ArgumentParser(prog='sqlos', description='SQL shell. Runs interactively '
+        'unless commands are given with -c, -f or piped into stdin.')
+    parser.add_argument('-c', '--command', action='append', help='Command to run, can be given more than once')
+    parser.add_argument('-f', '--file', help='Script of commands to run, one per line')
+    parser.add_argument('-d', '--database', default=DATABASE_PATH, help='Database file to use')
+    parser.add_argument('--no-transaction', action='store_true',
+        help='Commit as commands run instead of running the whole script in one transaction')
+    parser.add_argument('--serve', nargs='?', const=SERVER_ADDRESS, metavar='ADDRESS',
+        help='Run as a server for `client.py` on a Unix socket path or host:port (default: {})'.format(SERVER_ADDRESS))
+
+    return vars(parser.parse_args(args[1:]))
 
 if __name__ == "__main__":
-    main(arg_parser(sys.argv))
+    sys.exit(main(arg_parser(sys.argv)))
@@ -0,0 +1,292 @@
+import concurrent.futures
+import contextlib
+import sys
+import threading
+
+from util import format_cell, pretty_print_table
+
+'''
+Output for the shell and its commands. Commands print like normal, but while the shell is
+running them `sys.stdout` is swapped for an `OutputRouter`, which sends each thread's output
+wherever that thread has been redirected to. That's how a command's output is batched into
+fewer writes to the terminal, kept in a background job's buffer, or handed to another command.
+'''
+
+# Characters of output kept by a batched output before it's written out
+OUTPUT_BATCH_SIZE = 65536
+
+# Guards installing and removing the router
+ROUTER_LOCK = threading.Lock()
+# Cancellations for the commands which can be given up on, by the id of the thread running them
+CANCELLATIONS = {}
+
+'''
+Raised in a command's thread once the shell has given up on the command, e.g. because the
+user pressed Ctrl-C. It's raised the next time the command prints or asks for input.
+'''
+class Cancelled(BaseException):
+    pass
+
+'''
+Lets the shell give up on a command running on another thread. Python can't stop a thread,
+so the command stops itself the next time it prints or asks for input.
+'''
+class Cancellation():
+    '''
+    @param read (optional) Function `ask` reads a line with, taking the prompt and this
+        cancellation. It should stop waiting once the command is cancelled. Lines are read
+        with `input` if not given.
+    '''
+    def __init__(self, read=None):
+        self.read = read
+        # Done once the command is cancelled, so it can be waited on along with the input
+        self.future = concurrent.futures.Future()
+
+    def cancel(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+    def cancelled(self):
+        return self.future.done()
+
+    '''
+    @throws Cancelled if the command has been cancelled
+    '''
+    def check(self):
+        if self.future.done():
+            raise Cancelled()
+
+'''
+Buffer of output, kept as a list of chunks so big outputs aren't copied every write.
+'''
+class Output():
+    '''
+    @param stream (optional) Where the output goes when it's flushed. Redirecting to an output
+        without a stream sets it to wherever the thread was writing before.
+    @param batch_size (optional) Size the buffer can reach before it's flushed, or None to
+        keep everything until it's flushed or read
+    @param keep Whether everything is kept until it's read, flushing does nothing
+    @param keep_rows Whether rows a command emits are kept as rows instead of printed
+    '''
+    def __init__(self, stream=None, batch_size=None, keep=False, keep_rows=False):
+        self.stream = stream
+        self.batch_size = batch_size
+        self.keep = keep
+        self.keep_rows = keep_rows
+
+        self.chunks = []
+        self.size = 0
+        self.lock = threading.Lock()
+
+        # Rows emitted by a command, when `keep_rows` is set
+        self.columns = None
+        self.rows = None
+
+    def write(self, text):
+        with self.lock:
+            self.chunks.append(text)
+            self.size += len(text)
+            due = self.batch_size is not None and self.size >= self.batch_size
+
+        if due:
+            self.flush()
+
+        return len(text)
+
+    '''
+    Empties the buffer.
+    @return Everything written since the last read or flush
+    '''
+    def read(self):
+        with self.lock:
+            chunks, self.chunks = self.chunks, []
+            self.size = 0
+
+        return ''.join(chunks)
+
+    '''
+    @return Everything in the buffer, leaving it there
+    '''
+    def getvalue(self):
+        with self.lock:
+            return ''.join(self.chunks)
+
+    '''
+    Writes the buffer to the output's stream in one go.
+    '''
+    def flush(self):
+        if self.keep:
+            return
+
+        text = self.read()
+        stream = sys.stdout if self.stream is None else self.stream
+        if text:
+            stream.write(text)
+        stream.flush()
+
+    '''
+    Hands the output over to the next command in a pipeline. Text is passed on as rows of
+    one line each, with no column names.
+    @return Tuple of the column names and the rows
+    '''
+    def piped(self):
+        if self.rows is not None:
+            return self.columns, self.rows
+
+        return None, ((line,) for line in self.read().splitlines())
+
+    def __len__(self):
+        return self.size
+
+    # Anything else, like `isatty`, is answered by the stream
+    def __getattr__(self, name):
+        return getattr(sys.stdout if self.stream is None else self.stream, name)
+
+'''
+Stands in for `sys.stdout`. Writes from a redirected thread go to that thread's output,
+writes from any other thread go to the real stdout.
+'''
+class OutputRouter():
+    def __init__(self, stream):
+        self.stream = stream
+        self.routes = {}
+
+    def target(self):
+        return self.routes.get(threading.get_ident(), self.stream)
+
+    def write(self, text):
+        check_cancelled()
+        return self.target().write(text)
+
+    def flush(self):
+        self.target().flush()
+
+    # Anything else is handled by the real stdout
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+'''
+@return Where anything the current thread prints ends up
+'''
+def current():
+    if isinstance(sys.stdout, OutputRouter):
+        return sys.stdout.target()
+
+    return sys.stdout
+
+'''
+Sends everything the current thread prints to an output until the block ends. Redirects can
+be nested. The router is put in place by the first redirect and taken away after the last.
+@param output Output to send to
+'''
+@contextlib.contextmanager
+def redirect(output):
+    ident = threading.get_ident()
+    with ROUTER_LOCK:
+        router = sys.stdout
+        if not isinstance(router, OutputRouter):
+            router = OutputRouter(router)
+            sys.stdout = router
+
+        previous = router.routes.get(ident)
+        if output.stream is None:
+            output.stream = router.stream if previous is None else previous
+        router.routes[ident] = output
+
+    try:
+        yield output
+    finally:
+        with ROUTER_LOCK:
+            if previous is None:
+                del router.routes[ident]
+            else:
+                router.routes[ident] = previous
+
+            if not router.routes and sys.stdout is router:
+                sys.stdout = router.stream
+
+'''
+Lets the shell cancel whatever the current thread runs until the block ends.
+@param cancellation Cancellation the shell will use
+'''
+@contextlib.contextmanager
+def cancellable(cancellation):
+    ident = threading.get_ident()
+    CANCELLATIONS[ident] = cancellation
+    try:
+        yield cancellation
+    finally:
+        del CANCELLATIONS[ident]
+
+'''
+@throws Cancelled if the shell has given up on what the current thread is running
+'''
+def check_cancelled():
+    cancellation = CANCELLATIONS.get(threading.get_ident())
+    if cancellation is not None:
+        cancellation.check()
+
+'''
+Asks the user for a line of input on behalf of a command. Commands should use this instead
+of `input`, so the shell can give up on a command which is waiting for an answer.
+@param prompt (optional) Prompt to show
+@return The line the user typed
+@throws Cancelled if the shell gives up on the command
+@throws EOFError if there's no more input
+'''
+def ask(prompt=''):
+    cancellation = CANCELLATIONS.get(threading.get_ident())
+    if cancellation is None or cancellation.read is None:
+        return input(prompt)
+
+    cancellation.check()
+    return cancellation.read(prompt, cancellation)
+
+'''
+Collects what the current thread prints, in batches. The batch is written out whenever it
+reaches `batch_size` and when the block ends.
+'''
+@contextlib.contextmanager
+def buffered(batch_size=OUTPUT_BATCH_SIZE):
+    output = Output(batch_size=batch_size)
+    try:
+        with redirect(output):
+            yield output
+    finally:
+        output.flush()
+
+'''
+Keeps everything the current thread prints, without writing it anywhere.
+@param keep_rows Whether rows emitted with `emit` are kept as rows instead of printed
+'''
+@contextlib.contextmanager
+def capture(keep_rows=False):
+    with redirect(Output(keep=True, keep_rows=keep_rows)) as output:
+        yield output
+
+'''
+Outputs a command's rows. Normally they're printed as a table, but if the output is keeping
+rows they're handed over as they are, without being read. Rows without column names, like
+lines of text piped from another command, are printed as plain lines.
+@param rows Iterable of rows
+@param columns (optional) Names of the columns
+@param options Passed on to `pretty_print_table`
+@return Number of rows printed, or None if the rows were kept
+@see util.pretty_print_table
+'''
+def emit(rows, columns=None, **options):
+    output = current()
+    if isinstance(output, Output) and output.keep_rows:
+        output.columns = list(columns) if columns else None
+        output.rows = rows
+        return None
+
+    if columns is None:
+        count = 0
+        for row in rows:
+            print(' '.join(format_cell(cell) for cell in row))
+            count += 1
+
+        return count
+
+    return pretty_print_table(rows, columns, ask=ask, **options)
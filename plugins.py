@@ -0,0 +1,173 @@
+import ast
+import builtins
+import json
+import os
+import time
+from importlib import import_module
+
+'''
+Finds the shell's commands without importing them. Each module in the commands package is
+read with `ast` to find the `Command` classes in it and the names they're invoked by, and
+the results are kept in a manifest file so the modules are only read again when they
+change. The shell registers a `LazyCommand` for each one, which imports the module the
+first time the command is used.
+'''
+
+COMMANDS_PATH = 'commands'
+# Manifest of the commands in each module, kept with the rest of Python's caches
+MANIFEST_FILE = os.path.join(COMMANDS_PATH, '__pycache__', 'sqlos_manifest.json')
+# Base classes which make a class a command
+COMMAND_BASES = ('Command',)
+
+'''
+Stands in for a command until it's first used. Looking up anything on it other than its
+name imports the command's module and hands over to the real command.
+'''
+class LazyCommand():
+    '''
+    @param name Name the command is invoked by
+    @param module Name of the module with the command in it
+    @param class_name Name of the command's class
+    '''
+    def __init__(self, name, module, class_name):
+        self.name = name
+        self.module = module
+        self.class_name = class_name
+        self.command = None
+        # Seconds it took to import the module and make the command
+        self.load_time = None
+
+    '''
+    Imports the command's module and makes the command, the first time it's called.
+    @return The real command
+    '''
+    def load(self):
+        if self.command is None:
+            start = time.perf_counter()
+            cls = getattr(import_module(self.module), self.class_name)
+            self.command = cls()
+            self.load_time = time.perf_counter() - start
+
+        return self.command
+
+    def __call__(self, cl, args):
+        return self.load()(cl, args)
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+'''
+Finds every command in the commands package, using the manifest for modules that haven't
+changed since it was written. The manifest is updated if anything has changed.
+@param path Directory of the commands package
+@param manifest_file Path of the manifest
+@return Dictionary of module name to a dictionary of command name to class name. Modules
+    which couldn't be read map to None and have to be imported to find their commands.
+'''
+def find_commands(path=COMMANDS_PATH, manifest_file=MANIFEST_FILE):
+    manifest = load_manifest(manifest_file)
+    found = {}
+    changed = False
+
+    for filename in sorted(os.listdir(path)):
+        if not filename.endswith('.py') or filename == '__init__.py':
+            continue
+
+        module = '{}.{}'.format(os.path.basename(os.path.normpath(path)), filename[:-3])
+        stat = os.stat(os.path.join(path, filename))
+        entry = manifest.get(module)
+        if entry is None or entry['mtime'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+            entry = {
+                'mtime': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'commands': scan_module(os.path.join(path, filename)),
+            }
+            changed = True
+
+        found[module] = entry
+
+    if changed or len(found) != len(manifest):
+        save_manifest(manifest_file, found)
+
+    return {module: entry['commands'] for module, entry in found.items()}
+
+'''
+Reads a module's source to find its commands. Classes only count as commands if it's
+clear from the source, so a class whose base comes from somewhere else, like another module,
+means the module has to be imported to find out.
+@param path Path of the module
+@return Dictionary of command name to class name, or None if the module's commands or their
+    names couldn't be worked out without running the module
+'''
+def scan_module(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            tree = ast.parse(f.read(), path)
+    except (OSError, SyntaxError, ValueError):
+        return None
+
+    commands = {}
+    # Classes defined in the module so far, and whether each one is a command
+    classes = {}
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+
+        bases = [base.attr if isinstance(base, ast.Attribute) else getattr(base, 'id', None)
+            for base in node.bases]
+        for base in bases:
+            # Anything but a command base, a class from this module or a builtin could be
+            # a subclass of `Command`
+            if base is None or (base not in COMMAND_BASES and base not in classes
+                    and not hasattr(builtins, base)):
+                return None
+
+        classes[node.name] = any(base in COMMAND_BASES or classes.get(base) for base in bases)
+        if not classes[node.name]:
+            continue
+
+        name = command_name(node)
+        if name is None:
+            return None
+        commands[name] = node.name
+
+    return commands
+
+'''
+Finds the name a command class gives to `Command.__init__`, e.g. `'database'` from
+`super(DatabaseCommand, self).__init__('database', ...)`.
+@param node Class definition
+@return The command's name, or None if it isn't a plain string
+'''
+def command_name(node):
+    for item in node.body:
+        if not isinstance(item, ast.FunctionDef) or item.name != '__init__':
+            continue
+
+        for call in ast.walk(item):
+            if (isinstance(call, ast.Call) and isinstance(call.func, ast.Attribute)
+                    and call.func.attr == '__init__' and isinstance(call.func.value, ast.Call)
+                    and getattr(call.func.value.func, 'id', None) == 'super'):
+                if call.args and isinstance(call.args[0], ast.Constant) \
+                        and isinstance(call.args[0].value, str):
+                    return call.args[0].value
+
+                return None
+
+    return None
+
+def load_manifest(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(path, manifest):
+    # The manifest is only a cache, so it doesn't matter if it can't be written
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+    except OSError:
+        pass
@@ -0,0 +1,137 @@
+import os
+import queue
+import sqlite3
+import threading
+import urllib.parse
+
+# Most read connections a database keeps open at once
+POOL_SIZE = 4
+# Pragmas which are set per connection, so read connections need them too
+CONNECTION_PRAGMAS = ('cache_size', 'mmap_size', 'temp_store')
+
+'''
+Pool of read-only connections to a database file. Writes always go through the database's
+own connection, reads can borrow a connection from here so they can run on other threads
+at the same time. Connections are made the first time they're needed, up to `size` of them.
+Borrowing when every connection is in use waits until one is given back.
+
+In-memory databases only exist on the connection that made them, so for those the pool
+hands out the database's own connection instead.
+'''
+class ConnectionPool():
+    '''
+    @param path Path of the database file
+    @param writer The database's own connection
+    @param size Most connections to open
+    @param pragmas Storage settings to apply to each connection. The dictionary is kept, not
+        copied, so the database's own settings can be shared and changed later.
+    '''
+    def __init__(self, path, writer, size=POOL_SIZE, pragmas=None):
+        self.path = path
+        self.writer = writer
+        self.size = size
+        self.pragmas = pragmas if pragmas is not None else {}
+        self.attached = {}
+        # Bumped whenever the attached databases change, connections made before then
+        # are closed instead of reused
+        self.generation = 0
+
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.connections = {}
+
+    def shared(self):
+        return self.path == ':memory:'
+
+    '''
+    Borrows a read connection. It must be given back with `release`.
+    @return Connection which can be used on any thread
+    '''
+    def acquire(self):
+        if self.shared():
+            return self.writer
+
+        self.slots.acquire()
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            try:
+                return self.connect()
+            except Exception as e:
+                self.slots.release()
+                raise e
+
+    '''
+    Gives back a connection borrowed with `acquire`.
+    '''
+    def release(self, conn):
+        if conn is self.writer:
+            return
+
+        if self.connections.get(conn) == self.generation:
+            self.idle.put(conn)
+        else:
+            self.discard(conn)
+        self.slots.release()
+
+    '''
+    Opens a new read-only connection, with the pool's settings and attached databases.
+    '''
+    def connect(self):
+        uri = 'file:{}?mode=ro'.format(urllib.parse.quote(os.path.abspath(self.path)))
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+
+        for name, value in self.pragmas.items():
+            if name in CONNECTION_PRAGMAS:
+                conn.execute('PRAGMA {} = {}'.format(name, value))
+        for alias, path in self.attached.items():
+            conn.execute('ATTACH DATABASE ? AS "{}"'.format(alias), (path,))
+
+        with self.lock:
+            self.connections[conn] = self.generation
+
+        return conn
+
+    '''
+    Records a database attached to the database's own connection, so read connections
+    have it attached as well.
+    @param alias Name the database is attached as
+    @param path (optional) Path of the attached database, or None once it's detached
+    '''
+    def attach(self, alias, path=None):
+        if path is None:
+            self.attached.pop(alias, None)
+        else:
+            self.attached[alias] = path
+
+        self.refresh()
+
+    '''
+    Throws away the idle connections so the settings and attached databases are applied
+    again. Connections in use are thrown away when they're given back.
+    '''
+    def refresh(self):
+        # Every connection is stale now, new ones are made as they're needed
+        self.generation += 1
+        while True:
+            try:
+                self.discard(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
+    def discard(self, conn):
+        with self.lock:
+            self.connections.pop(conn, None)
+        conn.close()
+
+    '''
+    Closes every connection in the pool.
+    '''
+    def close(self):
+        with self.lock:
+            connections, self.connections = self.connections, {}
+
+        for conn in connections:
+            conn.close()
@@ -0,0 +1,313 @@
+import contextlib
+import math
+import sqlite3
+import threading
+import time
+from collections import deque
+
+# Number of log entries kept in memory
+LOG_BUFFER_SIZE = 1000
+# Number of pending entries which triggers a write to the `logs` table
+LOG_BATCH_SIZE = 100
+# Seconds between writes to the `logs` table when there are pending entries
+LOG_FLUSH_INTERVAL = 5.0
+# Seconds the background writer waits on a locked database before giving up until next time
+LOG_WRITE_TIMEOUT = 0.5
+# Most entries kept waiting to be written. While the database stays locked, e.g. by a long
+# transaction, the oldest are dropped past this and a note of how many is written instead.
+LOG_PENDING_LIMIT = 10000
+
+# Columns of the `logs` table after `message`, and their types. Older databases get them
+# added when they're opened.
+LOG_COLUMNS = (
+    ('template', 'STRING'),
+    ('duration_ms', 'REAL'),
+    ('row_count', 'INTEGER'),
+    ('plan', 'STRING'),
+)
+
+'''
+Keeps track of every statement run against the database, along with how long it took, how
+many rows it returned or changed, and its query plan. Only the most recent entries are
+kept in memory, in a ring buffer. New entries are written to the `logs` table in batches,
+either once enough of them have built up or once enough time has passed. Older history is
+never loaded at startup, it is paged from the database when it's asked for.
+
+For databases stored in a file the writes are done by a background thread with its own
+connection, so a batch is committed without touching the shell's open transaction. In-memory
+databases can't be opened twice, so the writes are done on the shell's connection instead,
+from whichever call made the batch due. They wait until the shell isn't in a transaction,
+so they're committed on their own and a rollback can't lose them.
+
+Reading the history never waits on the writer. The batch being written is kept aside until
+it's in the table, and reads which raced with a write are done again.
+'''
+class QueryLog():
+    '''
+    Initialise the log. The `logs` table must already exist.
+    @param db Connection owned by the database
+    @param path Path of the database file, or None to write on `db` directly
+    @param buffer_size Number of entries kept in memory
+    @param batch_size Number of pending entries which triggers a write
+    @param flush_interval Seconds between writes while there are pending entries
+    @param pending_limit Most entries kept waiting to be written
+    @param on_commit (optional) Function the background writer's commits are passed to
+        instead of being made straight away, so the database can tell them apart from
+        changes made by other connections
+    @param reader (optional) Function returning a context manager which gives the connection
+        to read history on, e.g. a read connection when the history is read on another
+        thread. History is read on `db` if not given.
+    '''
+    def __init__(self, db, path=None, buffer_size=LOG_BUFFER_SIZE, batch_size=LOG_BATCH_SIZE,
+            flush_interval=LOG_FLUSH_INTERVAL, pending_limit=LOG_PENDING_LIMIT, on_commit=None,
+            reader=None):
+        self.db = db
+        self.on_commit = on_commit
+        self.reader = reader or (lambda: contextlib.nullcontext(db))
+        self.recent = deque(maxlen=buffer_size)
+        self.pending = []
+        # The batch being written, and how many batches have been written so far
+        self.writing = []
+        self.written = 0
+        # Entries dropped since the last write because too many were pending
+        self.dropped = 0
+        self.pending_limit = pending_limit
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+
+        # `lock` guards the in-memory lists, `write_lock` guards the writer connection
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+
+        self.writer = None
+        self.thread = None
+        if path is None or in_memory(path):
+            # Another connection would open a different, empty database
+            self.writer = db
+        else:
+            self.writer = sqlite3.connect(path, timeout=LOG_WRITE_TIMEOUT,
+                check_same_thread=False)
+            self.thread = threading.Thread(target=self.write_loop, name='sqlos-log-writer',
+                daemon=True)
+            self.thread.start()
+
+    '''
+    Adds an entry to the log. The entry is kept in memory and queued to be written to
+    the `logs` table with the next batch.
+    @param message The statement to log
+    @param template (optional) The statement with its values taken out
+    @param duration_ms (optional) Milliseconds the statement took
+    @param row_count (optional) Number of rows the statement returned or changed
+    @param plan (optional) The statement's query plan
+    @see sql_parser.normalize
+    '''
+    def append(self, message, template=None, duration_ms=None, row_count=None, plan=None):
+        with self.lock:
+            self.recent.append(message)
+            self.pending.append((message, template, duration_ms, row_count, plan))
+            self.trim()
+            due = len(self.pending) >= self.batch_size
+
+        if self.thread is not None:
+            if due:
+                self.wake.set()
+        elif due or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    '''
+    Writes every pending entry to the `logs` table. If the database is locked, or the
+    entries would be written inside the shell's transaction, they stay pending and are
+    written with the next batch.
+    '''
+    def flush(self):
+        with self.write_lock:
+            if self.writer is self.db and self.db.in_transaction:
+                return
+
+            with self.lock:
+                batch, self.pending = self.pending, []
+                dropped, self.dropped = self.dropped, 0
+                self.writing = batch
+
+            self.last_flush = time.monotonic()
+            if not batch:
+                return
+
+            rows = batch
+            if dropped:
+                rows = [('[{} log entries dropped while the database was locked]'.format(dropped),
+                    None, None, None, None)] + batch
+
+            try:
+                self.writer.executemany('''INSERT INTO logs (message, template, duration_ms,
+                    row_count, plan) VALUES (?, ?, ?, ?, ?)''', rows)
+                # Commits on the shell's connection aren't seen as changes by other connections
+                if self.on_commit is not None and self.writer is not self.db:
+                    self.on_commit(self.writer.commit)
+                else:
+                    self.writer.commit()
+            except sqlite3.OperationalError:
+                # Most likely the database is locked, try again later
+                with self.lock:
+                    self.pending = batch + self.pending
+                    self.dropped += dropped
+                    self.writing = []
+                    self.trim()
+                return
+
+            with self.lock:
+                self.writing = []
+                self.written += 1
+
+    '''
+    Drops the oldest pending entries past `pending_limit`. Has to be called with `lock` held.
+    '''
+    def trim(self):
+        extra = len(self.pending) - self.pending_limit
+        if extra > 0:
+            del self.pending[:extra]
+            self.dropped += extra
+
+    '''
+    Runs a read of the history, with the entries which haven't been written yet. If a batch
+    was written while the table was being read, it's read again so nothing shows up twice.
+    @param read Function taking the unwritten entries, newest first, which reads the table
+    @return Whatever `read` returns
+    '''
+    def read_history(self, read):
+        while True:
+            with self.lock:
+                unwritten = (self.writing + self.pending)[::-1]
+                written = self.written
+
+            result = read(unwritten)
+            if self.written == written:
+                return result
+
+    '''
+    Background writer. Flushes the log every `flush_interval` seconds, or sooner when
+    a batch fills up.
+    '''
+    def write_loop(self):
+        while not self.stopped.is_set():
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
+
+    '''
+    Returns a page of the log history, newest page first. Entries still waiting to be
+    written are read from memory, everything older is read from the `logs` table.
+    @param limit Number of entries in a page
+    @param page Which page to return, starting from 0 for the most recent entries
+    @return List of entries, oldest first
+    '''
+    def page(self, limit, page=0):
+        # Anything that hasn't been written yet is newer than what's in the table
+        def read(unwritten):
+            pending = [entry[0] for entry in unwritten]
+            offset = limit * page
+            entries = pending[offset:offset+limit]
+            offset = max(0, offset - len(pending))
+
+            if len(entries) < limit:
+                with self.reader() as conn:
+                    rows = conn.execute('''SELECT message FROM logs ORDER BY rowid DESC LIMIT ? OFFSET ?''',
+                        (limit - len(entries), offset)).fetchall()
+                entries.extend(row[0] for row in rows)
+
+            return entries[::-1]
+
+        return self.read_history(read)
+
+    '''
+    Returns the most recent entries which were timed, for working out statistics.
+    @param limit Most entries to return
+    @return List of (message, template, duration_ms, row_count, plan) tuples, newest first
+    '''
+    def profiles(self, limit):
+        def read(unwritten):
+            entries = [entry for entry in unwritten if entry[2] is not None][:limit]
+
+            if len(entries) < limit:
+                with self.reader() as conn:
+                    entries.extend(conn.execute('''SELECT message, template, duration_ms, row_count,
+                        plan FROM logs WHERE duration_ms IS NOT NULL ORDER BY rowid DESC LIMIT ?''',
+                        (limit - len(entries),)).fetchall())
+
+            return entries
+
+        return self.read_history(read)
+
+    '''
+    Stops the background writer and writes anything still pending. Closing the log more
+    than once does nothing.
+    '''
+    def close(self):
+        if self.stopped.is_set():
+            return
+
+        self.stopped.set()
+        if self.thread is not None:
+            self.wake.set()
+            self.thread.join()
+
+        self.flush()
+
+        if self.writer is not self.db:
+            self.writer.close()
+
+    def __iter__(self):
+        return iter(list(self.recent))
+
+    def __len__(self):
+        return len(self.recent)
+
+'''
+Whether a path opens an in-memory database, either `:memory:` or a `file::memory:` URI.
+'''
+def in_memory(path):
+    return path == ':memory:' or path.startswith('file::memory:') or \
+        (path.startswith('file:') and 'mode=memory' in path)
+
+'''
+Works out the latency of each statement template.
+@param entries Entries from `QueryLog.profiles`
+@return List of (template, count, p50, p95, max) tuples with times in milliseconds,
+    the templates taking the most time in total first
+'''
+def template_stats(entries):
+    durations = {}
+    for message, template, duration_ms, row_count, plan in entries:
+        durations.setdefault(template or message, []).append(duration_ms)
+
+    stats = []
+    for template, times in sorted(durations.items(), key=lambda item: -sum(item[1])):
+        times.sort()
+        stats.append((template, len(times), percentile(times, 0.5), percentile(times, 0.95),
+            times[-1]))
+
+    return stats
+
+'''
+Finds a percentile of some values, using the nearest rank.
+@param values Sorted list of values
+@param fraction Percentile as a fraction, e.g. 0.95
+'''
+def percentile(values, fraction):
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+'''
+Finds the steps of a query plan which read a whole table, e.g. `SCAN users`. Scans of an
+index are left out, they're usually the fastest way to answer the query.
+@param plan Query plan as stored in the log, steps separated by `; `
+@return List of the steps which are full table scans
+'''
+def full_scans(plan):
+    if not plan:
+        return []
+
+    return [step for step in plan.split('; ') if step.startswith('SCAN')
+        and 'INDEX' not in step and 'CONSTANT ROW' not in step]
@@ -0,0 +1,185 @@
+import contextlib
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+
+'''
+Cache of query results, for queries which are run over and over against tables that rarely
+change. Results are kept until the cache is full, then the least recently used are thrown
+away. Every result remembers the tables it read, so a write to a table only throws away the
+results which read it.
+'''
+
+# Most memory the cache uses when it's turned on without a size, in bytes
+RESULT_CACHE_SIZE = 64 * 1024 * 1024
+# Largest share of the cache one result can take up. Anything bigger isn't kept.
+RESULT_MAX_SHARE = 0.25
+
+'''
+A cached result.
+'''
+class Result():
+    def __init__(self, columns, rows, tables, size):
+        self.columns = columns
+        self.rows = rows
+        self.tables = tables
+        self.size = size
+
+class ResultCache():
+    '''
+    @param max_bytes Most memory the results can use, roughly
+    '''
+    def __init__(self, max_bytes=RESULT_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.max_result = int(max_bytes * RESULT_MAX_SHARE)
+
+        # Key -> Result, least recently used first
+        self.results = OrderedDict()
+        # Table name -> keys of the results which read it
+        self.tables = {}
+        self.size = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    '''
+    Looks up a result.
+    @param key Key the result was stored under
+    @return The Result, or None if it isn't cached
+    '''
+    def get(self, key):
+        with self.lock:
+            result = self.results.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+
+            self.results.move_to_end(key)
+            self.hits += 1
+            return result
+
+    '''
+    Stores a result, throwing away the least recently used results to make room.
+    @param key Key to store it under
+    @param columns Names of the result's columns
+    @param rows List of rows
+    @param tables Names of the tables the query read
+    @param size (optional) Size of the rows, if it's already been worked out
+    @return Whether the result was stored. Results too big for the cache aren't.
+    '''
+    def put(self, key, columns, rows, tables, size=None):
+        if size is None:
+            size = result_size(rows, self.max_result)
+        if size is None or size > self.max_result:
+            return False
+
+        tables = frozenset(table.lower() for table in tables)
+        with self.lock:
+            self.remove(key)
+            while self.results and self.size + size > self.max_bytes:
+                self.remove(next(iter(self.results)))
+                self.evictions += 1
+
+            self.results[key] = Result(columns, rows, tables, size)
+            self.size += size
+            for table in tables:
+                self.tables.setdefault(table, set()).add(key)
+
+        return True
+
+    '''
+    Throws away every result which read a table.
+    @param table Name of the table, optionally with its schema, e.g. `main.users`
+    '''
+    def invalidate(self, table):
+        table = table.rsplit('.', 1)[-1].lower()
+        with self.lock:
+            for key in list(self.tables.get(table, ())):
+                self.remove(key)
+                self.invalidations += 1
+
+    '''
+    Throws away every result.
+    '''
+    def clear(self):
+        with self.lock:
+            self.invalidations += len(self.results)
+            self.results.clear()
+            self.tables.clear()
+            self.size = 0
+
+    # Has to be called with the lock held
+    def remove(self, key):
+        result = self.results.pop(key, None)
+        if result is None:
+            return
+
+        self.size -= result.size
+        for table in result.tables:
+            keys = self.tables.get(table)
+            keys.discard(key)
+            if not keys:
+                del self.tables[table]
+
+    '''
+    Records the tables the statements run on a connection read, for the length of the block.
+    Tables are reported by sqlite as the statements are compiled, including the tables
+    behind views.
+    @param conn Connection the statements run on
+    '''
+    @contextlib.contextmanager
+    def reads(self, conn):
+        tables = set()
+        def authorizer(action, arg1, arg2, database, trigger):
+            if action == sqlite3.SQLITE_READ and arg1:
+                tables.add(arg1)
+            return sqlite3.SQLITE_OK
+
+        conn.set_authorizer(authorizer)
+        try:
+            yield tables
+        finally:
+            conn.set_authorizer(None)
+
+    '''
+    @return Dictionary of how well the cache is doing
+    '''
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit rate': '{:.1%}'.format(self.hits / lookups if lookups else 0),
+                'results': len(self.results),
+                'bytes': self.size,
+                'max bytes': self.max_bytes,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+'''
+Works out roughly how much memory rows use.
+@param rows List of rows
+@param limit Size to give up at
+@return Size in bytes, or None if it's over the limit
+'''
+def result_size(rows, limit):
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += row_size(row)
+        if size > limit:
+            return None
+
+    return size
+
+def row_size(row):
+    size = sys.getsizeof(row)
+    for cell in row:
+        size += sys.getsizeof(cell)
+
+    return size
@@ -0,0 +1,278 @@
+import asyncio
+import io
+import os
+import signal
+import socket
+import sys
+
+from client import SERVER_ADDRESS, parse_address
+from command_line import CommandLine, ExitException
+from database import Database, DATABASE_PATH
+from output import Output, OUTPUT_BATCH_SIZE, redirect
+from util import print_error
+
+'''
+Runs SQLOS as a server, so many clients can run commands at the same time without each
+starting a shell of their own. Every connection is a session with its own shell, so its
+own aliases, and its own write connection, so its own transaction. Reads from every session
+share the server's pool of read connections.
+
+Each line a client sends is run like a line in a script and is committed once it's done,
+unless the session opened a transaction with `database begin`. Commands which read their own
+input, like `database create`, get nothing to read. Closing the connection rolls back any
+transaction that's still open.
+@see client
+'''
+
+# Read connections shared by every session
+SERVER_POOL_SIZE = 8
+
+'''
+Where a session's output goes. Output is written from the session's command thread, and
+each write waits until the client has room for it, so a big result can't fill up memory.
+Lines starting with `.` get another `.` in front, so they can't be mistaken for the status.
+'''
+class SessionStream():
+    def __init__(self, writer, loop):
+        self.writer = writer
+        self.loop = loop
+        self.line_start = True
+
+    def write(self, text):
+        if text:
+            asyncio.run_coroutine_threadsafe(self.send(self.escape(text)), self.loop).result()
+
+        return len(text)
+
+    '''
+    Puts a `.` in front of lines which start with one.
+    @param text Output, which can start or end part way through a line
+    @return The escaped output
+    '''
+    def escape(self, text):
+        lines = text.split('\n')
+        for i, line in enumerate(lines):
+            if line.startswith('.') and (i > 0 or self.line_start):
+                lines[i] = '.' + line
+        self.line_start = text.endswith('\n')
+
+        return '\n'.join(lines)
+
+    async def send(self, text):
+        self.writer.write(text.encode('utf-8'))
+        await self.writer.drain()
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+'''
+A client's connection to the server.
+'''
+class Session():
+    '''
+    @param server Server the client connected to
+    @param reader Stream to read the client's commands from
+    @param writer Stream to write the output to
+    '''
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.stream = SessionStream(writer, asyncio.get_running_loop())
+        self.cl = None
+
+    '''
+    Runs the client's commands until it disconnects or exits.
+    '''
+    async def run(self):
+        try:
+            # Opening the database reads its schema, so keep it off the event loop
+            self.cl = await asyncio.to_thread(self.server.open_session)
+
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+
+                line = line.decode('utf-8').strip()
+                try:
+                    status = await self.run_line(line)
+                except ExitException:
+                    await self.respond(0)
+                    break
+
+                await self.respond(status)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # Client went away part way through
+            pass
+        finally:
+            if self.cl is not None:
+                await asyncio.to_thread(self.close)
+            self.writer.close()
+
+    '''
+    Runs one line from the client.
+    @param line The line the client sent
+    @return The status of the command
+    @throws ExitException if the client asked to end the session
+    '''
+    async def run_line(self, line):
+        if not line or line.startswith('#'):
+            return 0
+
+        if line.endswith('&'):
+            await self.stream.send(self.stream.escape('Background jobs aren\'t available over the server.\n'))
+            return 1
+
+        stages = self.cl.split_pipeline(line)
+        unknown = [com for com, args in stages if com not in self.cl.dispatch]
+        if unknown:
+            await self.stream.send(self.stream.escape('{} is not a command or alias.\n'.format(unknown[0])))
+            return 127
+
+        # Each session has its own command thread, so sessions don't wait for each other
+        return await self.cl.run_threaded(self.run_stages, stages)
+
+    '''
+    Runs a pipeline on the session's command thread, sending its output to the client.
+    '''
+    def run_stages(self, stages):
+        output = Output(stream=self.stream, batch_size=OUTPUT_BATCH_SIZE)
+        try:
+            with redirect(output):
+                try:
+                    status = self.cl.run_pipeline(stages) or 0
+                except ExitException as e:
+                    raise e
+                except Exception as e:
+                    print_error(type(e).__name__, e)
+                    status = 1
+
+                # Outside of a transaction, each line is committed once it's done
+                for db in self.cl.databases.values():
+                    if not db.explicit and db.db.in_transaction:
+                        db.commit()
+        finally:
+            output.flush()
+
+        return status
+
+    '''
+    Ends the command's output with its status.
+    '''
+    async def respond(self, status):
+        text = '.{}\n'.format(status)
+        if not self.stream.line_start:
+            text = '\n' + text
+        self.stream.line_start = True
+
+        await self.stream.send(text)
+
+    def close(self):
+        # A transaction left open is rolled back, not committed like the shell does
+        for db in self.cl.databases.values():
+            if db.explicit:
+                db.rollback()
+
+        self.cl.__del__()
+
+class Server():
+    '''
+    @param path Path of the database file. In-memory databases can't be shared between
+        sessions, so a file is needed.
+    @param address Unix socket path or `host:port` to listen on
+    @param pool_size Read connections shared by the sessions
+    @param options Passed on to each session's `Database`, e.g. a storage profile
+    @throws ValueError if the database isn't a file
+    '''
+    def __init__(self, path=DATABASE_PATH, address=SERVER_ADDRESS, pool_size=SERVER_POOL_SIZE, **options):
+        if path == ':memory:':
+            raise ValueError('The server needs a database file, in-memory databases can\'t be shared.')
+
+        self.path = path
+        self.address = address
+        self.pool_size = pool_size
+        self.options = options
+
+        self.db = None
+        self.server = None
+        self.sessions = set()
+
+    '''
+    Opens the database and starts listening. Opening the database first means the meta
+    tables and storage settings are set up before any session needs them.
+    '''
+    async def start(self):
+        self.db = await asyncio.to_thread(Database, path=self.path, pool_size=self.pool_size,
+            **self.options)
+
+        family, target = parse_address(self.address)
+        if family == socket.AF_UNIX:
+            self.server = await asyncio.start_unix_server(self.handle, path=target)
+        else:
+            self.server = await asyncio.start_server(self.handle, *target)
+
+    '''
+    Runs the server until it's cancelled, e.g. by Ctrl-C or SIGTERM.
+    '''
+    async def serve(self):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except NotImplementedError:
+            # No signal handlers on this platform
+            pass
+
+        # Commands which read input mustn't read the server's
+        stdin = sys.stdin
+        sys.stdin = io.StringIO()
+        try:
+            await self.start()
+            print('Serving {} on {}'.format(self.path, self.address))
+            await self.server.serve_forever()
+        finally:
+            sys.stdin = stdin
+            await self.close()
+
+    async def handle(self, reader, writer):
+        session = Session(self, reader, writer)
+        task = asyncio.current_task()
+        self.sessions.add(task)
+        try:
+            await session.run()
+        except asyncio.CancelledError:
+            # The server is shutting down
+            pass
+        finally:
+            self.sessions.discard(task)
+
+    '''
+    Makes the shell for a new session. Its database shares the server's read connections.
+    '''
+    def open_session(self):
+        db = Database(path=self.path, pool=self.db.pool, **self.options)
+        return CommandLine(db=db)
+
+    '''
+    Stops listening and ends every session.
+    '''
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+
+        for task in list(self.sessions):
+            task.cancel()
+        await asyncio.gather(*self.sessions, return_exceptions=True)
+
+        if self.server is not None:
+            await self.server.wait_closed()
+
+            family, target = parse_address(self.address)
+            if family == socket.AF_UNIX and os.path.exists(target):
+                os.remove(target)
+
+        if self.db is not None:
+            await asyncio.to_thread(self.db.__del__)
+            self.db = None
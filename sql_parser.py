@@ -0,0 +1,783 @@
+import re
+from collections import namedtuple
+
+'''
+Everything the database needs to know about a statement before running it.
+kind -> DDL, DML, QUERY or OTHER
+verb -> First keyword of the statement, e.g. INSERT. For statements starting with a WITH
+    clause it's the keyword of the statement the clause leads into.
+object -> Type of object for DDL statements, e.g. TABLE or INDEX
+table -> Table the statement targets, or None if there isn't one
+log_template -> The statement split on its `?` placeholders, used to build log entries
+template -> The statement with its values taken out, used to group statements when profiling
+'''
+Statement = namedtuple('Statement', ['kind', 'verb', 'object', 'table', 'log_template', 'template'])
+
+KINDS = {
+    'CREATE': 'DDL',
+    'DROP': 'DDL',
+    'ALTER': 'DDL',
+    'INSERT': 'DML',
+    'REPLACE': 'DML',
+    'UPDATE': 'DML',
+    'DELETE': 'DML',
+    'SELECT': 'QUERY',
+    'WITH': 'QUERY',
+    'VALUES': 'QUERY',
+    'PRAGMA': 'QUERY',
+    'EXPLAIN': 'QUERY',
+}
+
+# Statements a WITH clause can lead into
+WITH_VERBS = {'SELECT', 'VALUES', 'INSERT', 'REPLACE', 'UPDATE', 'DELETE'}
+
+# Name of a table, optionally quoted and/or prefixed with the schema
+NAME = r'''((?:[\w$]+|"[^"]+"|`[^`]+`|\[[^\]]+\])(?:\.(?:[\w$]+|"[^"]+"|`[^`]+`|\[[^\]]+\]))?)'''
+
+TARGETS = {
+    'CREATE': re.compile(r'CREATE\s+(?:TEMP\s+|TEMPORARY\s+)?(?:UNIQUE\s+)?(\w+)\s+(?:IF\s+NOT\s+EXISTS\s+)?' + NAME, re.I),
+    'DROP': re.compile(r'DROP\s+(\w+)\s+(?:IF\s+EXISTS\s+)?' + NAME, re.I),
+    'ALTER': re.compile(r'ALTER\s+(TABLE)\s+' + NAME, re.I),
+    'INSERT': re.compile(r'INSERT\s+(?:OR\s+\w+\s+)?INTO\s+()' + NAME, re.I),
+    'REPLACE': re.compile(r'REPLACE\s+INTO\s+()' + NAME, re.I),
+    'UPDATE': re.compile(r'UPDATE\s+(?:OR\s+\w+\s+)?()' + NAME, re.I),
+    'DELETE': re.compile(r'DELETE\s+FROM\s+()' + NAME, re.I),
+    'SELECT': re.compile(r'SELECT\s.*?\bFROM\s+()' + NAME, re.I | re.S),
+}
+
+'''
+Classifies a SQL statement. The result only depends on the statement text, so it's safe
+to cache it for statements that are run over and over.
+@param sql Statement to classify
+@return Statement tuple describing the statement
+'''
+def classify(sql):
+    stripped = sql.strip()
+    verb = stripped.split(None, 1)[0].upper() if stripped else ''
+    if verb == 'WITH':
+        # `WITH ... DELETE` is a write, so look past the WITH clause
+        tokens = tokenize(stripped)
+        start = main_statement(tokens)
+        if start is not None:
+            verb = tokens[start][1].upper()
+            stripped = join_tokens(tokens[start:])
+    kind = KINDS.get(verb, 'OTHER')
+
+    _object = None
+    table = None
+    target = TARGETS.get(verb)
+    if target is not None:
+        match = target.match(stripped)
+        if match is not None:
+            _object = match.group(1).upper() or None
+            table = unquote(match.group(2))
+
+    return Statement(kind, verb, _object, table, tuple(sql.split('?')), normalize(sql))
+
+'''
+Finds the statement a WITH clause leads into, e.g. the DELETE in
+`WITH old AS (SELECT ...) DELETE FROM events WHERE ...`. The common table expressions are
+all in brackets, so it's the first statement keyword outside of any.
+@param tokens Tokens of a statement starting with WITH
+@return Index of the token the statement starts at, or None if there isn't one
+'''
+def main_statement(tokens):
+    depth = 0
+    for i, (kind, text) in enumerate(tokens):
+        if text == '(':
+            depth += 1
+        elif text == ')':
+            depth -= 1
+        elif depth == 0 and kind == 'word' and text.upper() in WITH_VERBS:
+            return i
+
+    return None
+
+'''
+Turns a statement into a template by replacing its literal values with `?`, so statements
+which only differ by their values look the same, e.g. `SELECT * FROM users WHERE id = 5`
+becomes `SELECT * FROM users WHERE id = ?`. Lists of values like `IN (1, 2, 3)` become
+a single `?`.
+@param sql Statement to turn into a template
+@return The template
+'''
+def normalize(sql):
+    tokens = []
+    for kind, text in tokenize(sql):
+        if kind in ('string', 'number'):
+            kind, text = 'op', '?'
+
+        if text == '?' and len(tokens) >= 2 and tokens[-1][1] == ',' and tokens[-2][1] == '?':
+            tokens.pop()
+            continue
+
+        tokens.append((kind, text))
+
+    return join_tokens(tokens)
+
+# Queries which can have their results cached, WITH clauses are looked past
+CACHEABLE_VERBS = {'SELECT', 'VALUES'}
+# Functions and keywords which give a different answer each time, or depend on the time
+VOLATILE = {'RANDOM', 'RANDOMBLOB', 'CHANGES', 'TOTAL_CHANGES', 'LAST_INSERT_ROWID', 'DATE',
+    'TIME', 'DATETIME', 'JULIANDAY', 'STRFTIME', 'UNIXEPOCH', 'CURRENT_DATE', 'CURRENT_TIME',
+    'CURRENT_TIMESTAMP', 'SQLITE_OFFSET'}
+
+'''
+Works out what a query's results are cached under. Spacing, comments and the case of
+keywords don't matter, so `select *  from t` and `SELECT * FROM t` share a result. Queries
+which give a different answer each time they're run, like ones using `random()` or the
+time, can't be cached.
+@param sql Query to look at
+@return Text the query's results are cached under, or None if they can't be cached
+'''
+def cache_key(sql):
+    tokens = tokenize(sql)
+    if not tokens:
+        return None
+
+    start = main_statement(tokens) if tokens[0][1].upper() == 'WITH' else 0
+    if start is None or tokens[start][1].upper() not in CACHEABLE_VERBS:
+        return None
+
+    words = []
+    for kind, text in tokens:
+        if kind == 'word':
+            text = text.upper()
+            if text in VOLATILE:
+                return None
+        words.append(text)
+
+    return ' '.join(words)
+
+'''
+Removes the quotes from a table name.
+@param name Possibly quoted name
+'''
+def unquote(name):
+    if name[0] in '"`[':
+        return name[1:-1]
+
+    return name
+
+'''
+Quotes a table, column or index name so it can be put into a statement.
+@param name Name to quote
+'''
+def quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+'''
+Builds a log entry by filling in the placeholders of a statement with its values.
+@param log_template The statement split on its `?` placeholders
+@param vals Values passed with the statement
+@return The statement with the values filled in
+'''
+def format_log(log_template, vals):
+    parts = [log_template[0]]
+    for piece, val in zip(log_template[1:], vals):
+        parts.append(str(val))
+        parts.append(piece)
+
+    # Any placeholders without a value are left in
+    for piece in log_template[len(vals)+1:]:
+        parts.append('?')
+        parts.append(piece)
+
+    return ''.join(parts)
+
+# DDL parsing
+# A small tokenizer and parser for CREATE TABLE statements, used to fill the meta tables
+
+'''
+A column from a CREATE TABLE statement.
+name -> Name of the column
+type -> Declared type without its parameters, e.g. DECIMAL. Empty if there isn't one
+type_params -> Parameters of the type, e.g. ('10', '2') for DECIMAL(10,2)
+not_null -> Whether the column is NOT NULL
+unique -> Whether the column is UNIQUE on its own
+primary_key -> Whether the column is part of the primary key
+default -> Text of the default value, or None
+constraints -> Text of any other constraints, e.g. CHECK and REFERENCES clauses
+'''
+ColumnDef = namedtuple('ColumnDef', ['name', 'type', 'type_params', 'not_null', 'unique',
+    'primary_key', 'default', 'constraints'])
+
+'''
+A CREATE TABLE statement.
+name -> Name of the table
+if_not_exists -> Whether IF NOT EXISTS was given
+columns -> Tuple of ColumnDefs, in order
+primary_key -> Names of the columns in the primary key
+unique -> Tuple of the column name tuples from table level UNIQUE constraints
+constraints -> Text of any other table constraints, e.g. CHECK and FOREIGN KEY clauses
+'''
+TableDef = namedtuple('TableDef', ['name', 'if_not_exists', 'columns', 'primary_key', 'unique',
+    'constraints'])
+
+TOKEN = re.compile(r'''
+    (?P<space>\s+|--[^\n]*|/\*.*?(?:\*/|$))
+    |(?P<string>'(?:[^']|'')*')
+    |(?P<quoted>"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\])
+    |(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    |(?P<word>[A-Za-z_][\w$]*)
+    |(?P<op>\|\||<<|>>|<=|>=|==|!=|<>|[^\s\w])
+''', re.X | re.S)
+
+# Keywords which end a column's type and start its constraints
+COLUMN_CONSTRAINTS = {'CONSTRAINT', 'PRIMARY', 'NOT', 'NULL', 'UNIQUE', 'CHECK', 'DEFAULT',
+    'COLLATE', 'REFERENCES', 'GENERATED', 'AS'}
+# Tokens which end a column's type, or a constraint which is kept as text
+CONSTRAINT_END = COLUMN_CONSTRAINTS | {'(', ',', ')', ''}
+# Keywords which start a table constraint instead of a column
+TABLE_CONSTRAINTS = {'CONSTRAINT', 'PRIMARY', 'UNIQUE', 'CHECK', 'FOREIGN'}
+
+'''
+Splits a SQL statement into tokens in a single pass. Whitespace and comments are dropped.
+@param sql Statement to split
+@return List of (kind, text) tuples, where kind is one of string, quoted, number, word or op
+'''
+def tokenize(sql):
+    tokens = []
+    for match in TOKEN.finditer(sql):
+        kind = match.lastgroup
+        if kind != 'space':
+            tokens.append((kind, match.group()))
+
+    return tokens
+
+'''
+Parses a CREATE TABLE statement.
+@param sql Statement to parse
+@return TableDef describing the table
+@throws ValueError if the statement isn't a CREATE TABLE statement
+'''
+def parse_create_table(sql):
+    return DDLParser(tokenize(sql)).create_table()
+
+'''
+Recursive descent parser over the tokens of a DDL statement. Each method consumes the
+tokens for one part of the statement and moves `pos` past them.
+'''
+class DDLParser():
+    def __init__(self, tokens):
+        self.tokens = tokens
+        # Keywords are compared in upper case, so do it once for every token up front
+        self.upper = [text.upper() for kind, text in tokens]
+        self.pos = 0
+
+    '''
+    @return Upper case text of the current token, or an empty string at the end
+    '''
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.upper[self.pos]
+
+        return ''
+
+    def next(self):
+        if self.pos >= len(self.tokens):
+            raise ValueError('Unexpected end of statement')
+
+        self.pos += 1
+        return self.tokens[self.pos-1][1]
+
+    '''
+    Consumes the next tokens if they match the keywords, otherwise consumes nothing.
+    @return Whether the keywords matched
+    '''
+    def accept(self, *keywords):
+        if self.peek() != keywords[0]:
+            return False
+
+        if tuple(self.upper[self.pos:self.pos+len(keywords)]) == keywords:
+            self.pos += len(keywords)
+            return True
+
+        return False
+
+    def expect(self, *keywords):
+        if not self.accept(*keywords):
+            raise ValueError('Expected {} but found `{}`'.format(' '.join(keywords), self.peek()))
+
+    def name(self):
+        return unquote(self.next())
+
+    '''
+    Consumes a parenthesised group, including any groups nested inside it.
+    @return Tokens inside the parentheses
+    '''
+    def group(self):
+        self.expect('(')
+        start = self.pos
+        depth = 1
+        while depth:
+            text = self.next()
+            if text == '(':
+                depth += 1
+            elif text == ')':
+                depth -= 1
+
+        return self.tokens[start:self.pos-1]
+
+    '''
+    Consumes a parenthesised list of column names, e.g. in PRIMARY KEY (a, b).
+    Sort orders and collations on the columns are skipped.
+    '''
+    def name_list(self):
+        names = []
+        for part in split_commas(self.group()):
+            names.append(unquote(part[0][1]))
+
+        return tuple(names)
+
+    '''
+    Consumes tokens up to the next comma or closing parenthesis that isn't nested.
+    @return Text of the consumed tokens
+    '''
+    def clause(self):
+        start = self.pos
+        while self.peek() not in (',', ')', ''):
+            if self.peek() == '(':
+                self.group()
+            else:
+                self.pos += 1
+
+        return join_tokens(self.tokens[start:self.pos])
+
+    def create_table(self):
+        self.expect('CREATE')
+        self.accept('TEMP') or self.accept('TEMPORARY')
+        self.expect('TABLE')
+        if_not_exists = self.accept('IF', 'NOT', 'EXISTS')
+
+        name = self.name()
+        if self.accept('.'):
+            name = self.name()
+
+        columns = []
+        primary_key = ()
+        unique = []
+        constraints = []
+
+        # CREATE TABLE ... AS SELECT has no column definitions
+        if self.peek() == '(':
+            self.next()
+            while True:
+                if self.peek() in TABLE_CONSTRAINTS:
+                    kind, value = self.table_constraint()
+                    if kind == 'PRIMARY':
+                        primary_key = value
+                    elif kind == 'UNIQUE':
+                        unique.append(value)
+                    else:
+                        constraints.append(value)
+                else:
+                    columns.append(self.column())
+
+                if not self.accept(','):
+                    break
+            self.expect(')')
+
+        # Columns in the table's primary key or single column unique constraints are
+        # marked on the columns themselves as well
+        columns = [column._replace(
+                primary_key=column.primary_key or column.name in primary_key,
+                unique=column.unique or (column.name,) in unique)
+            for column in columns]
+        if not primary_key:
+            primary_key = tuple(column.name for column in columns if column.primary_key)
+
+        return TableDef(name, if_not_exists, tuple(columns), primary_key, tuple(unique),
+            tuple(constraints))
+
+    '''
+    Consumes a table constraint.
+    @return Tuple of the kind of constraint and either the columns it covers (PRIMARY KEY
+        and UNIQUE) or its text (everything else)
+    '''
+    def table_constraint(self):
+        start = self.pos
+        if self.accept('CONSTRAINT'):
+            self.name()
+
+        if self.accept('PRIMARY', 'KEY'):
+            value = self.name_list()
+            self.clause()
+            return 'PRIMARY', value
+        elif self.accept('UNIQUE'):
+            value = self.name_list()
+            self.clause()
+            return 'UNIQUE', value
+
+        kind = self.peek()
+        self.clause()
+
+        return kind, join_tokens(self.tokens[start:self.pos])
+
+    def column(self):
+        name = self.name()
+
+        # The type is every word up to the first constraint, e.g. UNSIGNED BIG INT
+        type_words = []
+        while self.peek() not in CONSTRAINT_END:
+            type_words.append(self.next())
+
+        type_params = ()
+        if self.peek() == '(':
+            type_params = tuple(join_tokens(part) for part in split_commas(self.group()))
+
+        not_null = False
+        unique = False
+        primary_key = False
+        default = None
+        constraints = []
+
+        while self.peek() not in (',', ')', ''):
+            if self.accept('CONSTRAINT'):
+                self.name()
+            elif self.accept('PRIMARY', 'KEY'):
+                primary_key = True
+                self.conflict_clause({'ASC', 'DESC', 'AUTOINCREMENT'})
+            elif self.accept('NOT', 'NULL'):
+                not_null = True
+                self.conflict_clause()
+            elif self.accept('NULL'):
+                self.conflict_clause()
+            elif self.accept('UNIQUE'):
+                unique = True
+                self.conflict_clause()
+            elif self.accept('DEFAULT'):
+                if self.peek() == '(':
+                    default = '(' + join_tokens(self.group()) + ')'
+                elif self.peek() in ('-', '+'):
+                    default = self.next() + self.next()
+                else:
+                    default = self.next()
+            else:
+                # CHECK, COLLATE, REFERENCES, GENERATED and anything else are kept as text
+                constraints.append(self.column_constraint())
+
+        return ColumnDef(name, ' '.join(type_words).upper(), type_params, not_null, unique,
+            primary_key, default, tuple(constraints))
+
+    '''
+    Skips the optional ON CONFLICT clause after a constraint, along with any of the given
+    keywords.
+    '''
+    def conflict_clause(self, keywords=frozenset()):
+        while True:
+            if self.accept('ON', 'CONFLICT'):
+                self.next()
+            elif self.peek() in keywords:
+                self.next()
+            else:
+                return
+
+    '''
+    Consumes a column constraint which is kept as text. The constraint ends at the next
+    keyword which starts a constraint, or the end of the column.
+    '''
+    def column_constraint(self):
+        start = self.pos
+        self.next()
+        while self.peek() not in CONSTRAINT_END or self.peek() == '(':
+            if self.peek() == '(':
+                self.group()
+            else:
+                self.pos += 1
+
+        return join_tokens(self.tokens[start:self.pos])
+
+'''
+Splits tokens on commas which aren't inside parentheses.
+@param tokens List of tokens
+@return List of lists of tokens
+'''
+def split_commas(tokens):
+    parts = [[]]
+    depth = 0
+    for token in tokens:
+        if token[1] == ',' and depth == 0:
+            parts.append([])
+            continue
+
+        if token[1] == '(':
+            depth += 1
+        elif token[1] == ')':
+            depth -= 1
+        parts[-1].append(token)
+
+    return [part for part in parts if part]
+
+'''
+Joins tokens back into text. Spacing is normalised, so the text may not be the same as the
+original statement.
+'''
+def join_tokens(tokens):
+    text = ''
+    previous = None
+    for kind, value in tokens:
+        # Function calls and type parameters keep their parentheses attached
+        attached = value in (')', ',', '.') or (value == '(' and previous in ('word', 'quoted'))
+        if text and not (attached or text[-1] in ('(', '.')):
+            text += ' '
+        text += value
+        previous = kind
+
+    return text
+
+# Insert values parsing
+# Parses the values given to `database insert` into a statement with every value bound
+
+# Functions which can be called to make a value. Only functions without side effects are
+# allowed, anything else has to go through `database execute`.
+INSERT_FUNCTIONS = {'DATE', 'TIME', 'DATETIME', 'JULIANDAY', 'STRFTIME', 'UNIXEPOCH', 'RANDOM',
+    'RANDOMBLOB', 'ABS', 'ROUND', 'LOWER', 'UPPER', 'TRIM', 'LENGTH', 'HEX', 'COALESCE',
+    'IFNULL', 'NULLIF', 'PRINTF', 'SUBSTR', 'REPLACE', 'MIN', 'MAX'}
+# Keywords which stand for a constant, which is bound like any other value so rows with
+# and without them are inserted by the same statement
+INSERT_CONSTANTS = {
+    'NULL': None,
+    'TRUE': 1,
+    'FALSE': 0,
+}
+# Keywords which can be used as values, and the SQL they become
+INSERT_KEYWORDS = {
+    'CURRENT_DATE': 'CURRENT_DATE',
+    'CURRENT_TIME': 'CURRENT_TIME',
+    'CURRENT_TIMESTAMP': 'CURRENT_TIMESTAMP',
+}
+
+'''
+Values for an INSERT statement.
+columns -> Names of the columns the values are for, empty for every column in order
+rows -> List of rows, each a tuple of (sql, params) values. `sql` is `?` for a plain value
+    or the expression making it, with its own values bound as `params`.
+'''
+InsertValues = namedtuple('InsertValues', ['columns', 'rows'])
+
+'''
+Parses the values for an insert, e.g. `(name, created) VALUES ('bob', datetime('now')), (alice, NULL)`.
+Words which aren't keywords or function calls are taken as text, so quotes are only
+needed around text with spaces or punctuation.
+@param sql Values to parse
+@return InsertValues
+@throws ValueError if the values can't be parsed or call a function that isn't allowed
+'''
+def parse_insert_values(sql):
+    return InsertParser(tokenize(sql)).insert_values()
+
+'''
+Parses a single value for an insert.
+@param sql Value to parse, e.g. `datetime('now')`
+@return Tuple of the value's SQL and the values bound to it
+@throws ValueError if the value can't be parsed or calls a function that isn't allowed
+'''
+def parse_insert_value(sql):
+    parser = InsertParser(tokenize(sql))
+    value = parser.value()
+    if parser.peek() != '':
+        raise ValueError('Unexpected `{}` after value'.format(parser.peek()))
+
+    return value
+
+'''
+Changes for an UPDATE statement.
+assignments -> Tuple of (column, (sql, params)) tuples, with values like `InsertValues`
+where -> Text of the WHERE condition, or None to update every row
+'''
+Update = namedtuple('Update', ['assignments', 'where'])
+
+'''
+Parses the changes for an update, e.g. `SET name = bob, seen = datetime('now') WHERE id = 5`.
+Values are parsed the same way as insert values, the condition is passed on as it is.
+@param sql Changes to parse
+@return Update
+@throws ValueError if the changes can't be parsed or call a function that isn't allowed
+@see parse_insert_values
+'''
+def parse_update(sql):
+    return InsertParser(tokenize(sql)).update()
+
+class InsertParser(DDLParser):
+    def update(self):
+        self.expect('SET')
+        assignments = []
+        while True:
+            column = self.name()
+            self.expect('=')
+            assignments.append((column, self.value()))
+
+            if not self.accept(','):
+                break
+
+        where = None
+        if self.accept('WHERE'):
+            where = join_tokens(self.tokens[self.pos:])
+            if not where:
+                raise ValueError('Expected a condition after WHERE')
+        elif self.peek() != '':
+            raise ValueError('Unexpected `{}` after values'.format(self.peek()))
+
+        return Update(tuple(assignments), where)
+
+    def insert_values(self):
+        columns = ()
+        if self.peek() == '(':
+            columns = self.name_list()
+        self.expect('VALUES')
+
+        rows = []
+        while True:
+            self.expect('(')
+            row = [self.value()]
+            while self.accept(','):
+                row.append(self.value())
+            self.expect(')')
+            rows.append(tuple(row))
+
+            if not self.accept(','):
+                break
+
+        if self.peek() != '':
+            raise ValueError('Unexpected `{}` after values'.format(self.peek()))
+
+        return InsertValues(columns, rows)
+
+    '''
+    Consumes a value. Literals are bound instead of put into the statement, including the
+    arguments to function calls.
+    @return Tuple of the value's SQL and the values bound to it
+    '''
+    def value(self):
+        word = self.peek()
+        if word == '':
+            raise ValueError('Unexpected end of values')
+
+        kind, text = self.tokens[self.pos]
+        self.pos += 1
+        if word in ('-', '+') and self.pos < len(self.tokens) and self.tokens[self.pos][0] == 'number':
+            return '?', (number(text + self.next()),)
+        elif kind == 'number':
+            return '?', (number(text),)
+        elif kind == 'string':
+            return '?', (text[1:-1].replace("''", "'"),)
+        elif kind == 'quoted':
+            return '?', (unquote(text),)
+        elif kind != 'word':
+            raise ValueError('Expected a value but found `{}`'.format(text))
+
+        if self.peek() == '(':
+            if word not in INSERT_FUNCTIONS:
+                raise ValueError('Function `{}` can\'t be used in values'.format(text))
+
+            self.next()
+            parts = []
+            params = []
+            while self.peek() != ')':
+                sql, part_params = self.value()
+                parts.append(sql)
+                params.extend(part_params)
+                if not self.accept(','):
+                    break
+            self.expect(')')
+
+            return '{}({})'.format(word.lower(), ', '.join(parts)), tuple(params)
+        elif word in INSERT_CONSTANTS:
+            return '?', (INSERT_CONSTANTS[word],)
+        elif word in INSERT_KEYWORDS:
+            return INSERT_KEYWORDS[word], ()
+
+        return '?', (text,)
+
+'''
+Compiles the rows of an insert. Runs of rows next to each other whose values have the same
+SQL are grouped, so every row in a group can be inserted by the same statement and the rows
+still go in in the order they were given. Each row's bound values are flattened into one
+tuple. It's a single pass over the values.
+@param rows Rows from `InsertValues`
+@return List of tuples of each value's SQL and a list of the rows' bound values
+'''
+def compile_insert(rows):
+    groups = []
+    for row in rows:
+        shape = tuple(sql for sql, params in row)
+        params = []
+        for sql, value_params in row:
+            params.extend(value_params)
+
+        if not groups or groups[-1][0] != shape:
+            groups.append((shape, []))
+        groups[-1][1].append(tuple(params))
+
+    return groups
+
+'''
+Turns a number token into an int or a float.
+'''
+def number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+# Query column mining
+# Finds the columns statements filter and sort on, used to suggest indexes
+
+# Comparisons which pick out rows with one value
+EQUALITY = {'=', '==', 'IN'}
+# Comparisons which pick out a range of rows
+RANGE = {'<', '<=', '>', '>=', 'BETWEEN', 'LIKE', 'GLOB'}
+# Keywords which end a WHERE or ORDER BY clause
+CLAUSE_END = {'GROUP', 'ORDER', 'LIMIT', 'HAVING', 'WINDOW', 'UNION', 'EXCEPT', 'INTERSECT',
+    'RETURNING', 'OFFSET'}
+# Words after a column in an ORDER BY clause which aren't columns
+ORDER_WORDS = {'ASC', 'DESC', 'NULLS', 'FIRST', 'LAST', 'COLLATE'}
+
+'''
+Finds the columns a statement filters on in its WHERE clause and sorts on in its ORDER BY
+clause. Only simple statements on one table are understood, anything with a join or a
+subquery is left alone.
+@param sql Statement to look at
+@return Tuple of the columns compared to one value, the columns compared to a range, and
+    the columns sorted on, each a list in the order they appear. None if the statement
+    isn't understood.
+'''
+def query_columns(sql):
+    tokens = tokenize(sql)
+    words = [text.upper() for kind, text in tokens]
+    if 'JOIN' in words or words.count('SELECT') > 1:
+        return None
+
+    equality, ranges, order = [], [], []
+    clause = None
+    i = 0
+    while i < len(tokens):
+        kind, text = tokens[i]
+        word = words[i]
+
+        if word == 'WHERE':
+            clause = 'WHERE'
+        elif word == 'ORDER' and i + 1 < len(words) and words[i+1] == 'BY':
+            clause = 'ORDER'
+            i += 1
+        elif word in CLAUSE_END:
+            clause = None
+        elif kind in ('word', 'quoted') and clause is not None:
+            # `table.column` only counts the column
+            if i + 2 < len(tokens) and tokens[i+1][1] == '.':
+                i += 2
+                kind, text = tokens[i]
+            name = unquote(text)
+
+            following = words[i+1] if i + 1 < len(words) else ''
+            if clause == 'WHERE' and following in EQUALITY:
+                equality.append(name)
+            elif clause == 'WHERE' and following in RANGE:
+                ranges.append(name)
+            elif clause == 'ORDER' and word not in ORDER_WORDS and (i == 0 or words[i-1] != 'COLLATE'):
+                order.append(name)
+
+        i += 1
+
+    return equality, ranges, order
@@ -0,0 +1,51 @@
+import unittest
+
+import bench
+
+import os
+import sys
+import tempfile
+
+
+class TestBench(unittest.TestCase):
+
+    def test_benchmarks(self):
+        # Every benchmark sets up and runs without failing
+        for name, setup in bench.BENCHMARKS.items():
+            with setup() as function:
+                function()
+                function()
+
+    def test_run(self):
+        results = bench.run(['shell.parse_command'], rounds=2)
+
+        result = results['shell.parse_command']
+        self.assertEqual(result['rounds'], 2)
+        self.assertGreater(result['number'], 0)
+        self.assertLessEqual(result['best_us'], result['mean_us'])
+        self.assertAlmostEqual(result['ops_per_sec'], 1e6 / result['best_us'])
+
+        with self.assertRaises(KeyError):
+            bench.run(['nothing'])
+
+    def test_save(self):
+        results = {'fast': {'best_us': 1.0}, 'slow': {'best_us': 3.0}}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.json')
+            bench.save(results, path)
+
+            self.assertEqual(bench.load(path), results)
+
+    def test_compare(self):
+        previous = {'fast': {'best_us': 1.0}, 'slow': {'best_us': 2.0}}
+        results = {'fast': {'best_us': 1.1}, 'slow': {'best_us': 3.0}, 'new': {'best_us': 5.0}}
+
+        self.assertEqual(bench.compare(results, previous), [
+            ('fast', 1.0, 1.1, 1.1, False),
+            ('slow', 2.0, 3.0, 1.5, True),
+        ])
+
+        results = {name: dict(result, ops_per_sec=1e6 / result['best_us'],
+            mean_us=result['best_us']) for name, result in results.items()}
+        self.assertEqual(bench.report(results, previous), 1)
+        self.assertIn('SLOWER', sys.stdout.getvalue())
@@ -1,11 +1,19 @@
+import asyncio
+import concurrent.futures
+import io
 import unittest
 
-from command_line import (CommandLine, HelpBuiltin, ExitException, ExitBuiltin,
-                          AliasBuiltin, TodoBuiltin)
+from command_line import (CommandLine, Builtin, HelpBuiltin, ExitException, ExitBuiltin,
+                          AliasBuiltin, TodoBuiltin, FgBuiltin, HeadBuiltin)
+from commands.command import Command
 from database import Database
+from plugins import LazyCommand
 from util import pretty_print
 
+import os
 import sys
+import tempfile
+import threading
 
 
 def clear_stdout():
@@ -130,8 +138,36 @@ class TestCommandLine(unittest.TestCase):
         pass
     
     def test_init_commands(self):
-        # This test is not implemented.
         self.cl.init_commands()
+
+        # Commands are only imported once they're used
+        self.assertIsInstance(self.cl.coms['test'], LazyCommand)
+        self.assertIsInstance(self.cl.coms['database'], LazyCommand)
+
+        command, args = self.cl.resolve_command('dbs', ['numbers'])
+        self.assertIsInstance(command, Command)
+        self.assertIs(self.cl.coms['database'], command)
+        self.assertIsNotNone(self.cl.plugins['database'].load_time)
+
+        # Modules which have to be imported only register the commands they define
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'sqlos_greet.py'), 'w') as f:
+                f.write('\n'.join([
+                    'from commands.database_command import DatabaseCommand',
+                    'class GreetCommand(DatabaseCommand):',
+                    '    def __init__(self):',
+                    '        super(GreetCommand, self).__init__()',
+                    "        self.name = 'greet'",
+                ]))
+            sys.path.insert(0, directory)
+            try:
+                self.cl.import_commands('sqlos_greet')
+            finally:
+                sys.path.remove(directory)
+                sys.modules.pop('sqlos_greet', None)
+
+        self.assertEqual(self.cl.plugins['greet'].module, 'sqlos_greet')
+        self.assertEqual(self.cl.plugins['database'].module, 'commands.database_command')
     
     def test_init_builtins(self):
         # This test is not implemented.
@@ -141,10 +177,403 @@ class TestCommandLine(unittest.TestCase):
         # This test is not implemented.
         pass
     
+    def test_dispatch(self):
+        # Aliases can use other aliases, their arguments go first
+        self.cl.add_alias('numbers', 'dbs numbers')
+        command, args = self.cl.resolve_command('numbers', ['--page', '10'])
+        self.assertIs(command, self.cl.coms['database'])
+        self.assertEqual(args, ['select', 'numbers', '--page', '10'])
+
+        # An alias hides the command with the same name until it's removed
+        self.cl.add_alias('help', 'todo')
+        self.assertIs(self.cl.resolve_command('help', [])[0], self.cl.builtin['todo'])
+        self.cl.remove_alias('help')
+        self.assertIs(self.cl.resolve_command('help', [])[0], self.cl.builtin['help'])
+
+        # An alias using its own name runs the real command
+        self.cl.add_alias('jobs', 'jobs --all')
+        self.assertEqual(self.cl.resolve_command('jobs', []), (self.cl.builtin['jobs'], ['--all']))
+
+        # Loops are refused
+        self.cl.add_alias('ping', 'pong')
+        with self.assertRaises(ValueError):
+            self.cl.add_alias('pong', 'ping')
+        self.assertNotIn('pong', self.cl.aliases)
+        self.assertNotIn('pong', self.cl.dispatch)
+
     def test_append_stdout(self):
-        # This test is not implemented.
-        pass
+        self.cl.append_stdout('first')
+        self.cl.append_stdout('second')
+
+        # Nothing is shown until it's flushed
+        self.assertEqual(get_stdout(), '')
+        self.assertEqual(self.cl.stdout.getvalue(), 'first\nsecond\n')
     
     def test_flush_stdout(self):
-        # This test is not implemented.
-        pass
\ No newline at end of file
+        self.cl.append_stdout('message')
+        self.cl.flush_stdout()
+
+        self.assertEqual(get_stdout(), 'message')
+        self.assertEqual(len(self.cl.stdout), 0)
+
+    def test_capture_command(self):
+        self.db.execute('''CREATE TABLE numbers (value INTEGER)''')
+        self.db.insert_many('numbers', [(1,), (2,)])
+
+        output = self.cl.capture_command('dbs', ['numbers'])
+        self.assertEqual(output.columns, ['value'])
+        self.assertEqual(list(output.rows), [(1,), (2,)])
+        self.assertEqual(get_stdout(), '')
+
+    def test_use_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'other.db')
+
+            self.cl.parse_command('database', ['use', path])
+            self.assertEqual(self.cl.db.path, path)
+            other = self.cl.db
+
+            # Reads, including background jobs, go to the new file's connections
+            self.assertEqual(other.pool.path, path)
+            self.assertEqual(other.pool.size, self.db.pool.size)
+            other.execute('''CREATE TABLE other (value INTEGER)''')
+            other.insert_many('other', [(1,)])
+            other.commit()
+            job = self.cl.start_job('dbs other', 'dbs', ['other'])
+            job.future.result()
+            self.assertEqual(job.status, 'Done')
+            self.assertEqual(job.output.read(), 'value\n-----\n1\n')
+            get_stdout()
+
+            # Switching back and forth reuses the open databases
+            self.cl.parse_command('database', ['use', ':memory:'])
+            self.assertIs(self.cl.db, self.db)
+            self.cl.parse_command('database', ['use', path])
+            self.assertIs(self.cl.db, other)
+
+            other.__del__()
+            del self.cl.databases[path]
+
+    def test_autocommit_waiting(self):
+        self.db.execute('''CREATE TABLE numbers (value INTEGER)''')
+        self.db.commit()
+        self.db.autocommit(ms=50)
+        self.db.execute('''INSERT INTO numbers VALUES (1)''')
+
+        # Writes are committed while the shell waits for the user to type something
+        self.cl.pending_input = concurrent.futures.Future()
+        threading.Timer(0.5, self.cl.pending_input.set_result, ['dbs numbers']).start()
+        self.assertEqual(asyncio.run(self.cl.read_input('> ')), 'dbs numbers')
+        self.assertFalse(self.db.db.in_transaction)
+        get_stdout()
+
+    def test_jobs(self):
+        self.db.execute('''CREATE TABLE numbers (value INTEGER)''')
+        self.db.insert_many('numbers', ((i,) for i in range(5)))
+
+        # Writes can't run in the background
+        self.assertIsNone(self.cl.start_job('dbx DELETE FROM numbers', 'dbx', ['DELETE', 'FROM', 'numbers']))
+        get_stdout()
+
+        job = self.cl.start_job('dbs numbers', 'dbs', ['numbers'])
+        self.assertEqual(get_stdout(), '[1] dbs numbers')
+
+        # The job's output is kept until `fg`
+        job.future.result()
+        self.cl.report_jobs()
+        self.assertEqual(get_stdout(), '[1] Done\tdbs numbers')
+
+        FgBuiltin()(cl=self.cl, args=['1'])
+        self.assertEqual(get_stdout(), 'value\n-----\n0\n1\n2\n3\n4')
+        self.assertNotIn(1, self.cl.jobs)
+
+    def test_jobs_isolated(self):
+        with tempfile.TemporaryDirectory() as directory:
+            db = Database(path=os.path.join(directory, 'jobs.db'))
+            cl = CommandLine(db=db)
+            db.execute('''CREATE TABLE numbers (value INTEGER)''')
+            db.insert_many('numbers', ((i,) for i in range(5)))
+            db.commit()
+
+            # Note which threads use the database's own connection
+            threads = []
+            db.db.set_trace_callback(lambda sql: threads.append(threading.current_thread().name))
+
+            # A write is still going on in the foreground while the jobs run
+            cl.parse_command('database', ['insert', 'numbers', '5'])
+            jobs = [cl.start_job(line, line.split(' ')[0], line.split(' ')[1:]) for line in
+                ('dbs numbers', 'dbl 3', 'database stats', 'database explain SELECT * FROM numbers')]
+            cl.parse_command('database', ['insert', 'numbers', '6'])
+            for job in jobs:
+                job.future.result()
+            get_stdout()
+
+            self.assertEqual([job.status for job in jobs], ['Done'] * 4)
+            # Only the foreground used the database's own connection, so the jobs didn't
+            # see its uncommitted rows
+            self.assertFalse([name for name in threads if name.startswith('sqlos-job')])
+            self.assertEqual(jobs[0].output.read(), 'value\n-----\n0\n1\n2\n3\n4\n')
+            self.assertEqual(db.execute('''SELECT count(*) FROM numbers'''), [(7,)])
+
+            # The jobs ran their own instances of the command, leaving the shell's alone
+            self.assertIs(cl.coms['database'].cl, cl)
+            db.db.set_trace_callback(None)
+            cl.__del__()
+
+    def test_run_command(self):
+        self.db.execute('''CREATE TABLE numbers (value INTEGER)''')
+
+        # Regular commands run on the command thread
+        asyncio.run(self.cl.run_command('dbi', ['numbers', '1']))
+        self.assertEqual(self.db.execute('''SELECT * FROM numbers'''), [(1,)])
+
+        # Coroutines are awaited
+        class AsyncBuiltin(Builtin):
+            async def __call__(self, cl, args):
+                return len(args)
+
+        self.cl.register_command(AsyncBuiltin('async'), builtin=True)
+        self.assertEqual(asyncio.run(self.cl.run_command('async', ['a', 'b'])), 2)
+
+    def test_split_pipeline(self):
+        self.assertEqual(self.cl.split_pipeline('dbs events'), [('dbs', ['events'])])
+        self.assertEqual(self.cl.split_pipeline('dbs events |  head 10 | count'),
+            [('dbs', ['events']), ('head', ['10']), ('count', [])])
+
+        # Only a `|` on its own separates commands
+        self.assertEqual(self.cl.split_pipeline("dbx SELECT a || 'x' FROM t"),
+            [('dbx', ['SELECT', 'a', '||', "'x'", 'FROM', 't'])])
+
+    def test_pipeline(self):
+        self.db.execute('''CREATE TABLE numbers (value INTEGER, name STRING)''')
+        self.db.insert_many('numbers', ((i, 'n{}'.format(i)) for i in range(100)))
+
+        self.cl.run_pipeline(self.cl.split_pipeline('dbs numbers | filter value >= 50 | sort value desc | head 3'))
+        self.assertEqual(get_stdout(), 'value  name\n-----  ----\n99     n99\n98     n98\n97     n97')
+
+        self.cl.run_pipeline(self.cl.split_pipeline('dbs numbers | filter name ~ N1 | count'))
+        self.assertEqual(get_stdout(), 'count\n-----\n11')
+
+        # Text is piped as lines
+        self.cl.run_pipeline(self.cl.split_pipeline('todo | filter STANDARD out'))
+        self.assertEqual(get_stdout(), 'Move all print statements to standard out')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'numbers.csv')
+            self.cl.run_pipeline(self.cl.split_pipeline('dbs numbers | head 2 | export ' + path))
+            self.assertEqual(get_stdout(), 'Exported 2 rows to ' + path)
+            with open(path) as f:
+                self.assertEqual(f.read().split(), ['value,name', '0,n0', '1,n1'])
+
+    def test_insert(self):
+        self.db.execute('''CREATE TABLE events (name STRING, created STRING, size INTEGER)''')
+
+        self.cl.parse_command('database', ['insert', 'events', 'one', "sql:date('2020-01-02')", '1'])
+        self.cl.parse_command('database', ['insert', 'events', 'VALUES', "('two', date('2020-01-02',", "'+1", "day'),", '2),',
+            "(three,", 'NULL,', '-3),', "('it''s',", 'date(NULL),', '4)'])
+        self.assertEqual(get_stdout(), 'Inserted 3 rows')
+        self.assertEqual(self.db.execute('''SELECT * FROM events'''), [('one', '2020-01-02', 1),
+            ('two', '2020-01-03', 2), ('three', None, -3), ("it's", None, 4)])
+
+        self.cl.parse_command('database', ['insert', 'events', '(name)', 'VALUES', '(four)'])
+        self.assertEqual(self.db.execute('''SELECT name, size FROM events WHERE name = 'four' '''),
+            [('four', None)])
+
+        # Only whitelisted functions can be called, and nothing is inserted
+        self.cl.parse_command('database', ['insert', 'events', "sql:load_extension('x')"])
+        self.assertEqual(get_stdout(), "Function `load_extension` can't be used in values")
+        self.assertEqual(self.db.execute('''SELECT count(*) FROM events'''), [(5,)])
+
+        # Rows go in in the order they're given
+        self.db.execute('''CREATE TABLE notes (id INTEGER, text STRING)''')
+        self.cl.parse_command('database', ['insert', 'notes', 'VALUES', '(1,', 'a),', '(2,', 'NULL),',
+            '(3,', "upper('c')),", '(4,', 'd)'])
+        self.assertEqual(self.db.execute('''SELECT * FROM notes'''),
+            [(1, 'a'), (2, None), (3, 'C'), (4, 'd')])
+
+        # Values which only look like the start of a list of rows are inserted as they are
+        self.db.execute('''CREATE TABLE words (word STRING)''')
+        self.cl.parse_command('database', ['insert', 'words', '(draft)'])
+        self.cl.parse_command('database', ['insert', 'words', 'values'])
+        self.assertEqual(self.db.execute('''SELECT * FROM words'''), [('(draft)',), ('values',)])
+        get_stdout()
+
+        # Column names are quoted, so keywords and spaces are fine
+        self.db.execute('''CREATE TABLE orders ("order" INTEGER, "first name" STRING)''')
+        self.cl.parse_command('database', ['insert', 'orders', '(order,', '"first', 'name")', 'VALUES', '(1,', 'bob)'])
+        self.cl.parse_command('database', ['update', 'orders', 'SET', '"first', 'name"', '=', 'alice', '--all'])
+        get_stdout()
+        self.assertEqual(self.db.execute('''SELECT * FROM orders'''), [(1, 'alice')])
+
+    def test_update_delete(self):
+        self.db.execute('''CREATE TABLE users (id INTEGER PRIMARY KEY, name STRING, age INTEGER)''')
+        self.db.insert_many('users', ((i, 'user{}'.format(i), 20 + i) for i in range(10)))
+
+        self.cl.parse_command('database', ['update', 'users', 'SET', 'name', '=', "'Bob", "Smith',", 'age', '=', 'abs(-1)',
+            'WHERE', 'id', '=', '3'])
+        self.assertTrue(get_stdout().startswith('Updated 1 rows in '))
+        self.assertEqual(self.db.execute('''SELECT name, age FROM users WHERE id = 3'''), [('Bob Smith', 1)])
+
+        # Like deleting, a condition or --all is needed
+        self.assertEqual(self.cl.parse_command('database', ['update', 'users', 'SET', 'age', '=', '0']), -1)
+        self.assertEqual(get_stdout(), 'Updating needs a WHERE clause, or --all to update every row.\n'
+            'Usage: database update <table> SET <column> = <value>, ... WHERE ... | --all')
+        self.assertEqual(self.db.execute('''SELECT count(*) FROM users WHERE age = 0'''), [(0,)])
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'changes.csv')
+            with open(path, 'w') as f:
+                f.write('name,id\nalice,1\ncarol,2\nnobody,99\n')
+            self.cl.parse_command('database', ['update', '--batch', 'users', path, '--key', 'id'])
+            self.assertTrue(get_stdout().startswith('Updated 2 rows in '))
+            self.assertEqual(self.db.execute('''SELECT name FROM users WHERE id < 3'''),
+                [('user0',), ('alice',), ('carol',)])
+
+            with open(path, 'w') as f:
+                f.write('id\n1\n2\n')
+            self.cl.parse_command('database', ['delete', '--batch', 'users', path])
+            self.assertTrue(get_stdout().startswith('Deleted 2 rows in '))
+
+        # A condition or --all is needed
+        self.assertEqual(self.cl.parse_command('database', ['delete', 'users']), -1)
+        self.assertTrue(get_stdout().startswith('Deleting needs a WHERE clause'))
+        self.assertEqual(self.cl.parse_command('database', ['delete', 'users', '--all', '--chunk']), -1)
+        self.assertEqual(get_stdout(), '--chunk needs a value.\nUsage: database delete <table> WHERE ... | --all [--chunk N]')
+        self.assertEqual(self.db.execute('''SELECT count(*) FROM users'''), [(8,)])
+
+        self.cl.parse_command('database', ['delete', 'users', 'WHERE', 'age', '>', '25', '--chunk', '2'])
+        self.assertTrue(get_stdout().split('\r')[-1].startswith('Deleted 4 rows in '))
+        self.assertEqual(self.db.execute('''SELECT id FROM users'''), [(0,), (3,), (4,), (5,)])
+
+        self.cl.parse_command('database', ['delete', 'users', '--all'])
+        self.assertEqual(self.db.execute('''SELECT count(*) FROM users'''), [(0,)])
+
+    def test_select_page(self):
+        self.db.execute('''CREATE TABLE numbers (value INTEGER)''')
+        self.db.insert_many('numbers', ((i,) for i in range(5)))
+
+        for args in (['--page'], ['--page', 'ten'], ['--page', '0'], ['--page', '10']):
+            self.assertEqual(self.cl.parse_command('database', ['select'] + args), -1)
+            self.assertTrue(get_stdout().endswith('Usage: database select <table> [column...] [--page N]'))
+
+        # Stops paging when there's nothing left to read the answer from
+        stdin = sys.stdin
+        sys.stdin = io.StringIO()
+        try:
+            self.assertEqual(self.cl.parse_command('database', ['select', 'numbers', '--page', '2']), 0)
+        finally:
+            sys.stdin = stdin
+        self.assertEqual(get_stdout().split('\n')[2:], ['0', '1', '-- More -- (enter to continue, q to stop)'])
+
+    def test_interrupt(self):
+        self.db.execute('''CREATE TABLE numbers (value INTEGER)''')
+        self.db.insert_many('numbers', ((i,) for i in range(5)))
+
+        # Input which doesn't come until it's written
+        read, write = os.pipe()
+        stdin = sys.stdin
+        sys.stdin = os.fdopen(read)
+
+        async def interrupt_select():
+            self.cl.main_task = asyncio.current_task()
+            self.cl.running = asyncio.ensure_future(self.cl.run_command('dbs', ['numbers', '--page', '2']))
+            for i in range(100):
+                if self.cl.pending_input is not None:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertIsNotNone(self.cl.pending_input)
+
+            # Ctrl-C while the select waits at its prompt stops it
+            self.cl.interrupt()
+            with self.assertRaises(asyncio.CancelledError):
+                await self.cl.running
+            self.cl.running = None
+
+            # The next command runs straight away, and the line typed goes to the shell
+            count = await asyncio.wait_for(self.cl.run_command('dbs', ['numbers', 'count(*)']), 1)
+            os.write(write, b'jobs\n')
+            line = await asyncio.wait_for(self.cl.read_input('> '), 1)
+
+            return count, line
+
+        try:
+            self.assertEqual(asyncio.run(interrupt_select()), (0, 'jobs'))
+        finally:
+            os.close(write)
+            sys.stdin.close()
+            sys.stdin = stdin
+            self.cl.main_task = None
+
+        self.assertEqual(get_stdout().split('\n'), ['value', '-----', '0', '1',
+            '-- More -- (enter to continue, q to stop) count(*)', '--------', '5', '>'])
+
+    def test_head(self):
+        read = []
+        def rows():
+            for i in range(1000):
+                read.append(i)
+                yield (i,)
+
+        # Only the rows passed on are read
+        self.cl.pipe = (['value'], rows())
+        HeadBuiltin()(cl=self.cl, args=['3'])
+        self.assertEqual(read, [0, 1, 2])
+        self.assertEqual(get_stdout(), 'value\n-----\n0\n1\n2')
+
+        # Without a pipe there's nothing to work on
+        self.cl.pipe = None
+        self.assertEqual(HeadBuiltin()(cl=self.cl, args=[]), 1)
+        get_stdout()
+
+    def test_run_script(self):
+        script = io.StringIO('\n'.join([
+            '# Comments and blank lines are skipped',
+            '',
+            'database create EOF',
+            'numbers',
+            'value INTEGER',
+            'EOF',
+            'dbi numbers 1',
+            'dbi numbers 2',
+        ]))
+
+        self.assertEqual(self.cl.run_script(script), 0)
+        self.assertEqual(self.db.execute('''SELECT * FROM numbers'''), [(1,), (2,)])
+        self.assertFalse(self.db.db.in_transaction)
+
+        # A failing script is rolled back
+        script = io.StringIO('dbi numbers 3\ndbx SELECT * FROM missing\ndbi numbers 4')
+
+        self.assertEqual(self.cl.run_script(script), 1)
+        self.assertEqual(self.db.execute('''SELECT * FROM numbers'''), [(1,), (2,)])
+        get_stdout()
+
+        # So is one where a sub-command refuses its arguments
+        script = io.StringIO('dbi numbers 3\ndbi numbers VALUES (4\ndbi numbers 5')
+
+        self.assertEqual(self.cl.run_script(script), 1)
+        self.assertEqual(self.db.execute('''SELECT * FROM numbers'''), [(1,), (2,)])
+        get_stdout()
+
+        # Scripts can open their own transactions inside the script's
+        script = io.StringIO('\n'.join([
+            'database begin',
+            'dbi numbers 3',
+            'database rollback',
+            'database begin',
+            'dbi numbers 4',
+            'database commit',
+            'dbi numbers 5',
+        ]))
+
+        self.assertEqual(self.cl.run_script(script), 0)
+        self.assertEqual(self.db.execute('''SELECT * FROM numbers'''), [(1,), (2,), (4,), (5,)])
+        self.assertFalse(self.db.db.in_transaction)
+        get_stdout()
+
+        # And everything they did is rolled back if the script fails
+        script = io.StringIO('database begin\ndbi numbers 6\ndatabase commit\ndbx SELECT * FROM missing')
+
+        self.assertEqual(self.cl.run_script(script), 1)
+        self.assertEqual(self.db.execute('''SELECT * FROM numbers'''), [(1,), (2,), (4,), (5,)])
+        get_stdout()
@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+
+import config
+from database import Database
+
+
+class TestConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'sqlos.ini')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_config(self, text):
+        with open(self.path, 'w') as f:
+            f.write('[database]\n' + text)
+
+    def test_load_config(self):
+        self.assertEqual(config.load_config(self.path), {})
+
+        self.write_config('profile = fast\ncache_size = -1024\nlog_size = 100\n'
+            'log_interval = 0.5\nschema_fallback = no\n')
+        settings = config.load_config(self.path)
+
+        self.assertEqual(settings, {'profile': 'fast', 'cache_size': '-1024', 'log_size': 100,
+            'log_interval': 0.5, 'schema_fallback': False})
+
+        # Everything read can be given to the database
+        db = Database(_type='memory', **settings)
+        self.assertEqual(db.log.recent.maxlen, 100)
+        self.assertEqual(db.pragma('cache_size'), -1024)
+        db.__del__()
+
+    def test_invalid_config(self):
+        self.write_config('log_size = lots\n')
+        with self.assertRaises(ValueError):
+            config.load_config(self.path)
+
+        self.write_config('path = other.db\n')
+        with self.assertRaises(ValueError):
+            config.load_config(self.path)
@@ -1,3 +1,8 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
 
 from database import Database
@@ -13,29 +18,357 @@ class TestDatabase(unittest.TestCase):
     def test_create_meta(self):
         '''
         Test database meta tables.
-        CREATE TABLE users (username STRING, password STRING)
+        CREATE TABLE users (username STRING UNIQUE NOT NULL, password STRING NOT NULL)
         Should create:
         table_meta:
             name -> users
             column1 ->
                 name -> username
                 type -> string
-                is_nullable -> 1
+                is_nullable -> 0
                 is_unique -> 1
                 is_primary_key -> 0
             column2 ->
                 name -> password
                 type -> string
-                is_nullable -> 1
+                is_nullable -> 0
                 is_unique -> 0
                 is_primary_key -> 0
         '''
         self.db.execute('''CREATE TABLE users (username STRING UNIQUE NOT NULL, password STRING NOT NULL)''')
         
-        self.assertListEqual(self.db.get_table_meta('users'), [('users', 'username', 'STRING', 1, 1, 0), ('users', 'password', 'STRING', 1, 0, 0)])
+        self.assertListEqual(self.db.get_table_meta('users'), [('users', 'username', 'STRING', 0, 1, 0), ('users', 'password', 'STRING', 0, 0, 0)])
+
+    def test_create_meta_complex(self):
+        self.db.execute('''CREATE TABLE IF NOT EXISTS prices (
+            id INTEGER,
+            amount DECIMAL(10,2) NOT NULL CHECK (amount >= 0),
+            currency STRING DEFAULT 'GBP',
+            PRIMARY KEY (id, currency)
+        )''')
+        # Running it again does nothing
+        self.db.execute('''CREATE TABLE IF NOT EXISTS prices (id INTEGER)''')
+
+        self.assertListEqual(self.db.get_table_meta('prices'), [('prices', 'id', 'INTEGER', 1, 0, 1),
+            ('prices', 'amount', 'DECIMAL(10,2)', 0, 0, 0), ('prices', 'currency', 'STRING', 1, 0, 1)])
     
     def test_delete_meta(self):
         self.db.execute('''CREATE TABLE users (username STRING, password STRING)''')
         self.db.execute('''DROP TABLE users''')
 
-        self.assertCountEqual(self.db.get_table_meta('users'), [])
\ No newline at end of file
+        self.assertCountEqual(self.db.get_table_meta('users'), [])
+
+    def test_stream(self):
+        self.db.execute('''CREATE TABLE numbers (value INTEGER)''')
+        for i in range(25):
+            self.db.execute('''INSERT INTO numbers VALUES (?)''', i)
+
+        rows = self.db.stream('''SELECT value FROM numbers''', batch_size=10)
+
+        # Other statements can run while the stream is still open
+        self.assertEqual(next(rows), (0,))
+        self.assertEqual(self.db.execute('''SELECT count(*) FROM numbers'''), [(25,)])
+        self.assertListEqual(list(rows), [(i,) for i in range(1, 25)])
+
+    def test_statement_cache(self):
+        self.db.execute('''CREATE TABLE numbers (value INTEGER)''')
+        for i in range(10):
+            self.db.execute('''INSERT INTO numbers VALUES (?)''', i)
+
+        stats = self.db.cache_stats()
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['hits'], 9)
+
+    def test_insert_many(self):
+        self.db.execute('''CREATE TABLE numbers (value INTEGER, name STRING)''')
+
+        count = self.db.insert_many('numbers', ((i, str(i)) for i in range(25)), batch_size=10)
+
+        self.assertEqual(count, 25)
+        self.assertEqual(self.db.execute('''SELECT count(*) FROM numbers'''), [(25,)])
+        # One log entry per batch
+        self.assertEqual(len([i for i in self.db.log if i.startswith('INSERT')]), 3)
+
+    def test_update_delete_many(self):
+        self.db.execute('''CREATE TABLE numbers (value INTEGER, name STRING)''')
+        self.db.insert_many('numbers', ((i, str(i)) for i in range(25)))
+        self.db.commit()
+
+        count = self.db.update_many('numbers', ['name'], ['value'], [('one', 1), ('two', 2), ('none', 99)])
+        self.assertEqual(count, 2)
+        self.assertEqual(self.db.execute('''SELECT name FROM numbers WHERE value IN (1, 2)'''),
+            [('one',), ('two',)])
+
+        self.assertEqual(self.db.delete_many('numbers', ['value'], [(1,), (2,)]), 2)
+
+        # Chunks are committed as they go
+        chunks = []
+        count = self.db.delete_chunked('numbers', 'value >= ?', (10,), chunk_size=4, progress=chunks.append)
+        self.assertEqual((count, chunks), (15, [4, 8, 12, 15]))
+        self.assertFalse(self.db.db.in_transaction)
+        self.assertEqual(self.db.execute('''SELECT count(*) FROM numbers'''), [(8,)])
+
+        # Tables without rowids are deleted from in one go
+        self.db.execute('''CREATE TABLE keyed (id INTEGER PRIMARY KEY, name STRING) WITHOUT ROWID''')
+        self.db.insert_many('keyed', ((i, str(i)) for i in range(5)))
+        self.assertEqual(self.db.delete_chunked('keyed', chunk_size=2), 5)
+
+    def test_schema_fallback(self):
+        # Tables altered outside of the meta tables are looked up with PRAGMA table_info
+        self.db.execute('''CREATE TABLE users (username STRING)''')
+        self.db.execute('''ALTER TABLE users ADD COLUMN password STRING NOT NULL DEFAULT ''  ''')
+
+        self.assertListEqual(self.db.get_table_meta('users'),
+            [('users', 'username', 'STRING', 1, 0, 0), ('users', 'password', 'STRING', 0, 0, 0)])
+
+    def test_transaction(self):
+        self.db.execute('''CREATE TABLE numbers (value INTEGER)''')
+        self.db.commit()
+
+        with self.db.transaction():
+            self.db.execute('''INSERT INTO numbers VALUES (1)''')
+
+            # Nested transactions only roll back their own changes
+            with self.assertRaises(ValueError):
+                with self.db.transaction():
+                    self.db.execute('''INSERT INTO numbers VALUES (2)''')
+                    raise ValueError()
+
+        self.assertFalse(self.db.db.in_transaction)
+        self.assertEqual(self.db.execute('''SELECT * FROM numbers'''), [(1,)])
+
+        self.db.begin()
+        self.db.execute('''INSERT INTO numbers VALUES (3)''')
+        self.db.rollback()
+
+        self.assertEqual(self.db.execute('''SELECT * FROM numbers'''), [(1,)])
+
+    def test_transaction_pending_writes(self):
+        self.db.execute('''CREATE TABLE numbers (value INTEGER UNIQUE)''')
+        self.db.commit()
+
+        # Writes which haven't been committed aren't lost when a bulk insert fails
+        self.db.execute('''INSERT INTO numbers VALUES (1)''')
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.insert_many('numbers', [(2,), (3,), (2,)])
+
+        self.assertTrue(self.db.db.in_transaction)
+        self.assertEqual(self.db.execute('''SELECT * FROM numbers'''), [(1,)])
+
+        # Or committed part way through a chunked delete
+        self.db.insert_many('numbers', [(2,), (3,)])
+        self.db.delete_chunked('numbers', 'value > 1', chunk_size=1)
+        self.assertTrue(self.db.db.in_transaction)
+
+        # Rolling back a transaction only rolls back what came after `begin`
+        self.db.begin()
+        self.db.execute('''INSERT INTO numbers VALUES (4)''')
+        self.db.rollback()
+
+        self.assertEqual(self.db.execute('''SELECT * FROM numbers'''), [(1,)])
+        self.db.rollback()
+        self.assertEqual(self.db.execute('''SELECT * FROM numbers'''), [])
+
+    def test_schema_changes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.db')
+            first = Database(path=path)
+            second = Database(path=path)
+            first.execute('''CREATE TABLE t (a INTEGER UNIQUE)''')
+            first.commit()
+            self.assertEqual([column[1] for column in second.get_table_meta('t')], ['a'])
+
+            # Changes made by another connection are picked up
+            first.execute('''ALTER TABLE t ADD COLUMN b STRING''')
+            first.commit()
+            self.assertEqual([column[1:] for column in second.get_table_meta('t')],
+                [('a', 'INTEGER', 1, 1, 0), ('b', 'STRING', 1, 0, 0)])
+
+            first.execute('''DROP TABLE t''')
+            first.execute('''CREATE TABLE t (x, y, z)''')
+            first.commit()
+            self.assertEqual([column[1] for column in second.get_table_meta('t')], ['x', 'y', 'z'])
+
+            first.__del__()
+            second.__del__()
+
+    def test_rollback_schema(self):
+        self.db.begin()
+        self.db.execute('''CREATE TABLE users (username STRING)''')
+        self.db.rollback()
+
+        self.assertListEqual(self.db.get_table_meta('users'), [])
+
+    def test_autocommit(self):
+        self.db.execute('''CREATE TABLE numbers (value INTEGER)''')
+        self.db.commit()
+        self.db.autocommit(every=3)
+
+        self.db.execute('''INSERT INTO numbers VALUES (1)''')
+        self.db.execute('''INSERT INTO numbers VALUES (2)''')
+        self.assertTrue(self.db.db.in_transaction)
+
+        self.db.execute('''INSERT INTO numbers VALUES (3)''')
+        self.assertFalse(self.db.db.in_transaction)
+
+        # Old writes are committed by the next statement, even one answered from the cache
+        self.db.cache_results(1 << 20)
+        self.db.autocommit(ms=50)
+        self.db.execute('''SELECT count(*) FROM numbers''')
+        self.db.execute('''INSERT INTO numbers VALUES (4)''')
+        self.db.execute('''SELECT value FROM numbers''')
+        self.assertGreater(self.db.autocommit_due(), 0)
+        time.sleep(0.06)
+        self.assertEqual(self.db.autocommit_due(), 0)
+        self.assertEqual(self.db.execute('''SELECT value FROM numbers'''), [(1,), (2,), (3,), (4,)])
+        self.assertFalse(self.db.db.in_transaction)
+        self.assertIsNone(self.db.autocommit_due())
+
+    def test_pragmas(self):
+        db = Database(_type='memory', profile='fast', cache_size=-1024)
+
+        # Settings passed in override the profile
+        self.assertEqual(db.pragma('cache_size'), -1024)
+        self.assertEqual(db.pragma('temp_store'), 2)
+
+        db.use_profile('bulk-load')
+        self.assertEqual(db.pragma('synchronous'), 0)
+
+        with self.assertRaises(ValueError):
+            db.pragma('cache_size', '1; DROP TABLE logs')
+
+        db.__del__()
+
+    def test_read_pool(self):
+        with tempfile.TemporaryDirectory() as directory:
+            db = Database(path=os.path.join(directory, 'pool.db'), pool_size=2)
+            db.execute('''CREATE TABLE numbers (value INTEGER)''')
+            db.insert_many('numbers', ((i,) for i in range(100)))
+            db.commit()
+
+            # Reads run on other threads, on their own connections
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(
+                list(db.read('''SELECT sum(value) FROM numbers''')))) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertListEqual(results, [[(4950,)]] * 4)
+            self.assertLessEqual(len(db.pool.connections), 2)
+
+            with self.assertRaises(Exception):
+                db.read('''DELETE FROM numbers''')
+
+            # Settings changed later reach the read connections, even without a profile
+            db.pragma('cache_size', -1234)
+            self.assertEqual(list(db.read('''PRAGMA cache_size''')), [(-1234,)])
+
+            db.__del__()
+
+    def test_attach(self):
+        self.db.attach(':memory:', 'other')
+        self.db.execute('''CREATE TABLE other.numbers (value INTEGER)''')
+        self.db.execute('''INSERT INTO other.numbers VALUES (1)''')
+
+        self.assertEqual(self.db.execute('''SELECT * FROM other.numbers'''), [(1,)])
+
+        self.db.commit()
+        self.db.detach('other')
+
+    def test_interrupt(self):
+        # Counts forever unless interrupted
+        sql = '''WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i+1 FROM n) SELECT count(*) FROM n'''
+
+        timer = threading.Timer(0.1, self.db.interrupt)
+        timer.start()
+        with self.assertRaises(sqlite3.OperationalError):
+            self.db.execute(sql)
+        timer.join()
+
+    def test_result_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.db')
+            db = Database(path=path, result_cache=1 << 20)
+            db.execute('''CREATE TABLE numbers (value INTEGER)''')
+            db.execute('''CREATE TABLE other (value INTEGER)''')
+            db.insert_many('numbers', [(1,), (2,)])
+
+            self.assertEqual(db.execute('''SELECT count(*) FROM numbers'''), [(2,)])
+            # Spacing and keyword case don't matter
+            self.assertEqual(list(db.stream('''select   count(*) from numbers''')), [(2,)])
+            self.assertEqual(db.results.stats()['hits'], 1)
+
+            # Writes to other tables leave the result alone
+            db.execute('''INSERT INTO other VALUES (1)''')
+            db.commit()
+            self.assertEqual(len(db.results.results), 1)
+
+            db.execute('''INSERT INTO numbers VALUES (3)''')
+            db.commit()
+            self.assertEqual(db.execute('''SELECT count(*) FROM numbers'''), [(3,)])
+
+            # Changes from another connection are noticed
+            conn = sqlite3.connect(path)
+            conn.execute('''INSERT INTO numbers VALUES (4)''')
+            conn.commit()
+            conn.close()
+            self.assertEqual(db.execute('''SELECT count(*) FROM numbers'''), [(4,)])
+
+            # Results with changes which are rolled back are thrown away
+            db.execute('''INSERT INTO numbers VALUES (5)''')
+            self.assertEqual(db.execute('''SELECT count(*) FROM numbers'''), [(5,)])
+            db.rollback()
+            self.assertEqual(db.execute('''SELECT count(*) FROM numbers'''), [(4,)])
+
+            # Queries which depend on the time aren't cached
+            db.execute('''SELECT datetime('now')''')
+            self.assertEqual(len(db.results.results), 1)
+
+            # Deletes behind a WITH clause are writes
+            db.execute('''WITH big AS (SELECT value FROM numbers WHERE value > 3)
+                DELETE FROM numbers WHERE value IN big''')
+            self.assertEqual(db.execute('''SELECT count(*) FROM numbers'''), [(3,)])
+
+            # So are changes made by triggers
+            db.execute('''SELECT count(*) FROM other''')
+            db.execute('''CREATE TRIGGER copy AFTER INSERT ON numbers BEGIN
+                INSERT INTO other VALUES (new.value); END''')
+            db.execute('''SELECT count(*) FROM other''')
+            db.execute('''INSERT INTO numbers VALUES (6)''')
+            self.assertEqual(db.execute('''SELECT count(*) FROM other'''), [(2,)])
+            db.__del__()
+
+    def test_result_cache_log_writes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            db = Database(path=os.path.join(directory, 'test.db'), result_cache=1 << 20)
+            db.execute('''CREATE TABLE numbers (value INTEGER)''')
+            db.insert_many('numbers', [(1,), (2,)])
+            db.commit()
+
+            # The log's writer commits on its own connection, which doesn't count as a change
+            for i in range(5):
+                self.assertEqual(list(db.stream('''SELECT * FROM numbers''')), [(1,), (2,)])
+                db.log.flush()
+
+            self.assertEqual(db.results.stats()['hits'], 4)
+            db.__del__()
+
+    def test_indexes(self):
+        self.db.execute('''CREATE TABLE users (id INTEGER, name STRING)''')
+
+        name = self.db.create_index('users', ['name', 'id'], unique=True)
+        self.assertEqual(name, 'idx_users_name_id')
+        # Indexes made with plain SQL are kept track of too
+        self.db.execute('''CREATE INDEX users_id ON users (id)''')
+
+        self.assertEqual(self.db.get_indexes('users'), [('idx_users_name_id', 'users', ['name', 'id'], 1),
+            ('users_id', 'users', ['id'], 0)])
+
+        self.db.drop_index('users_id')
+        self.assertEqual([index[0] for index in self.db.get_indexes()], ['idx_users_name_id'])
+
+        # Dropping the table drops its indexes
+        self.db.execute('''DROP TABLE users''')
+        self.assertEqual(self.db.get_indexes(), [])
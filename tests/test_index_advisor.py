@@ -0,0 +1,33 @@
+import unittest
+
+from database import Database
+import index_advisor
+
+class TestIndexAdvisor(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(_type='memory')
+        self.db.execute('''CREATE TABLE events (id INTEGER, user_id INTEGER, kind STRING)''')
+        self.db.insert_many('events', ((i, i % 100, 'kind{}'.format(i % 3)) for i in range(1000)))
+
+    def tearDown(self):
+        self.db.__del__()
+        del self.db
+
+    def test_advise(self):
+        for user in range(5):
+            self.db.execute('''SELECT * FROM events WHERE user_id = ? ORDER BY id''', user)
+        # Run once, which isn't enough to suggest anything
+        self.db.execute('''SELECT * FROM events WHERE kind = 'kind1' ''')
+
+        suggestions = index_advisor.advise(self.db, self.db.log.profiles(100))
+        self.assertEqual([(suggestion.table, suggestion.columns, suggestion.calls)
+            for suggestion in suggestions], [('events', ('user_id',), 5)])
+        self.assertIn('USING INDEX', suggestions[0].plan)
+        self.assertLessEqual(suggestions[0].saved_ms, suggestions[0].total_ms)
+
+        # The trial index isn't left behind
+        self.assertEqual(self.db.execute('''SELECT name FROM sqlite_master WHERE name = ?''', index_advisor.TRIAL_INDEX), [])
+
+        # Nothing is suggested once there's an index
+        self.db.create_index('events', ['user_id'])
+        self.assertEqual(index_advisor.advise(self.db, self.db.log.profiles(100)), [])
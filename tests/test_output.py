@@ -0,0 +1,64 @@
+import unittest
+
+from output import Output, OutputRouter, buffered, capture, emit, redirect
+
+import io
+import sys
+import threading
+
+
+class TestOutput(unittest.TestCase):
+
+    def test_batches(self):
+        stream = io.StringIO()
+        output = Output(stream, batch_size=10)
+
+        output.write('12345')
+        self.assertEqual(stream.getvalue(), '')
+        self.assertEqual(len(output), 5)
+
+        # Filling the batch writes it out in one go
+        output.write('67890')
+        self.assertEqual(stream.getvalue(), '1234567890')
+        self.assertEqual(len(output), 0)
+
+        output.write('abc')
+        output.flush()
+        self.assertEqual(stream.getvalue(), '1234567890abc')
+
+    def test_redirect(self):
+        stdout = sys.stdout
+        other = []
+
+        with capture() as outer:
+            print('outer')
+            with buffered() as inner:
+                print('inner')
+            print('outer again')
+
+            # Other threads still write to the real stdout
+            thread = threading.Thread(target=lambda: other.append(sys.stdout.target()))
+            thread.start()
+            thread.join()
+
+        self.assertEqual(outer.getvalue(), 'outer\ninner\nouter again\n')
+        self.assertIs(other[0], stdout)
+
+        # The router is only there while something is redirected
+        self.assertIs(sys.stdout, stdout)
+
+    def test_emit(self):
+        rows = iter([(1, 'a'), (2, 'b')])
+
+        with capture(keep_rows=True) as output:
+            self.assertIsNone(emit(rows, ['id', 'name']))
+
+        # The rows are handed over without being read
+        self.assertEqual(output.columns, ['id', 'name'])
+        self.assertIs(output.rows, rows)
+        self.assertEqual(output.getvalue(), '')
+
+        with capture() as output:
+            self.assertEqual(emit(rows, ['id', 'name']), 2)
+
+        self.assertEqual(output.getvalue(), 'id  name\n--  ----\n1   a\n2   b\n')
@@ -0,0 +1,93 @@
+import unittest
+
+from commands.command import Command
+from plugins import LazyCommand, find_commands, scan_module
+
+import os
+import tempfile
+
+
+COMMAND_SOURCE = '''
+from commands.command import Command
+
+class HelloCommand(Command):
+    def __init__(self):
+        super(HelloCommand, self).__init__('hello', 'Says hello')
+
+class Helper():
+    pass
+'''
+
+MIXIN_SOURCE = '''
+from commands.command import Command
+
+class HelloError(Exception):
+    pass
+
+class Greeter():
+    pass
+
+class HelloCommand(Greeter, Command):
+    def __init__(self):
+        super(HelloCommand, self).__init__('hello', 'Says hello')
+'''
+
+class TestPlugins(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'plugins')
+        self.manifest = os.path.join(self.path, '__pycache__', 'manifest.json')
+        os.mkdir(self.path)
+
+        self.module = os.path.join(self.path, 'hello.py')
+        with open(self.module, 'w') as f:
+            f.write(COMMAND_SOURCE)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_scan_module(self):
+        self.assertEqual(scan_module(self.module), {'hello': 'HelloCommand'})
+
+        # Names which aren't plain strings can't be worked out without running the module
+        with open(self.module, 'w') as f:
+            f.write(COMMAND_SOURCE.replace("'hello'", "NAME"))
+        self.assertIsNone(scan_module(self.module))
+
+        # Other classes from the module and builtins can be told apart from commands
+        with open(self.module, 'w') as f:
+            f.write(MIXIN_SOURCE)
+        self.assertEqual(scan_module(self.module), {'hello': 'HelloCommand'})
+
+        # Commands which only inherit `Command` through another module's class need importing
+        with open(self.module, 'w') as f:
+            f.write(COMMAND_SOURCE.replace('from commands.command import Command',
+                'from commands.database_command import DatabaseCommand')
+                .replace('HelloCommand(Command)', 'HelloCommand(DatabaseCommand)'))
+        self.assertIsNone(scan_module(self.module))
+        self.assertEqual(find_commands(self.path, self.manifest), {'plugins.hello': None})
+
+    def test_find_commands(self):
+        self.assertEqual(find_commands(self.path, self.manifest), {'plugins.hello': {'hello': 'HelloCommand'}})
+        self.assertTrue(os.path.exists(self.manifest))
+
+        # Unchanged modules come from the manifest
+        with open(self.manifest) as f:
+            manifest = f.read()
+        with open(self.manifest, 'w') as f:
+            f.write(manifest.replace('HelloCommand', 'CachedCommand'))
+        self.assertEqual(find_commands(self.path, self.manifest), {'plugins.hello': {'hello': 'CachedCommand'}})
+
+        # Changed modules are read again
+        with open(self.module, 'a') as f:
+            f.write('\n# Changed\n')
+        self.assertEqual(find_commands(self.path, self.manifest), {'plugins.hello': {'hello': 'HelloCommand'}})
+
+    def test_lazy_command(self):
+        command = LazyCommand('database', 'commands.database_command', 'DatabaseCommand')
+        self.assertIsNone(command.load_time)
+
+        self.assertEqual(command.desc, command.load().desc)
+        self.assertIsInstance(command.command, Command)
+        self.assertIsNotNone(command.load_time)
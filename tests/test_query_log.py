@@ -0,0 +1,147 @@
+import unittest
+
+from database import Database
+import query_log
+
+import os
+import sqlite3
+import tempfile
+
+class TestQueryLog(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(_type='memory', log_size=5, log_batch_size=3)
+
+    def tearDown(self):
+        self.db.__del__()
+        del self.db
+
+    def count_logs(self):
+        return self.db.db.execute('''SELECT count(*) FROM logs''').fetchone()[0]
+
+    def test_batches(self):
+        self.db.execute('''SELECT 1''')
+        self.db.execute('''SELECT 2''')
+
+        # Nothing is written until a batch fills up
+        self.assertEqual(self.count_logs(), 0)
+
+        self.db.execute('''SELECT 3''')
+
+        self.assertEqual(self.count_logs(), 3)
+
+    def test_ring_buffer(self):
+        for i in range(10):
+            self.db.execute('''SELECT ?''', i)
+
+        self.assertListEqual(list(self.db.log), ['SELECT {}'.format(i) for i in range(5, 10)])
+
+    def test_page(self):
+        for i in range(10):
+            self.db.execute('''SELECT ?''', i)
+
+        # Entry 9 is still pending, the rest come from the logs table
+        self.assertListEqual(self.db.log.page(4), ['SELECT {}'.format(i) for i in range(6, 10)])
+        self.assertListEqual(self.db.log.page(4, 2), ['SELECT 0', 'SELECT 1'])
+
+    def test_profiles(self):
+        self.db.execute('''CREATE TABLE numbers (value INTEGER)''')
+        self.db.insert_many('numbers', ((i,) for i in range(10)))
+        for i in range(3):
+            self.db.execute('''SELECT * FROM numbers WHERE value > ?''', i)
+
+        message, template, duration, rows, plan = self.db.log.profiles(10)[0]
+        self.assertEqual(message, 'SELECT * FROM numbers WHERE value > 2')
+        self.assertEqual(template, 'SELECT * FROM numbers WHERE value > ?')
+        self.assertGreaterEqual(duration, 0)
+        self.assertEqual(rows, 7)
+        self.assertEqual(query_log.full_scans(plan), ['SCAN numbers'])
+
+        # Entries already written to the logs table keep their timings
+        stats = query_log.template_stats(self.db.log.profiles(10))
+        self.assertIn(('SELECT * FROM numbers WHERE value > ?', 3), [stat[:2] for stat in stats])
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(query_log.percentile(values, 0.5), 50)
+        self.assertEqual(query_log.percentile(values, 0.95), 95)
+        self.assertEqual(query_log.percentile([7], 0.95), 7)
+
+    def test_migrate(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'old.db')
+            conn = sqlite3.connect(path)
+            conn.execute('''CREATE TABLE logs (message STRING NOT NULL)''')
+            conn.execute('''INSERT INTO logs VALUES ('SELECT 1')''')
+            conn.commit()
+            conn.close()
+
+            # Old logs tables get the new columns, and old entries are kept
+            db = Database(path=path)
+            db.execute('''SELECT 2''')
+            self.assertEqual(db.log.page(2), ['SELECT 1', 'SELECT 2'])
+            self.assertEqual([entry[0] for entry in db.log.profiles(2)], ['SELECT 2'])
+            db.__del__()
+
+    def test_in_memory_transaction(self):
+        self.db.execute('''CREATE TABLE numbers (value INTEGER)''')
+        self.db.commit()
+
+        # Entries made in a transaction wait for it to end, so rolling back doesn't lose them
+        self.db.begin()
+        for i in range(3):
+            self.db.execute('''INSERT INTO numbers VALUES (?)''', i)
+        self.db.rollback()
+        self.db.execute('''SELECT 1''')
+
+        messages = self.db.db.execute('''SELECT message FROM logs ORDER BY rowid DESC LIMIT 4''').fetchall()
+        self.assertEqual([row[0] for row in messages][::-1],
+            ['INSERT INTO numbers VALUES (0)', 'INSERT INTO numbers VALUES (1)',
+             'INSERT INTO numbers VALUES (2)', 'SELECT 1'])
+        self.assertEqual(self.db.execute('''SELECT count(*) FROM numbers'''), [(0,)])
+
+        # Writing them leaves no transaction open, so the next one isn't a savepoint
+        self.assertFalse(self.db.db.in_transaction)
+        with self.db.transaction():
+            self.db.execute('''INSERT INTO numbers VALUES (3)''')
+        self.assertFalse(self.db.db.in_transaction)
+
+    def test_pending_limit(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.db')
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.execute('''CREATE TABLE logs (message STRING NOT NULL, template STRING,
+                duration_ms REAL, row_count INTEGER, plan STRING)''')
+            conn.commit()
+            log = query_log.QueryLog(conn, path, batch_size=1000, flush_interval=60, pending_limit=5)
+
+            # Entries can't be written while another connection holds the database
+            lock = sqlite3.connect(path, isolation_level=None)
+            lock.execute('''BEGIN IMMEDIATE''')
+            for i in range(8):
+                log.append('SELECT {}'.format(i), duration_ms=1.0)
+            log.flush()
+
+            self.assertEqual(len(log.pending), 5)
+            self.assertEqual(log.page(10), ['SELECT {}'.format(i) for i in range(3, 8)])
+            self.assertEqual(len(log.profiles(10)), 5)
+
+            # Once it's free, a note of what was dropped is written with the rest
+            lock.execute('''COMMIT''')
+            lock.close()
+            log.flush()
+            self.assertEqual(log.page(10), ['[3 log entries dropped while the database was locked]'] +
+                ['SELECT {}'.format(i) for i in range(3, 8)])
+
+            log.close()
+            conn.close()
+
+    def test_in_memory(self):
+        for path in (':memory:', 'file::memory:?cache=shared', 'file:logs?mode=memory'):
+            self.assertTrue(query_log.in_memory(path))
+        self.assertFalse(query_log.in_memory('memory.db'))
+
+        # Logs are written on the database's own connection
+        log = query_log.QueryLog(self.db.db, ':memory:')
+        self.assertIs(log.writer, self.db.db)
+        self.assertIsNone(log.thread)
@@ -0,0 +1,56 @@
+import unittest
+
+from result_cache import ResultCache
+
+import sqlite3
+
+
+class TestResultCache(unittest.TestCase):
+
+    def test_lru(self):
+        rows = [(i, 'row {}'.format(i)) for i in range(10)]
+        cache = ResultCache()
+        cache.put('a', ['id', 'name'], rows, {'t'})
+        size = cache.size
+
+        # Room for four results, the least recently used goes first
+        cache = ResultCache(size * 4 + size // 2)
+        for key in 'abcd':
+            cache.put(key, ['id', 'name'], rows, {'t'})
+        self.assertIsNotNone(cache.get('a'))
+        cache.put('e', ['id', 'name'], rows, {'t'})
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a').rows, rows)
+        self.assertLessEqual(cache.size, cache.max_bytes)
+
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (2, 1, 1))
+
+        # Results too big for the cache aren't kept
+        self.assertFalse(cache.put('f', ['id', 'name'], rows * 2, {'t'}))
+
+    def test_invalidate(self):
+        cache = ResultCache()
+        cache.put('a', ['x'], [(1,)], {'Users'})
+        cache.put('b', ['x'], [(1,)], {'users', 'events'})
+        cache.put('c', ['x'], [(1,)], {'events'})
+
+        cache.invalidate('main.USERS')
+        self.assertEqual(list(cache.results), ['c'])
+        self.assertNotIn('users', cache.tables)
+
+        cache.clear()
+        self.assertEqual((cache.size, cache.stats()['invalidations']), (0, 3))
+
+    def test_reads(self):
+        conn = sqlite3.connect(':memory:')
+        conn.execute('''CREATE TABLE a (x INTEGER)''')
+        conn.execute('''CREATE TABLE b (y INTEGER)''')
+        conn.execute('''CREATE VIEW v AS SELECT y FROM b''')
+
+        with ResultCache().reads(conn) as tables:
+            conn.execute('''SELECT * FROM a JOIN v ON x = y''')
+
+        # Views count as the tables behind them too
+        self.assertEqual(tables, {'a', 'b', 'v'})
@@ -0,0 +1,98 @@
+import asyncio
+import io
+import unittest
+
+from client import Client, parse_address
+from server import Server
+
+import os
+import socket
+import tempfile
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'test.db')
+        self.address = os.path.join(self.directory.name, 'sqlos.sock')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    '''
+    Runs a function with clients connected to a server, the clients are used on another
+    thread so the server can keep going.
+    '''
+    def with_server(self, function, clients=2):
+        async def serve():
+            server = Server(self.path, self.address)
+            await server.start()
+            try:
+                return await asyncio.to_thread(self.run_clients, function, clients)
+            finally:
+                await server.close()
+
+        return asyncio.run(serve())
+
+    def run_clients(self, function, count):
+        clients = [Client(self.address, timeout=10) for i in range(count)]
+        try:
+            return function(*clients)
+        finally:
+            for client in clients:
+                client.close()
+
+    def run_command(self, client, line):
+        out = io.StringIO()
+        status = client.run(line, out)
+        return status, out.getvalue()
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address('localhost:7000'), (socket.AF_INET, ('localhost', 7000)))
+        self.assertEqual(parse_address(':7000'), (socket.AF_INET, ('localhost', 7000)))
+        self.assertEqual(parse_address('/tmp/sqlos.sock'), (socket.AF_UNIX, '/tmp/sqlos.sock'))
+
+    def test_sessions(self):
+        def clients(first, second):
+            self.assertEqual(self.run_command(first, 'dbx CREATE TABLE numbers (value INTEGER)'), (0, ''))
+            self.run_command(first, 'dbi numbers 1')
+
+            # Each session has its own transaction
+            self.run_command(first, 'database begin')
+            self.run_command(first, 'dbi numbers 2')
+            self.assertEqual(self.run_command(second, 'dbs numbers | count'), (0, 'count\n-----\n1\n'))
+            self.run_command(first, 'database commit')
+            self.assertEqual(self.run_command(second, 'dbs numbers | count'), (0, 'count\n-----\n2\n'))
+
+            # And its own aliases
+            self.run_command(first, 'alias nums dbs numbers')
+            self.assertEqual(self.run_command(first, 'nums | count'), (0, 'count\n-----\n2\n'))
+            self.assertEqual(self.run_command(second, 'nums'), (127, 'nums is not a command or alias.\n'))
+
+            # Lines starting with `.` come through as they are
+            self.assertEqual(self.run_command(first, 'dbx SELECT \'.hidden\' AS name'),
+                (0, 'name\n-------\n.hidden\n'))
+
+            self.assertEqual(self.run_command(second, 'exit'), (0, ''))
+            with self.assertRaises(ConnectionError):
+                second.run('dbs numbers', io.StringIO())
+
+        self.with_server(clients)
+        self.assertFalse(os.path.exists(self.address))
+
+    def test_rollback_on_disconnect(self):
+        def begin(client):
+            self.run_command(client, 'dbx CREATE TABLE numbers (value INTEGER)')
+            self.run_command(client, 'database begin')
+            self.run_command(client, 'dbi numbers 1')
+
+        def count(client):
+            return self.run_command(client, 'dbs numbers | count')
+
+        self.with_server(begin, clients=1)
+        self.assertEqual(self.with_server(count, clients=1), (0, 'count\n-----\n0\n'))
+
+    def test_memory(self):
+        with self.assertRaises(ValueError):
+            Server(':memory:')
@@ -0,0 +1,126 @@
+import unittest
+
+import sql_parser
+
+class TestSqlParser(unittest.TestCase):
+    def test_classify(self):
+        statement = sql_parser.classify('''CREATE TABLE IF NOT EXISTS users (username STRING)''')
+        self.assertEqual((statement.kind, statement.verb, statement.object, statement.table),
+            ('DDL', 'CREATE', 'TABLE', 'users'))
+
+        statement = sql_parser.classify('''DROP INDEX users_name''')
+        self.assertEqual((statement.kind, statement.object, statement.table),
+            ('DDL', 'INDEX', 'users_name'))
+
+        statement = sql_parser.classify('''INSERT OR REPLACE INTO "users" VALUES (?, ?)''')
+        self.assertEqual((statement.kind, statement.table), ('DML', 'users'))
+
+        statement = sql_parser.classify('''select created_at from events where id = ?''')
+        self.assertEqual((statement.kind, statement.verb, statement.table), ('QUERY', 'SELECT', 'events'))
+
+    def test_format_log(self):
+        template = sql_parser.classify('''INSERT INTO users VALUES (?, ?)''').log_template
+
+        self.assertEqual(sql_parser.format_log(template, ('a', 1)), 'INSERT INTO users VALUES (a, 1)')
+        self.assertEqual(sql_parser.format_log(template, ('a',)), 'INSERT INTO users VALUES (a, ?)')
+
+    def test_normalize(self):
+        self.assertEqual(sql_parser.normalize('''SELECT * FROM users WHERE id = 5 AND name = 'bob' '''),
+            'SELECT * FROM users WHERE id = ? AND name = ?')
+        self.assertEqual(sql_parser.classify('''SELECT a FROM t WHERE b IN (1, 2, 3)''').template,
+            sql_parser.classify('''SELECT a FROM t WHERE b IN (4)''').template)
+
+    def test_cache_key(self):
+        self.assertEqual(sql_parser.cache_key('''select *
+            from users -- everyone
+            where name = 'Bob' '''), "SELECT * FROM USERS WHERE NAME = 'Bob'")
+        self.assertIsNone(sql_parser.cache_key('''SELECT random()'''))
+        self.assertIsNone(sql_parser.cache_key('''DELETE FROM users'''))
+        self.assertIsNone(sql_parser.cache_key('''WITH old AS (SELECT id FROM users) DELETE FROM users
+            WHERE id IN old'''))
+        self.assertIsNotNone(sql_parser.cache_key('''WITH old AS (SELECT id FROM users) SELECT * FROM old'''))
+
+    def test_classify_with(self):
+        statement = sql_parser.classify('''WITH RECURSIVE old(id) AS (SELECT id FROM users
+            WHERE (seen < 5)), other AS NOT MATERIALIZED (VALUES (1)) DELETE FROM "users" WHERE id IN old''')
+        self.assertEqual((statement.kind, statement.verb, statement.table), ('DML', 'DELETE', 'users'))
+
+        statement = sql_parser.classify('''WITH old AS (DELETE) SELECT * FROM old''')
+        self.assertEqual((statement.kind, statement.verb), ('QUERY', 'SELECT'))
+
+    def test_query_columns(self):
+        self.assertEqual(sql_parser.query_columns('''SELECT * FROM events WHERE user_id = ? AND
+            e.created > ? ORDER BY created DESC, "kind" COLLATE nocase'''),
+            (['user_id'], ['created'], ['created', 'kind']))
+
+        # Joins and subqueries aren't understood
+        self.assertIsNone(sql_parser.query_columns('''SELECT * FROM a JOIN b ON a.id = b.id'''))
+
+    def test_parse_insert_values(self):
+        values = sql_parser.parse_insert_values('''(name, "created at") VALUES (bob, datetime('now', -1)),
+            ('it''s', CURRENT_TIMESTAMP), (2.5, NULL)''')
+
+        self.assertEqual(values.columns, ('name', 'created at'))
+        self.assertEqual(values.rows, [(('?', ('bob',)), ('datetime(?, ?)', ('now', -1))),
+            (('?', ("it's",)), ('CURRENT_TIMESTAMP', ())), (('?', (2.5,)), ('?', (None,)))])
+
+        # Rows next to each other are grouped by the SQL of their values
+        self.assertEqual(sql_parser.compile_insert(values.rows), [
+            (('?', 'datetime(?, ?)'), [('bob', 'now', -1)]),
+            (('?', 'CURRENT_TIMESTAMP'), [("it's",)]),
+            (('?', '?'), [(2.5, None)]),
+        ])
+
+        # Constants are bound, so they don't split rows up
+        values = sql_parser.parse_insert_values('''VALUES (1, a), (2, NULL), (3, TRUE), (4, date(x)), (5, c)''')
+        self.assertEqual(sql_parser.compile_insert(values.rows), [
+            (('?', '?'), [(1, 'a'), (2, None), (3, 1)]),
+            (('?', 'date(?)'), [(4, 'x')]),
+            (('?', '?'), [(5, 'c')]),
+        ])
+
+        self.assertEqual(sql_parser.parse_insert_value('''upper('a')'''), ('upper(?)', ('a',)))
+        with self.assertRaises(ValueError):
+            sql_parser.parse_insert_value('''load_extension('evil')''')
+        with self.assertRaises(ValueError):
+            sql_parser.parse_insert_values('''VALUES (a); DROP TABLE users''')
+
+    def test_parse_update(self):
+        update = sql_parser.parse_update('''SET name = bob, seen = datetime('now') WHERE id > 5 AND name != 'it''s' ''')
+
+        self.assertEqual(update.assignments, (('name', ('?', ('bob',))), ('seen', ('datetime(?)', ('now',)))))
+        self.assertEqual(update.where, "id > 5 AND name != 'it''s'")
+        self.assertIsNone(sql_parser.parse_update('''SET a = 1''').where)
+
+        with self.assertRaises(ValueError):
+            sql_parser.parse_update('''SET a = 1 b = 2''')
+
+    def test_tokenize(self):
+        tokens = sql_parser.tokenize('''a.b >= 'it''s' -- comment
+            /* block */ "quoted name" 1.5e3''')
+
+        self.assertListEqual(tokens, [('word', 'a'), ('op', '.'), ('word', 'b'), ('op', '>='),
+            ('string', "'it''s'"), ('quoted', '"quoted name"'), ('number', '1.5e3')])
+
+    def test_parse_create_table(self):
+        table = sql_parser.parse_create_table('''CREATE TABLE IF NOT EXISTS prices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            amount DECIMAL(10, 2) NOT NULL DEFAULT -1 CHECK (amount >= 0),
+            created TEXT DEFAULT (datetime('now')),
+            owner INTEGER,
+            UNIQUE (owner),
+            FOREIGN KEY (owner) REFERENCES users(id)
+        )''')
+
+        self.assertEqual(table.name, 'prices')
+        self.assertTrue(table.if_not_exists)
+        self.assertEqual(table.primary_key, ('id',))
+        self.assertEqual(table.constraints, ('FOREIGN KEY(owner) REFERENCES users(id)',))
+
+        _id, amount, created, owner = table.columns
+        self.assertTrue(_id.primary_key)
+        self.assertEqual((amount.type, amount.type_params, amount.not_null, amount.default),
+            ('DECIMAL', ('10', '2'), True, '-1'))
+        self.assertEqual(amount.constraints, ('CHECK(amount >= 0)',))
+        self.assertEqual(created.default, "(datetime('now'))")
+        self.assertTrue(owner.unique)
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+
+from database import Database
+import transfer
+
+class TestTransfer(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(_type='memory')
+        self.db.execute('''CREATE TABLE users (username STRING, age INTEGER)''')
+        self.db.insert_many('users', [('alice', 30), ('bob', None), ('carol', 41)])
+
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.db.__del__()
+        del self.db
+
+        self.dir.cleanup()
+
+    def test_detect_format(self):
+        self.assertEqual(transfer.detect_format('users.csv'), ('csv', False))
+        self.assertEqual(transfer.detect_format('users.jsonl.gz'), ('jsonl', True))
+        self.assertEqual(transfer.detect_format('users.txt'), (None, False))
+
+    def test_choose_format(self):
+        self.assertEqual(transfer.choose_format('users.txt', ['--format', 'CSV', '--gzip']), ('csv', True))
+        for options in ([], ['--format'], ['--format', 'xml']):
+            with self.assertRaises(ValueError):
+                transfer.choose_format('users.txt', options)
+
+    def round_trip(self, name):
+        path = os.path.join(self.dir.name, name)
+        fmt, compressed = transfer.detect_format(path)
+
+        rows = self.db.stream('''SELECT * FROM users''')
+        with transfer.open_file(path, 'w', compressed) as f:
+            self.assertEqual(transfer.write_rows(f, rows, rows.columns, fmt), 3)
+
+        self.db.execute('''CREATE TABLE copy (username STRING, age INTEGER)''')
+        with transfer.open_file(path, 'r', compressed) as f:
+            columns, rows = transfer.read_rows(f, fmt)
+            self.assertEqual(columns, ['username', 'age'])
+            self.assertEqual(self.db.insert_many('copy', rows, columns=columns), 3)
+
+        return self.db.execute('''SELECT * FROM copy''')
+
+    def test_quoted_columns(self):
+        path = os.path.join(self.dir.name, 'orders.csv')
+        with open(path, 'w') as f:
+            f.write('order,first name,"say ""hi"""\n1,bob,hello\n')
+
+        self.db.execute('''CREATE TABLE orders ("order" INTEGER, "first name" STRING, "say ""hi""" STRING)''')
+        with transfer.open_file(path, 'r') as f:
+            columns, rows = transfer.read_rows(f, 'csv')
+            self.assertEqual(self.db.insert_many('orders', rows, columns=columns), 1)
+
+        self.assertEqual(self.db.update_many('orders', ['first name'], ['order'], [('alice', 1)]), 1)
+        self.assertEqual(self.db.execute('''SELECT * FROM orders'''), [(1, 'alice', 'hello')])
+        self.assertEqual(self.db.delete_many('orders', ['say "hi"'], [('hello',)]), 1)
+
+    def test_csv(self):
+        # CSV has no NULL, it comes back as an empty string
+        self.assertListEqual(self.round_trip('users.csv.gz'), [('alice', 30), ('bob', ''), ('carol', 41)])
+
+    def test_jsonl(self):
+        self.assertListEqual(self.round_trip('users.jsonl'), [('alice', 30), ('bob', None), ('carol', 41)])
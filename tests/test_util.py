@@ -3,6 +3,15 @@ import unittest
 import util
 from termcolor import colored, cprint
 
+import sys
+
+
+def get_stdout():
+    out = sys.stdout.getvalue()
+    sys.stdout.truncate(0)
+    sys.stdout.seek(0)
+    return out
+
 class TestUtil(unittest.TestCase):
     def setUp(self):
         pass
@@ -18,6 +27,20 @@ class TestUtil(unittest.TestCase):
     
     def test_pretty_print_dict(self):
         pass
+
+    def test_pretty_print_table(self):
+        # Only the first two rows are used for the widths, so the last is truncated
+        rows = iter([(1, 'alice'), (2, None), (3, 'bartholomew')])
+        count = util.pretty_print_table(rows, ['id', 'name'], sample_size=2)
+
+        self.assertEqual(count, 3)
+        self.assertEqual(get_stdout(), '\n'.join([
+            'id  name',
+            '--  -----',
+            '1   alice',
+            '2   NULL',
+            '3   ba...',
+        ]) + '\n')
     
     def test_str_replace_index(self):
-        pass
\ No newline at end of file
+        pass
@@ -0,0 +1,175 @@
+import contextlib
+import csv
+import gzip
+import json
+import sys
+
+'''
+Moves rows between tables and files. Everything here works on iterators, so rows flow
+from the database to the file (or the other way around) one at a time and a table of any
+size can be moved without holding it in memory.
+Supported formats:
+csv -> Comma separated values, with the column names as the first row
+jsonl -> One JSON object per line, keyed by column name
+Either format can be gzip compressed.
+'''
+
+FORMATS = ('csv', 'jsonl')
+# Number of rows between progress reports
+PROGRESS_INTERVAL = 10000
+
+'''
+Works out the format of a file from its extension, e.g. `users.csv.gz` is gzipped CSV.
+@param path Path of the file
+@return Tuple of the format and whether the file is gzipped. The format is None if
+    it couldn't be worked out.
+'''
+def detect_format(path):
+    compressed = path.endswith('.gz')
+    if compressed:
+        path = path[:-3]
+
+    extension = path.rsplit('.', 1)[-1].lower()
+    if extension == 'ndjson':
+        extension = 'jsonl'
+
+    return (extension if extension in FORMATS else None), compressed
+
+'''
+Works out the format of a file from its extension and any options the user gave.
+@param path Path of the file
+@param options List of options, which can include `--format csv|jsonl` and `--gzip`
+@return Tuple of the format and whether the file is gzipped
+@throws ValueError if the format couldn't be worked out or isn't supported
+'''
+def choose_format(path, options):
+    fmt, compressed = detect_format(path)
+
+    if '--format' in options:
+        index = options.index('--format')
+        if index + 1 >= len(options):
+            raise ValueError('--format needs one of: {}'.format(', '.join(FORMATS)))
+        fmt = options[index+1].lower()
+    if '--gzip' in options:
+        compressed = True
+
+    if fmt is None:
+        raise ValueError('Unknown format for {}. Use --format with one of: {}'.format(path,
+            ', '.join(FORMATS)))
+    if fmt not in FORMATS:
+        raise ValueError('Unknown format `{}`. Expected one of: {}'.format(fmt, ', '.join(FORMATS)))
+
+    return fmt, compressed
+
+'''
+Opens a file for reading or writing rows.
+@param path Path of the file
+@param mode Either 'r' or 'w'
+@param compressed Whether the file is gzipped
+@return Text file object
+'''
+def open_file(path, mode, compressed=False):
+    if compressed:
+        return gzip.open(path, mode + 't', newline='', encoding='utf-8')
+
+    return open(path, mode, newline='', encoding='utf-8')
+
+'''
+Opens a file to read rows from, or stdin.
+@param path Path of the file, `-` to read stdin
+@return Context manager giving the file object. Stdin is left open afterwards.
+'''
+@contextlib.contextmanager
+def open_input(path):
+    if path == '-':
+        yield sys.stdin
+        return
+
+    with open(path, newline='') as f:
+        yield f
+
+'''
+Reads CSV rows from a file as they're needed.
+@param f File object to read from
+@return Generator of rows, each a list of strings
+'''
+def csv_rows(f):
+    # Blank lines come out of the reader as empty rows
+    return (row for row in csv.reader(f) if row)
+
+'''
+Writes rows to a file.
+@param f File object to write to
+@param rows Iterable of rows
+@param columns Names of the columns, in the same order as the values in each row
+@param fmt Format to write, one of `FORMATS`
+@return Number of rows written
+'''
+def write_rows(f, rows, columns, fmt):
+    count = 0
+
+    if fmt == 'csv':
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    elif fmt == 'jsonl':
+        for row in rows:
+            f.write(json.dumps(dict(zip(columns, row))))
+            f.write('\n')
+            count += 1
+    else:
+        raise ValueError('Unknown format `{}`. Expected one of: {}'.format(fmt, ', '.join(FORMATS)))
+
+    return count
+
+'''
+Reads rows from a file. The column names are read straight away, the rows are read as
+they're needed.
+@param f File object to read from
+@param fmt Format to read, one of `FORMATS`
+@return Tuple of the column names and a generator of rows
+'''
+def read_rows(f, fmt):
+    if fmt == 'csv':
+        rows = csv_rows(f)
+
+        return next(rows, []), rows
+    elif fmt == 'jsonl':
+        objects = (json.loads(line) for line in f if line.strip())
+        first = next(objects, None)
+        if first is None:
+            return [], iter(())
+
+        columns = list(first)
+
+        return columns, json_rows(first, objects, columns)
+    else:
+        raise ValueError('Unknown format `{}`. Expected one of: {}'.format(fmt, ', '.join(FORMATS)))
+
+'''
+Turns JSON objects into rows, with the values in column order. Missing keys become NULL.
+@param first The first object, already read to find the columns
+@param objects The rest of the objects
+@param columns Names of the columns
+'''
+def json_rows(first, objects, columns):
+    yield tuple(first.get(column) for column in columns)
+    for obj in objects:
+        yield tuple(obj.get(column) for column in columns)
+
+'''
+Passes rows through unchanged, calling `report` with the number of rows seen so far
+every `interval` rows.
+@param rows Iterable of rows
+@param report Function to call with the current count
+@param interval Number of rows between reports
+'''
+def progress(rows, report, interval=PROGRESS_INTERVAL):
+    count = 0
+    for row in rows:
+        yield row
+        count += 1
+        if count % interval == 0:
+            report(count)
@@ -1,5 +1,11 @@
 from termcolor import colored, cprint
 import functools
+import itertools
+
+# Number of rows used to work out column widths when printing a table
+TABLE_SAMPLE_SIZE = 100
+# Widest a column can be when printing a table, longer values are truncated
+TABLE_MAX_WIDTH = 40
 
 # Public functions
 # These functions are meant to be imported and called
@@ -8,11 +14,18 @@ Takes a message and passes it to one of the printing functions to
 depending on the type of the message.
 Variable printing utilities:
 dictionary -> @see pretty_print_dict
+list of rows -> @see pretty_print_table
+list -> @see pretty_print_list
 @param message The message to pretty print
 '''
 def pretty_print(message):
     if type(message) == dict:
         pretty_print_dict(message)
+    elif type(message) in (list, tuple):
+        if message and all(type(i) in (list, tuple) for i in message):
+            pretty_print_table(message)
+        else:
+            pretty_print_list(message)
     else:
         raise NotImplementedError('Still working on pretty printing.')
 
@@ -44,6 +57,87 @@ def pretty_print_dict(arg_dict, padding=4):
     for key in sorted(arg_dict.keys()):
         print(template.format(key, arg_dict[key]))
 
+'''
+Prints each item of a list on its own line.
+'''
+def pretty_print_list(arg_list):
+    for item in arg_list:
+        print(item)
+
+'''
+Prints rows as a table. The column widths are worked out from the headers and the first
+`sample_size` rows only, so printing starts straight away no matter how many rows there are.
+Rows after the sample are printed as they come, with any value too wide for its column
+truncated. Values are never wider than `max_width`.
+@param rows Iterable of rows, e.g. the result of `Database.stream`
+@param headers (optional) Names of the columns
+@param sample_size Number of rows used to work out the column widths
+@param max_width Widest a column can be
+@param page_size (optional) Number of rows to print before waiting for the user to continue
+@param padding Number of spaces between columns
+@param ask Function asking the user whether to carry on after each page
+@return Number of rows printed
+'''
+def pretty_print_table(rows, headers=None, sample_size=TABLE_SAMPLE_SIZE, max_width=TABLE_MAX_WIDTH,
+        page_size=None, padding=2, ask=input):
+    rows = iter(rows)
+    sample = [[format_cell(cell) for cell in row] for row in itertools.islice(rows, sample_size)]
+
+    widths = [len(str(header)) for header in headers or []]
+    for row in sample:
+        # Pad out the widths for rows wider than the headers
+        widths.extend([0] * (len(row) - len(widths)))
+        for i, cell in enumerate(row):
+            if len(cell) > widths[i]:
+                widths[i] = len(cell)
+    widths = [min(width, max_width) for width in widths]
+
+    separator = ' ' * padding
+    def print_row(row):
+        print(separator.join(truncate(cell, width).ljust(width)
+            for cell, width in zip(row, widths)).rstrip())
+
+    if headers:
+        print_row([str(header) for header in headers])
+        print_row(['-' * width for width in widths])
+
+    count = 0
+    for row in itertools.chain(sample, ([format_cell(cell) for cell in row] for row in rows)):
+        print_row(row)
+        count += 1
+
+        if page_size and count % page_size == 0:
+            try:
+                answer = ask('-- More -- (enter to continue, q to stop) ')
+            except EOFError:
+                # Nobody to ask, e.g. the rest of a script is the input
+                break
+            if answer.strip().lower() == 'q':
+                break
+
+    return count
+
+'''
+Turns a value from the database into the text shown in a table.
+'''
+def format_cell(cell):
+    if cell is None:
+        return 'NULL'
+
+    return str(cell).replace('\n', ' ')
+
+'''
+Shortens text to fit a width, marking that it was cut off.
+'''
+def truncate(text, width):
+    if len(text) <= width:
+        return text
+
+    if width < 4:
+        return text[:width]
+
+    return text[:width-3] + '...'
+
 '''
 Replace nth number in a string
 '''
@@ -57,4 +151,4 @@ def str_replace_index(string, substring, replace, index):
     if i == index:
         return string[:find]+replace+string[find+len(substring):]
     
-    return string
\ No newline at end of file
+    return string